@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+
+""" What was fetched of each article URL by earlier crawls, kept in a sqlite database.
+
+    For each URL, the ETag and Last-Modified headers of its last response, sent back as
+    If-None-Match and If-Modified-Since so an unchanged page costs a 304 and no body,
+    and the hash and date of the DocItem extracted from it, so an item whose content is
+    unchanged is not passed on again. See IncrementalCrawl in middlewares.py.
+"""
+
+import sqlite3
+import hashlib
+import json
+import time
+
+# Fields of a DocItem that are its content; session_id differs every crawl
+CONTENT_FIELDS = ('link', 'title', 'date', 'body')
+
+# Writes between commits, and at close
+COMMIT_EVERY = 100
+
+def contentHash(item):
+    """ Return the sha1 of the content of item
+    """
+    return hashlib.sha1(json.dumps([item.get(field) for field in CONTENT_FIELDS])).hexdigest()
+
+def itemDate(item):
+    date = item.get('date')
+    if date and not isinstance(date, basestring):
+        date = date[0]
+    return date or None
+
+class CrawlState():
+    """ Crawl state database fileName, created if need be
+    """
+
+    def __init__(self, fileName):
+        self.fileName = fileName
+        self.db = sqlite3.connect(fileName)
+        self.db.row_factory = sqlite3.Row
+        self.db.execute("CREATE TABLE IF NOT EXISTS pages (url TEXT PRIMARY KEY, etag TEXT, "
+                        "last_modified TEXT, content_hash TEXT, date TEXT, fetched REAL)")
+        self.db.commit()
+        self.writes = 0
+
+    def __len__(self):
+        return self.db.execute("SELECT COUNT(*) FROM pages").fetchone()[0]
+
+    def get(self, url):
+        """ Return the row of url, with etag, last_modified, content_hash, date and fetched, or None
+        """
+        return self.db.execute("SELECT * FROM pages WHERE url = ?", (url,)).fetchone()
+
+    def record(self, url, etag, lastModified, item):
+        """ Record the headers of the latest response for url, and the item extracted from it
+        """
+        self.db.execute("INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?, ?, ?)",
+                        (url, etag, lastModified, contentHash(item), itemDate(item), time.time()))
+        self.wrote()
+
+    def touch(self, url):
+        """ Record that url was found not modified
+        """
+        self.db.execute("UPDATE pages SET fetched = ? WHERE url = ?", (time.time(), url))
+        self.wrote()
+
+    def wrote(self):
+        self.writes += 1
+        if self.writes % COMMIT_EVERY == 0:
+            self.db.commit()
+
+    def close(self):
+        self.db.commit()
+        self.db.close()
@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+
+""" Exact and near duplicate detection of article bodies, see DedupPipeline in pipelines.py.
+
+    A body is normalized to its lowercase words. Bodies with the same words are exact
+    duplicates, found by the sha1 of the words. Otherwise a body is a near duplicate of
+    an earlier one if the Jaccard similarity of their sets of word shingles, estimated
+    from MinHash signatures, is at least a threshold. Candidates are found with an
+    in-memory LSH index: signatures are cut into bands, and bodies sharing any band are
+    compared.
+
+    The exact hash and signature of each body kept can also be saved to a sqlite
+    database, a DedupState, and read back into the index by the next crawl. An
+    incremental crawl does not pass on the articles it kept before, so without them
+    the duplicates of those articles would be let through.
+"""
+
+import array
+import hashlib
+import json
+import random
+import sqlite3
+import zlib
+
+# Largest prime below 2^32, so each MinHash value fits an unsigned int
+PRIME = 4294967291
+
+# Writes between commits of a DedupState, and at close
+COMMIT_EVERY = 100
+
+def words(body):
+    """ Return the lowercase words of body, a list of paragraphs
+    """
+    return u" ".join(body).lower().split()
+
+def exactHash(tokens):
+    return hashlib.sha1(u" ".join(tokens).encode('utf-8')).digest()
+
+def shingleHashes(tokens, size):
+    """ Return the set of crc32s of each run of size words of tokens, or of all of them if fewer
+    """
+    last = max(1, len(tokens) - size + 1)
+    return set(zlib.crc32(u" ".join(tokens[i:i + size]).encode('utf-8')) & 0xffffffff for i in xrange(last))
+
+class DedupIndex():
+    """ Bodies seen so far, by exact hash and by LSH bands of their MinHash signatures.
+
+        Each body added is given a key, such as its link, reported as the original of
+        later duplicates.
+    """
+
+    def __init__(self, threshold=0.8, shingleSize=5, permutations=128, bands=32, seed=0):
+        if permutations % bands:
+            raise ValueError('{0} permutations do not split into {1} bands'.format(permutations, bands))
+        self.threshold = threshold
+        self.shingleSize = shingleSize
+        self.rows = permutations / bands
+
+        r = random.Random(seed)
+        self.perms = [(r.randint(1, PRIME - 1), r.randint(0, PRIME - 1)) for i in xrange(permutations)]
+
+        self.exact = {}         # exact hash: key
+        self.buckets = {}       # (band, band values): [keys]
+        self.signatures = {}    # key: signature
+        self.digests = {}       # key: exact hash
+        self.state = None
+
+        # Signatures saved by one crawl are only comparable with those of the same
+        # shingles and permutations
+        self.params = {'shingleSize': shingleSize, 'permutations': permutations, 'seed': seed}
+
+    def __len__(self):
+        return len(self.exact)
+
+    def signature(self, hashes):
+        return array.array('I', [min((a * h + b) % PRIME for h in hashes) for a, b in self.perms])
+
+    def similarity(self, sig1, sig2):
+        """ Return the estimated Jaccard similarity of the shingles of two signatures
+        """
+        return sum(1 for x, y in zip(sig1, sig2) if x == y) / float(len(sig1))
+
+    def bandKeys(self, sig):
+        rows = self.rows
+        return [(i, sig[i * rows:(i + 1) * rows].tostring()) for i in xrange(len(sig) / rows)]
+
+    def add(self, key, body):
+        """ Return (kind, original) if body duplicates one added before, kind 'exact' or 'near',
+            otherwise add body under key and return None
+
+            A body is never a duplicate of the one added under its own key, which it
+            replaces, as when an article has changed since the last crawl.
+        """
+        tokens = words(body)
+        digest = exactHash(tokens)
+        if self.exact.get(digest, key) != key:
+            return 'exact', self.exact[digest]
+
+        sig = self.signature(shingleHashes(tokens, self.shingleSize))
+        compared = set([key])
+        for band in self.bandKeys(sig):
+            for other in self.buckets.get(band, ()):
+                if other not in compared:
+                    compared.add(other)
+                    if self.similarity(sig, self.signatures[other]) >= self.threshold:
+                        return 'near', other
+
+        self.insert(key, digest, sig)
+        if self.state is not None:
+            self.state.record(key, digest, sig)
+        return None
+
+    def insert(self, key, digest, sig):
+        """ Add the body of exact hash digest and signature sig under key, in place of any before
+        """
+        if key in self.signatures:
+            self.remove(key)
+        self.exact[digest] = key
+        self.digests[key] = digest
+        self.signatures[key] = sig
+        for band in self.bandKeys(sig):
+            self.buckets.setdefault(band, []).append(key)
+
+    def remove(self, key):
+        sig = self.signatures.pop(key)
+        digest = self.digests.pop(key)
+        if self.exact.get(digest) == key:
+            del self.exact[digest]
+        for band in self.bandKeys(sig):
+            self.buckets[band].remove(key)
+            if not self.buckets[band]:
+                del self.buckets[band]
+
+    def attach(self, state):
+        """ Read the bodies saved in DedupState state, and save those added from now on to it
+        """
+        state.checkParams(self.params)
+        for key, digest, sig in state.iterBodies():
+            self.insert(key, digest, sig)
+        self.state = state
+
+class DedupState():
+    """ Dedup database fileName of the bodies kept by earlier crawls, created if need be
+    """
+
+    def __init__(self, fileName):
+        self.fileName = fileName
+        self.db = sqlite3.connect(fileName)
+        self.db.execute("CREATE TABLE IF NOT EXISTS params (params TEXT)")
+        self.db.execute("CREATE TABLE IF NOT EXISTS bodies (key TEXT PRIMARY KEY, exact BLOB, signature BLOB)")
+        self.db.commit()
+        self.writes = 0
+
+    def __len__(self):
+        return self.db.execute("SELECT COUNT(*) FROM bodies").fetchone()[0]
+
+    def checkParams(self, params):
+        """ Record params of the signatures, or raise ValueError if they differ from those recorded
+        """
+        row = self.db.execute("SELECT params FROM params").fetchone()
+        if row is None:
+            self.db.execute("INSERT INTO params VALUES (?)", (json.dumps(params, sort_keys=True),))
+            self.db.commit()
+        elif json.loads(row[0]) != params:
+            raise ValueError('{0} holds signatures of {1}, not {2}. Remove it or give DEDUP_STATE another path'.format(
+                             self.fileName, row[0], json.dumps(params, sort_keys=True)))
+
+    def iterBodies(self):
+        """ Yield (key, exact hash, signature) of each body
+        """
+        for key, digest, blob in self.db.execute("SELECT key, exact, signature FROM bodies"):
+            sig = array.array('I')
+            sig.fromstring(str(blob))
+            yield key, str(digest), sig
+
+    def record(self, key, digest, sig):
+        self.db.execute("INSERT OR REPLACE INTO bodies VALUES (?, ?, ?)",
+                        (key, buffer(digest), buffer(sig.tostring())))
+        self.writes += 1
+        if self.writes % COMMIT_EVERY == 0:
+            self.db.commit()
+
+    def close(self):
+        self.db.commit()
+        self.db.close()
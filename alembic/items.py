@@ -18,4 +18,5 @@ class DocItem(scrapy.Item):
     link = scrapy.Field()
     date = scrapy.Field()
     body = scrapy.Field()
+    duplicate_of = scrapy.Field()    # link of the item this duplicates, see DedupPipeline
     
\ No newline at end of file
@@ -0,0 +1,297 @@
+# -*- coding: utf-8 -*-
+
+# Define your downloader and spider middlewares here
+#
+# Don't forget to add your middleware to the DOWNLOADER_MIDDLEWARES or SPIDER_MIDDLEWARES setting
+# See: http://doc.scrapy.org/en/latest/topics/downloader-middleware.html
+# and: http://doc.scrapy.org/en/latest/topics/spider-middleware.html
+
+import time
+import urlparse
+from twisted.internet import task
+import scrapy
+from scrapy import log, signals
+from scrapy.exceptions import NotConfigured
+from alembic.crawlstate import CrawlState, contentHash
+
+
+class DomainState(object):
+    """
+    What the throttle has seen of one download slot, normally one domain
+    """
+
+    def __init__(self):
+        self.pages = 0
+        self.errors = 0
+        self.successes = 0          # in a row, since concurrency last changed
+        self.latency = None         # moving average, seconds
+        self.minLatency = None
+        self.crawlDelay = 0         # from robots.txt
+
+
+class PoliteThrottle(object):
+    """
+    Adapt the delay and concurrency of each domain to how its server responds.
+
+    Each run of THROTTLE_SPEEDUP_AFTER successful responses (times the concurrency)
+    allows one more concurrent request to a domain, up to THROTTLE_MAX_CONCURRENCY,
+    unless its latency has grown past THROTTLE_LATENCY_FACTOR times the best seen,
+    when one fewer is allowed. The delay between requests follows the latency divided
+    by the concurrency. A 429 or 503 response, or a download error, halves the
+    concurrency and doubles the delay, to at least any Retry-After given.
+
+    Delays stay within THROTTLE_MIN_DELAY and THROTTLE_MAX_DELAY, and never below the
+    Crawl-delay of the domain's robots.txt, which also holds it to one request at a
+    time. robots.txt is read as it passes through, fetched with ROBOTSTXT_OBEY.
+
+    Pages per second, overall and by domain, are logged every THROTTLE_REPORT_INTERVAL
+    seconds and when the spider closes, and kept in the crawl stats.
+    """
+
+    def __init__(self, crawler):
+        settings = crawler.settings
+        if not settings.getbool('THROTTLE_ENABLED', True):
+            raise NotConfigured
+        self.crawler = crawler
+        self.minDelay = settings.getfloat('THROTTLE_MIN_DELAY', 0.25)
+        self.maxDelay = settings.getfloat('THROTTLE_MAX_DELAY', 60)
+        self.maxConcurrency = settings.getint('THROTTLE_MAX_CONCURRENCY', 8)
+        self.speedUpAfter = settings.getint('THROTTLE_SPEEDUP_AFTER', 5)
+        self.latencyFactor = settings.getfloat('THROTTLE_LATENCY_FACTOR', 3)
+        self.reportInterval = settings.getfloat('THROTTLE_REPORT_INTERVAL', 60)
+        self.agent = settings.get('USER_AGENT', '').split('/')[0].lower()
+        self.domains = {}
+        self.started = None
+        self.reporter = None
+        crawler.signals.connect(self.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(self.spider_closed, signal=signals.spider_closed)
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(crawler)
+
+    def spider_opened(self, spider):
+        self.started = time.time()
+        if self.reportInterval > 0:
+            self.reporter = task.LoopingCall(self.report, spider)
+            self.reporter.start(self.reportInterval, now=False)
+
+    def spider_closed(self, spider, reason):
+        if self.reporter and self.reporter.running:
+            self.reporter.stop()
+        self.report(spider)
+
+    def getSlot(self, request):
+        key = request.meta.get('download_slot')
+        if key not in self.domains:
+            self.domains[key] = DomainState()
+        return self.domains[key], self.crawler.engine.downloader.slots.get(key)
+
+    def process_response(self, request, response, spider):
+        state, slot = self.getSlot(request)
+        state.pages += 1
+
+        if urlparse.urlparse(response.url).path == '/robots.txt' and response.status == 200:
+            state.crawlDelay = self.crawlDelay(response.body)
+            if state.crawlDelay:
+                log.msg("robots.txt of {0} asks for Crawl-delay {1}".format(request.meta.get('download_slot'), state.crawlDelay), level=log.INFO)
+
+        if slot is None:
+            return response
+        if response.status in (429, 503):
+            self.slowDown(state, slot, self.retryAfter(response))
+        elif response.status >= 500:
+            self.slowDown(state, slot)
+        else:
+            self.speedUp(state, slot, request.meta.get('download_latency'))
+        return response
+
+    def process_exception(self, request, exception, spider):
+        state, slot = self.getSlot(request)
+        if slot is not None:
+            self.slowDown(state, slot)
+
+    def speedUp(self, state, slot, latency):
+        if latency is None:
+            return
+        if state.latency is None:
+            state.latency = latency
+        else:
+            state.latency = 0.7 * state.latency + 0.3 * latency
+        state.minLatency = latency if state.minLatency is None else min(state.minLatency, latency)
+        state.successes += 1
+
+        if state.crawlDelay:
+            slot.concurrency = 1
+        elif state.latency > self.latencyFactor * state.minLatency and slot.concurrency > 1:
+            # Server is slowing under our requests
+            slot.concurrency -= 1
+            state.successes = 0
+        elif state.successes >= self.speedUpAfter * slot.concurrency and slot.concurrency < self.maxConcurrency:
+            slot.concurrency += 1
+            state.successes = 0
+
+        # Move half way to the delay that keeps the concurrent requests busy
+        target = state.latency / slot.concurrency
+        slot.delay = self.limitDelay(state, (slot.delay + target) / 2)
+
+    def slowDown(self, state, slot, retryAfter=0):
+        state.errors += 1
+        state.successes = 0
+        slot.concurrency = max(1, slot.concurrency // 2)
+        slot.delay = self.limitDelay(state, max(slot.delay * 2, self.minDelay * 2, retryAfter))
+
+    def limitDelay(self, state, delay):
+        return min(self.maxDelay, max(self.minDelay, state.crawlDelay, delay))
+
+    def retryAfter(self, response):
+        """
+        Return seconds of the Retry-After header of response, or 0
+        """
+        try:
+            return float(response.headers.get('Retry-After', 0))
+        except ValueError:
+            # An HTTP date rather than seconds
+            return 0
+
+    def crawlDelay(self, body):
+        """
+        Return the Crawl-delay of robots.txt body for this bot, or for every bot, or 0
+        """
+        delays = {}
+        agents = []
+        inRules = False
+        for line in body.splitlines():
+            line = line.split('#')[0].strip()
+            if ':' not in line:
+                continue
+            field, value = [part.strip() for part in line.split(':', 1)]
+            field = field.lower()
+            if field == 'user-agent':
+                if inRules:
+                    agents = []
+                    inRules = False
+                agents.append(value.lower())
+            else:
+                inRules = True
+                if field == 'crawl-delay':
+                    try:
+                        for agent in agents:
+                            delays[agent] = float(value)
+                    except ValueError:
+                        pass
+        for agent in (self.agent, '*'):
+            if agent and agent in delays:
+                return delays[agent]
+        return 0
+
+    def report(self, spider):
+        elapsed = time.time() - self.started
+        if elapsed <= 0:
+            return
+        pages = sum(state.pages for state in self.domains.itervalues())
+        stats = self.crawler.stats
+        stats.set_value('throttle/pages_per_second', pages / elapsed, spider=spider)
+        log.msg("Crawled {0} pages in {1:.0f}s, {2:.2f} pages/sec".format(pages, elapsed, pages / elapsed), level=log.INFO)
+        slots = self.crawler.engine.downloader.slots
+        for key, state in sorted(self.domains.iteritems()):
+            slot = slots.get(key)
+            log.msg("\t{0}: {1} pages, {2:.2f} pages/sec, {3} errors, delay {4:.2f}s, concurrency {5}".format(
+                key, state.pages, state.pages / elapsed, state.errors,
+                slot.delay if slot else 0, slot.concurrency if slot else 0), level=log.INFO)
+            stats.set_value('throttle/{0}/pages_per_second'.format(key), state.pages / elapsed, spider=spider)
+
+
+class IncrementalCrawl(object):
+    """
+    Fetch again only what changed since the last crawl, and pass on only new or changed items.
+
+    Requests with meta crawl_state set, as the spiders give articles, are sent with the
+    If-None-Match and If-Modified-Since headers of the last response for their URL, kept
+    in the CRAWL_STATE database, see crawlstate.py. A 304 Not Modified response is
+    dropped. An item of a full response is dropped if its content hash is unchanged,
+    otherwise passed on. It is recorded, with the response's ETag and Last-Modified,
+    only once the item pipelines have kept it, so an item a pipeline drops or fails on
+    is passed on again by the next crawl.
+
+    Set CRAWL_STATE empty, with `scrapy crawl -s CRAWL_STATE=`, to crawl everything.
+    """
+
+    def __init__(self, crawler):
+        self.fileName = crawler.settings.get('CRAWL_STATE')
+        if not self.fileName:
+            raise NotConfigured
+        self.stats = crawler.stats
+        self.state = None
+        crawler.signals.connect(self.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(self.spider_closed, signal=signals.spider_closed)
+        crawler.signals.connect(self.item_scraped, signal=signals.item_scraped)
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(crawler)
+
+    def spider_opened(self, spider):
+        self.state = CrawlState(self.fileName)
+        log.msg("Crawl state {0}: {1} pages seen before".format(self.fileName, len(self.state)), level=log.INFO)
+
+    def spider_closed(self, spider, reason):
+        self.state.close()
+        log.msg("Crawl state: {0} new, {1} changed, {2} unchanged, {3} not modified".format(
+            *[self.stats.get_value('crawlstate/' + key, 0, spider=spider) for key in ('new', 'changed', 'unchanged', 'not_modified')]),
+            level=log.INFO)
+
+    def stateUrl(self, response):
+        # Recorded under the URL requested, before any redirect
+        return response.meta.get('redirect_urls', [response.url])[0]
+
+    def process_spider_output(self, response, result, spider):
+        for x in result:
+            if isinstance(x, scrapy.Request):
+                if x.meta.get('crawl_state'):
+                    self.addConditions(x)
+            elif response.meta.get('crawl_state') and 'link' in x:
+                if self.isNew(response, x, spider):
+                    yield x
+                continue
+            yield x
+
+    def process_spider_exception(self, response, exception, spider):
+        if response.status == 304 and response.meta.get('crawl_state'):
+            self.state.touch(self.stateUrl(response))
+            self.stats.inc_value('crawlstate/not_modified', spider=spider)
+            return []
+
+    def addConditions(self, request):
+        row = self.state.get(request.url)
+        if row is None:
+            return
+        if row['etag']:
+            request.headers.setdefault('If-None-Match', row['etag'])
+        if row['last_modified']:
+            request.headers.setdefault('If-Modified-Since', row['last_modified'])
+
+    def isNew(self, response, item, spider):
+        """
+        Return True if item of response is new or changed since it was last recorded
+        """
+        row = self.state.get(self.stateUrl(response))
+        if row is None:
+            self.stats.inc_value('crawlstate/new', spider=spider)
+            return True
+        if row['content_hash'] != contentHash(item):
+            self.stats.inc_value('crawlstate/changed', spider=spider)
+            return True
+        self.stats.inc_value('crawlstate/unchanged', spider=spider)
+        # Kept by the pipelines before, so only the validators are new
+        self.record(response, item)
+        return False
+
+    def item_scraped(self, item, response, spider):
+        # Sent once every pipeline has kept the item
+        if response.meta.get('crawl_state') and 'link' in item:
+            self.record(response, item)
+
+    def record(self, response, item):
+        self.state.record(self.stateUrl(response), response.headers.get('ETag'),
+                          response.headers.get('Last-Modified'), item)
@@ -5,7 +5,234 @@
 # Don't forget to add your pipeline to the ITEM_PIPELINES setting
 # See: http://doc.scrapy.org/en/latest/topics/item-pipeline.html
 
+import os
+import hashlib
+import StringIO
+from scrapy import log
+from scrapy.exceptions import DropItem, NotConfigured
+from alembic.dedup import DedupIndex, DedupState
+import genModel
+import readjson
+import docstore
+
+
+class DedupPipeline(object):
+    """
+    Drop items whose body duplicates that of an earlier item, exactly or nearly.
+
+    Syndicated releases and mirror URLs give many copies of one article, each of which
+    would otherwise become a document, model and ranking candidate of its own. Bodies
+    are near duplicates if their word shingles are at least DEDUP_THRESHOLD similar,
+    see dedup.py. With DEDUP_ACTION = 'link' a duplicate is kept instead, with the link
+    of its original in duplicate_of, and readjson.py skips it.
+
+    The bodies kept are saved to the DEDUP_STATE database, and read back by the next
+    crawl. IncrementalCrawl does not pass on articles that are unchanged since they were
+    kept, so their duplicates are still found. Set DEDUP_STATE empty to compare items of
+    one crawl only.
+
+    The duplicate rate is logged when the spider closes, and kept in the crawl stats.
+    Items without a body are passed on as they are.
+    """
+
+    def __init__(self, settings, stats):
+        self.action = settings.get('DEDUP_ACTION', 'drop')
+        if self.action not in ('drop', 'link'):
+            raise ValueError("DEDUP_ACTION is {0}, expected 'drop' or 'link'".format(self.action))
+        self.stats = stats
+        self.index = DedupIndex(settings.getfloat('DEDUP_THRESHOLD', 0.8),
+                                settings.getint('DEDUP_SHINGLE', 5),
+                                settings.getint('DEDUP_PERMUTATIONS', 128),
+                                settings.getint('DEDUP_BANDS', 32))
+        self.stateName = settings.get('DEDUP_STATE')
+        self.state = None
+        self.items = 0
+        self.duplicates = {'exact': 0, 'near': 0}
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(crawler.settings, crawler.stats)
+
+    def open_spider(self, spider):
+        if self.stateName:
+            self.state = DedupState(self.stateName)
+            self.index.attach(self.state)
+            log.msg("Dedup state {0}: {1} bodies kept before".format(self.stateName, len(self.index)), level=log.INFO)
 
-class TutorialPipeline(object):
     def process_item(self, item, spider):
+        if not item.get('body'):
+            return item
+        self.items += 1
+        found = self.index.add(item['link'], item['body'])
+        if found is None:
+            return item
+
+        kind, original = found
+        self.duplicates[kind] += 1
+        self.stats.inc_value('dedup/' + kind, spider=spider)
+        if self.action == 'link':
+            item['duplicate_of'] = original
+            return item
+        raise DropItem("{0} duplicate of {1}: {2}".format(kind, original, item['link']))
+
+    def close_spider(self, spider):
+        if self.state is not None:
+            self.state.close()
+        duplicates = sum(self.duplicates.itervalues())
+        rate = duplicates / float(self.items) if self.items else 0.0
+        self.stats.set_value('dedup/rate', rate, spider=spider)
+        log.msg("Dedup: {0} of {1} items were duplicates ({2:.1%}), {3} exact and {4} near".format(
+            duplicates, self.items, rate, self.duplicates['exact'], self.duplicates['near']), level=log.INFO)
+
+
+class ModelPipeline(object):
+    """
+    Write the model of each item's document as it is scraped, as genModel.py -i would
+    from readjson.py's output, and the collection model when the spider closes.
+
+    The body is split into sentences and counted with genModel's own code, straight
+    from memory, so models are ready when the crawl ends, with no JSON or document files
+    written and read back in between. Document models are <MODEL_PREFIX>_<i>.model, with
+    their vocabulary and manifest, and an inverted index if MODEL_INDEX. The collection
+    model is <MODEL_COLLECTION>_all.model, with its term table. The documents are also
+    added to document store MODEL_STORE if set, so extract.py can summarize them.
+
+    If models of an earlier crawl are at MODEL_PREFIX, they are kept and added to:
+    items with a link in the manifest replace the model of that link, in the collection
+    model too, and others are given new ids, as genModel.py -u does for documents.
+    Items marked duplicates by DedupPipeline are skipped.
+
+    The manifest is keyed by link, not by document name as genModel.py's is, so the
+    pipeline needs paths of its own. It refuses to start over models, a manifest or a
+    store it did not write, rather than write over them or store documents twice.
+    Off unless MODEL_PREFIX is set, e.g. scrapy crawl cdc_archive -s MODEL_PREFIX=crawl_models/articles
+    """
+
+    # Marks the manifests this pipeline writes, which genModel.py -u refuses to update
+    MANIFEST_SOURCE = 'ModelPipeline'
+
+    def __init__(self, settings):
+        self.prefix = settings.get('MODEL_PREFIX')
+        if not self.prefix:
+            raise NotConfigured
+        self.colPrefix = settings.get('MODEL_COLLECTION') or self.prefix
+        self.binary = settings.getbool('MODEL_BINARY', True)
+        self.index = settings.getbool('MODEL_INDEX', False)
+        self.storeName = settings.get('MODEL_STORE')
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(crawler.settings)
+
+    def modelFile(self, i):
+        return self.prefix + '_' + repr(i) + '.model'
+
+    def existingModels(self):
+        dir = os.path.dirname(self.prefix) or '.'
+        base = os.path.basename(self.prefix) + '_'
+        return [n for n in os.listdir(dir) if n.startswith(base) and n.endswith('.model')]
+
+    def open_spider(self, spider):
+        import vocab
+        import termtable
+        for prefix in (self.prefix, self.colPrefix):
+            dir = os.path.dirname(prefix)
+            if dir and not os.path.isdir(dir):
+                os.makedirs(dir)
+
+        self.colFile = self.colPrefix + '_all.model'
+        vocabFile = self.prefix + '.vocab'
+        manifestFile = self.prefix + '.manifest'
+        self.manifest = genModel.readManifest(self.prefix)
+        if os.path.exists(manifestFile):
+            if self.manifest is None or self.manifest.get('source') != self.MANIFEST_SOURCE:
+                raise ValueError('{0} was not written by ModelPipeline, give MODEL_PREFIX a path of its own'.format(manifestFile))
+            for fileName in (self.colFile, vocabFile):
+                if not os.path.exists(fileName):
+                    raise ValueError('{0} of the models at {1} is missing, remove them to crawl them again'.format(fileName, self.prefix))
+            log.msg("Adding to the {0} models at {1}".format(len(self.manifest['docs']), self.prefix), level=log.INFO)
+            self.collection = genModel.copyModel(genModel.loadModel(self.colFile))
+            self.vocabulary = vocab.readVocabulary(vocabFile)
+        else:
+            # Ids start at 0, so never over model files some other build left
+            for existing in (self.existingModels(), os.path.exists(self.colFile),
+                             self.storeName and docstore.isStore(self.storeName)):
+                if existing:
+                    raise ValueError('Models or documents without a ModelPipeline manifest are at {0}, {1} or {2}, '
+                                     'give MODEL_PREFIX, MODEL_COLLECTION and MODEL_STORE paths of their own'.format(
+                                     self.prefix, self.colFile, self.storeName))
+            self.manifest = {'docs': {}, 'nextId': 0, 'source': self.MANIFEST_SOURCE}
+            self.collection = genModel.FeatureSet(polarity=1)
+            self.vocabulary = vocab.Vocabulary()
+
+        self.builders = [self.vocabulary]
+        self.terms = termtable.TermTableBuilder()
+        self.builders.append(self.terms)
+        self.indexBuilder = None
+        if self.index:
+            import invindex
+            self.indexBuilder = invindex.IndexBuilder()
+            self.builders.append(self.indexBuilder)
+
+        self.writer = None
+        if self.storeName:
+            # Only a store this pipeline wrote, see above
+            self.writer = docstore.DocStoreWriter(self.storeName, append=True)
+        self.written = set()        # links modeled by this crawl
+
+    def process_item(self, item, spider):
+        link = item['link']
+        if item.get('duplicate_of') or link in self.written:
+            return item
+        self.written.add(link)
+
+        # The document text readjson.py would write, link, date, title, then a sentence per line
+        text = readjson.formatDoc(item)
+
+        docs = self.manifest['docs']
+        if link in docs:
+            # Changed since the last crawl
+            i = docs[link]['id']
+            if os.path.exists(self.modelFile(i)):
+                self.collection.subtract(genModel.loadModel(self.modelFile(i)))
+        else:
+            i = self.manifest['nextId']
+            self.manifest['nextId'] += 1
+        docs[link] = {'id': i, 'hash': hashlib.sha1(text).hexdigest()}
+
+        origin = link
+        if self.writer is not None:
+            origin = docstore.documentRef(self.storeName, self.writer.add(text))
+
+        model = genModel.FeatureSet(polarity=1)
+        genModel.readDocument(StringIO.StringIO(text), origin, model, self.collection)
+        fileName = genModel.writeDocumentModel(i, model, self.prefix, self.binary, self.builders)
+        log.msg("Wrote model {0} of {1}".format(fileName, link), level=log.INFO)
         return item
+
+    def close_spider(self, spider):
+        if self.writer is not None:
+            self.writer.close()
+        docs = self.manifest['docs']
+        if not docs:
+            log.msg("No documents, so no models written", level=log.WARNING)
+            return
+
+        # Models kept from an earlier crawl are indexed from their files
+        for link, doc in sorted(docs.iteritems(), key=lambda (link, doc): doc['id']):
+            if link not in self.written:
+                fileName = self.modelFile(doc['id'])
+                model = genModel.loadModel(fileName)
+                self.terms.add(fileName, model)
+                if self.indexBuilder:
+                    self.indexBuilder.add(fileName, model)
+
+        if self.indexBuilder:
+            genModel.writeIndex(self.prefix, self.indexBuilder)
+        genModel.writeVocabulary(self.prefix, self.vocabulary)
+        genModel.writeCollectionModel(self.storeName or spider.name, self.colPrefix, self.collection, self.binary, self.terms)
+        self.manifest['collection'] = True
+        genModel.writeManifest(self.prefix, self.manifest)
+        genModel.writeGeneration(self.prefix)
+        log.msg("Wrote {0} document models at {1}, {2} new or changed, and collection model {3}".format(
+            len(docs), self.prefix, len(self.written), self.colFile), level=log.INFO)
@@ -11,10 +11,58 @@
 BOT_NAME = 'alembic'
 SPIDER_MODULES = ['alembic.spiders']
 NEWSPIDER_MODULE = 'alembic.spiders'
-DOWNLOAD_DELAY = 2
 DEPTH_LIMIT = 2
 LOG_FILE = 'scrapy.log'
 LOG_LEVEL='INFO'
 
+# JSON feed the archive page lists its articles from, with {page} in place of the page
+# number, for the cdc_archive spider. Required, here or with -a feed_url=<url>
+CDC_FEED_URL = ''
+
+# Each domain starts at one request every DOWNLOAD_DELAY seconds. PoliteThrottle then
+# adapts its delay and concurrency to the server's latency and errors, within the
+# THROTTLE_ limits, and never faster than the Crawl-delay of its robots.txt.
+# See alembic/middlewares.py
+DOWNLOAD_DELAY = 2
+CONCURRENT_REQUESTS = 32
+CONCURRENT_REQUESTS_PER_DOMAIN = 1
+ROBOTSTXT_OBEY = True
+RETRY_HTTP_CODES = [500, 502, 503, 504, 408, 429]
+DOWNLOADER_MIDDLEWARES = {
+    'alembic.middlewares.PoliteThrottle': 950,
+}
+THROTTLE_MIN_DELAY = 0.25
+THROTTLE_MAX_DELAY = 60
+THROTTLE_MAX_CONCURRENCY = 8
+THROTTLE_SPEEDUP_AFTER = 5
+THROTTLE_LATENCY_FACTOR = 3
+THROTTLE_REPORT_INTERVAL = 60
+
+# Articles fetched before are requested only if modified, and their items passed on only
+# if changed, by IncrementalCrawl. Set empty to crawl everything. See alembic/crawlstate.py
+CRAWL_STATE = 'crawlstate.db'
+SPIDER_MIDDLEWARES = {
+    'alembic.middlewares.IncrementalCrawl': 950,
+}
+
+# Items duplicating the body of an earlier one, of this crawl or of one kept by an
+# earlier crawl in DEDUP_STATE, are dropped, or with 'link' kept but marked. Set
+# DEDUP_STATE empty to compare items of one crawl only. See alembic/pipelines.py
+ITEM_PIPELINES = {
+    'alembic.pipelines.DedupPipeline': 300,
+    'alembic.pipelines.ModelPipeline': 800,
+}
+DEDUP_ACTION = 'drop'
+DEDUP_THRESHOLD = 0.8
+DEDUP_STATE = 'dedup.db'
+
+# With MODEL_PREFIX set, e.g. -s MODEL_PREFIX=crawl_models/articles, models of each item
+# are written as it is scraped, and the collection model when the crawl ends. Keep these
+# paths apart from those of modelgen_cdc.bat. See alembic/pipelines.py
+MODEL_PREFIX = ''
+MODEL_COLLECTION = 'crawl_articles'
+MODEL_STORE = 'crawl_docs.store'
+MODEL_INDEX = False
+
 # Crawl responsibly by identifying yourself (and your website) on the user-agent
 USER_AGENT = 'AlembicBot/0.1 (+http://utdallas.edu/~jpj054000/bot.htm)'
@@ -20,25 +20,94 @@ http://bgrva.github.io/blog/2014/03/04/scrapy-after-tutorials-part-1/
 
 
 import scrapy
+import json
+import threading
+import urlparse
+from twisted.internet import threads
+from scrapy import signals
+from scrapy.exceptions import DontCloseSpider
 from scrapy.selector import HtmlXPathSelector
 from scrapy.contrib.spiders import CrawlSpider, Rule
 from scrapy.contrib.linkextractors.sgml import SgmlLinkExtractor
 from scrapy import log
 from alembic.items import DocItem
-from selenium import webdriver
-from selenium.webdriver.remote import webelement
-#from selenium import selenium
-import time
+
+try:
+    from selenium import webdriver
+    from selenium.webdriver.common.by import By
+    from selenium.webdriver.support.ui import WebDriverWait
+    from selenium.webdriver.support import expected_conditions
+except ImportError:
+    webdriver = None
+
+class DriverPool(object):
+    """
+    Selenium drivers kept open and reused, as starting a browser takes seconds
+    """
+    
+    def __init__(self):
+        self.idle = []
+        self.drivers = []
+        self.lock = threading.Lock()     # drivers are used from reactor threads
+    
+    def acquire(self):
+        with self.lock:
+            if self.idle:
+                return self.idle.pop()
+        log.msg("starting selenium driver...", level=log.INFO)
+        driver = webdriver.Firefox()
+        with self.lock:
+            self.drivers.append(driver)
+        return driver
+    
+    def release(self, driver):
+        with self.lock:
+            self.idle.append(driver)
+    
+    def close(self):
+        with self.lock:
+            for driver in self.drivers:
+                driver.quit()
+            self.idle = []
+            self.drivers = []
+
+# Shared by the spiders of this process
+driverPool = DriverPool()
 
 class Cdc_archive_spider(scrapy.Spider):
     """
     Scrap each article listed in the media archive
     
-    Use with `$> scrapy crawl cdc_archive -a session_id=001 -o articles.json
+    Use with `$> scrapy crawl cdc_archive -a session_id=001 -a feed_url=<url> -o articles.json
+    
+    The archive list is rendered by javascript from a JSON feed, so articles are found
+    by requesting the feed directly, each page as its own request. Article requests are
+    yielded as each page is parsed, while the other pages are still being fetched.
+    
+    The feed URL must be given, with -a feed_url=<url> or the CDC_FEED_URL setting.
+    
+    Options, given with -a <name>=<value>:
+        feed_url        URL of the archive feed, with {page} in place of the page number.
+                        An HTML page listing the articles also works, if not paged.
+        first_page      Number of the first page of the feed, 1 by default
+        max_pages       Request at most this many pages of the feed
+        domains         Comma separated domains to crawl, cdc.gov by default
+        selenium        If 1, the default, and the feed fails or lists no articles, render
+                        the archive page in a pooled Firefox driver instead, if selenium is
+                        installed, and take the links from it. 0 to never start a browser.
+                        Rendering runs on a thread, so downloads carry on meanwhile.
     
-    TODO: Scrapy alone cannot parse data rendered from jquery responses. We need a toolkit like Selenium to process the dynamic content and serve us the full page, as it would be in Firefox.
+    Articles fetched by an earlier crawl are requested again only if modified, and
+    passed on only if their content changed, as recorded in the CRAWL_STATE database.
     
-    See http://snipplr.com/view/66998/
+    DEPTH_LIMIT does not apply. A feed without a page count is followed a page at a
+    time, so each page is one deeper than the last, and the articles of later pages
+    would be dropped. The crawl is bounded by the feed and max_pages instead.
+    
+    To test against a local fixture server, serve the feed and article pages of
+    tests/fixtures with `python -m SimpleHTTPServer 8000` and crawl with
+        -a feed_url=http://localhost:8000/feed_{page}.json -a domains=localhost
+    as tests/test_cdc_spider.py does for one page at a time.
     """
 
     name = "cdc_archive"
@@ -47,68 +116,179 @@ class Cdc_archive_spider(scrapy.Spider):
     
     topURL = "http://www.cdc.gov/media/archives.htm"
     
-    #We'll fetch a list using selenium
-    start_urls = []
+    # Links to articles, on the archive page once rendered
+    xpath_getlinks = "//ul[contains(@id, 'pressrelease')]/li/a[contains(@class, 'item-title')]"
+    
+    # Keys of feed entries that hold an article URL, and of the feed that hold its page count
+    LINK_KEYS = ('url', 'link', 'href')
+    PAGE_COUNT_KEYS = ('pages', 'totalPages', 'pageCount', 'total_pages')
+    
+    custom_settings = {'DEPTH_LIMIT': 0}
     
-    def __init__(self, session_id=-1, *args, **kwargs):
+    def __init__(self, session_id=-1, feed_url=None, first_page=1, max_pages=None, domains=None, selenium=1, *args, **kwargs):
         super(Cdc_archive_spider, self).__init__(*args, **kwargs)
         self.session_id = session_id
+        self.feed_url = feed_url
+        self.first_page = int(first_page)
+        self.max_pages = int(max_pages) if max_pages else None
+        self.selenium = bool(int(selenium))
+        if domains:
+            self.allowed_domains = domains.split(',')
+        self.articles = 0
+        self.rendering = 0      # fallback renders still running
+    
+    @classmethod
+    def from_crawler(cls, crawler, *args, **kwargs):
+        spider = super(Cdc_archive_spider, cls).from_crawler(crawler, *args, **kwargs)
+        crawler.signals.connect(spider.spiderIdle, signal=signals.spider_idle)
+        return spider
+    
+    def start_requests(self):
+        if not self.feed_url:
+            self.feed_url = self.settings.get('CDC_FEED_URL')
+        if not self.feed_url:
+            raise ValueError("No archive feed URL, give -a feed_url=<url> or set CDC_FEED_URL")
+        yield self.feedRequest(self.first_page)
+    
+    def spiderIdle(self, spider):
+        # Articles found by a render still running are yet to be queued
+        if spider is self and self.rendering:
+            raise DontCloseSpider
+    
+    def feedRequest(self, page):
+        return scrapy.Request(self.feed_url.replace('{page}', repr(page)), callback=self.parseFeed,
+                              errback=self.feedFailed, meta={'page': page}, dont_filter=True)
+    
+    def articleRequest(self, link):
+        # Fetched only if changed since the last crawl, see IncrementalCrawl in middlewares.py
+        return scrapy.Request(link, callback=self.parse, meta={'crawl_state': True})
+    
+    def lastPage(self, count):
+        """
+        Return the last page of the feed to request, given its page count, if known
+        """
+        last = None
+        if count is not None:
+            last = self.first_page + count - 1
+        if self.max_pages:
+            limit = self.first_page + self.max_pages - 1
+            last = limit if last is None else min(last, limit)
+        return last
+    
+    def parseFeed(self, response):
+        """
+        Yield a request for each article of a page of the feed, and for the pages after it
+        """
+        page = response.meta['page']
+        paged = '{page}' in self.feed_url
+        try:
+            data = json.loads(response.body)
+            links = [urlparse.urljoin(response.url, link) for link in self.feedLinks(data)]
+            count = self.pageCount(data)
+        except ValueError:
+            # Not JSON, such as the archive page itself
+            links = [urlparse.urljoin(response.url, href) for href in response.xpath(self.xpath_getlinks + "/@href").extract()]
+            count = None
+            paged = False
         
-        # Start up Selenium
-        log.msg("starting selenium server...", level=log.INFO)
-        self.verificationErrors = []
-        #self.selenium=selenium("localhost",4444, "*chrome", "http://www.cdc.gov/media/") 
-        self.driver = webdriver.Firefox()
-        
-        #start selenium with baseURL
-        #self.selenium.start()
-        #log.msg("selenium server started!", level=log.INFO)
-        log.msg("selenium driver started!", level=log.INFO)
-        
-        # print "Name: ", self.selenium.__class__.__name__
-        # print "Class: ",self.selenium.__class__
-        # print "Base: ", self.selenium.__class__.__bases__
-        # print "Dict: ", self.selenium.__dict__
-        
-        
-        # Open top url 
-        #self.selenium.open(self.topURL)
-        self.driver.get(self.topURL)
-        time.sleep(5) # Wait for javascript to load
-        
-        # and get list of URLs
-        xpath_getlinks = "//ul[contains(@id, 'pressrelease')]/li/a[contains(@class, 'item-title')]"
-        #matches = 0 
-        #matches = self.selenium.get_xpath_count(xpath_getlinks)
-        #print "Hits: ", matches
-        #sites = self.selenium.get_text(xpath_getlinks)
-        
-        # see http://stackoverflow.com/questions/17975471/selenium-with-scrapy-for-dynamic-page
-        linkElements = self.driver.find_elements_by_xpath(xpath_getlinks) #WebElement list
-        
-        articles = []
-        for e in linkElements:
-            articles.append(e.get_attribute('href'))
-        
-        log.msg("Found articles: \n{0}".format(articles), level=log.INFO)
-        print "Found {0} articles: \n{1}".format(len(articles), articles) 
+        log.msg("Feed page {0}: {1} articles".format(page, len(links)), level=log.INFO)
+        self.articles += len(links)
+        for link in links:
+            yield self.articleRequest(link)
         
-        # Add articles links to start_urls 
-        Cdc_archive_spider.start_urls.extend(articles)
+        if page == self.first_page and not links:
+            self.fallback()
+            return
         
-        # Now scrapy will call parse() on each article 
+        if not paged:
+            return
+        last = self.lastPage(count)
+        if count is not None:
+            # Page count known, so ask for every other page at once
+            if page == self.first_page:
+                for p in range(page + 1, last + 1):
+                    yield self.feedRequest(p)
+        elif links and (last is None or page < last):
+            yield self.feedRequest(page + 1)
+    
+    def feedLinks(self, data):
+        """
+        Yield each article URL of a parsed feed page, from its entries at any depth
+        """
+        if isinstance(data, dict):
+            for key in self.LINK_KEYS:
+                if isinstance(data.get(key), basestring):
+                    yield data[key]
+            for value in data.itervalues():
+                if isinstance(value, (dict, list)):
+                    for link in self.feedLinks(value):
+                        yield link
+        elif isinstance(data, list):
+            for value in data:
+                for link in self.feedLinks(value):
+                    yield link
+    
+    def pageCount(self, data):
+        if isinstance(data, dict):
+            for key in self.PAGE_COUNT_KEYS:
+                if key in data:
+                    return int(data[key])
+        return None
+    
+    def feedFailed(self, failure):
+        log.msg("Feed request failed: {0}".format(failure.getErrorMessage()), level=log.ERROR)
+        if failure.request.meta.get('page') == self.first_page:
+            self.fallback()
+    
+    def fallback(self):
+        """
+        Render the archive page with Selenium, if enabled, on a thread, then crawl each article on it
+        """
+        if not self.selenium:
+            log.msg("No articles found in feed {0}".format(self.feed_url), level=log.WARNING)
+            return
+        if webdriver is None:
+            log.msg("No articles found in feed, and selenium is not installed", level=log.ERROR)
+            return
         
-    def __del__(self):
-        #self.selenium.stop()
-        log.msg("Verification Errors: \n{0}".format(self.verificationErrors), level=log.INFO)
-        log.msg("DONE", level=log.INFO)
-        self.driver.close()
+        # Rendering waits on the browser, so keep it off the reactor thread downloads run on
+        self.rendering += 1
+        d = threads.deferToThread(self.renderArchive)
+        d.addCallback(self.queueArticles)
+        d.addErrback(lambda failure: log.msg("Rendering {0} failed: {1}".format(self.topURL, failure.getErrorMessage()), level=log.ERROR))
+        d.addBoth(self.renderDone)
+    
+    def renderArchive(self):
+        """
+        Return the article links of the archive page as rendered by Selenium. Runs on a thread.
+        """
+        driver = driverPool.acquire()
+        try:
+            driver.get(self.topURL)
+            
+            # Wait for javascript to load the list, rather than for a fixed time
+            WebDriverWait(driver, 30).until(expected_conditions.presence_of_element_located((By.XPATH, self.xpath_getlinks)))
+            return [e.get_attribute('href') for e in driver.find_elements_by_xpath(self.xpath_getlinks)]
+        finally:
+            driverPool.release(driver)
+    
+    def queueArticles(self, articles):
+        log.msg("Found {0} articles with selenium".format(len(articles)), level=log.INFO)
+        self.articles += len(articles)
+        for link in articles:
+            self.crawler.engine.crawl(self.articleRequest(link), self)
+    
+    def renderDone(self, result):
+        self.rendering -= 1
+    
+    def closed(self, reason):
+        driverPool.close()
+        log.msg("DONE, found {0} articles".format(self.articles), level=log.INFO)
         print "DONE"
-        #super.__del__(self) -->#Causes exception that says scrapy.Spider has no __del__() ?
     
     def parse(self, response):
         """
-        Called automatically by scrapy on every start_url
+        Called on every article found in the archive
         """
         print "Processing: ", ""+response.url
         log.msg("Processing url: {0}".format(""+response.url), level=log.INFO)
@@ -0,0 +1,433 @@
+#!/usr/bin/python2.7
+# benchmark.py
+# Jeremy Johnston
+
+""" Benchmarks of the model generation, ranking and summarization code paths.
+
+    Each benchmark builds its own synthetic data in a temporary directory, so it can be
+    run anywhere with:
+        python benchmark.py -b rank -n 10000,100000,1000000
+    
+    The tokenize benchmark can instead count a directory of real documents:
+        python benchmark.py -b tokenize -n 100,1000 -d cdc_docs
+"""
+
+from __future__ import division
+import sys
+import getopt
+import os
+import shutil
+import tempfile
+import random
+import math
+import array
+import time
+import StringIO
+import types
+from collections import deque
+import rank
+import invindex
+import extract
+import genModel
+import vocab
+from genModel import FeatureSet, Unigram
+
+def timeIt(fn, repeat=3):
+    """ Return best wall time of repeat calls of fn
+    """
+    best = None
+    for i in range(repeat):
+        start = time.time()
+        fn()
+        t = time.time() - start
+        if best is None or t < best:
+            best = t
+    return best
+
+def quiet(fn):
+    """ Return fn with its printed output dropped
+    """
+    def call():
+        stdout = sys.stdout
+        sys.stdout = StringIO.StringIO()
+        try:
+            return fn()
+        finally:
+            sys.stdout = stdout
+    return call
+
+def writeSyntheticIndex(fileName, nDocs):
+    """ Write an index of nDocs documents over terms of varied document frequency.
+    
+        genModel counts each word once per document, so every unigram of a document model
+        has the same probability, 1 / (numTokens + V), smaller the longer the document.
+    """
+    random.seed(nDocs)
+    builder = invindex.IndexBuilder()
+    builder.docs = [('bench_{0:07d}.model'.format(d), 'bench_{0:07d}.txt'.format(d)) for d in xrange(nDocs)]
+    docProbs = [math.log(2 / (2 * random.lognormvariate(6, 0.7)), 2) for d in xrange(nDocs)]
+
+    # (term, fraction of documents containing it)
+    terms = [('common', 0.5), ('medium', 0.05), ('rare', 0.0005)]
+    for term, fraction in terms:
+        n = max(1, int(nDocs * fraction))
+        docs = array.array('I', sorted(random.sample(xrange(nDocs), n)))
+        counts = array.array('I', [1] * n)
+        probs = array.array('d', (docProbs[d] for d in docs))
+        builder.postings[term] = (docs, counts, probs)
+    builder.write(fileName)
+
+    colModel = FeatureSet(polarity=1)
+    for term, fraction in terms:
+        colModel.words[term] = Unigram(term, count=1, probability=-random.uniform(4, 12))
+    return colModel, [term for term, fraction in terms]
+
+def benchRank(sizes):
+    """ Time rankIndex(), rankTopK() and rankVectorized() over synthetic indexes
+    """
+    tmp = tempfile.mkdtemp()
+    try:
+        print '{0: >10} | {1: >14} | {2: >14} | {3: >16}'.format('DOCS', 'rankIndex (s)', 'rankTopK (s)', 'vectorized (s)')
+        for n in sizes:
+            fileName = os.path.join(tmp, 'bench_{0}.index'.format(n))
+            colModel, terms = writeSyntheticIndex(fileName, n)
+            index = invindex.readIndex(fileName)
+
+            def full():
+                colModel.queryProbability = 0
+                return [r.modelFile for r in rank.rankIndex(terms, index, colModel, 0.5)[:10]]
+
+            def topK():
+                colModel.queryProbability = 0
+                return [r.modelFile for r in rank.rankTopK(terms, index, colModel, 0.5)[0]]
+
+            def vectorized():
+                colModel.queryProbability = 0
+                return [r.modelFile for r in rank.rankVectorized(terms, index, colModel, 0.5)[0]]
+
+            # All must give the same top 10
+            expected = full()
+            if topK() != expected or (rank.numpy and vectorized() != expected):
+                print 'ERROR: rankings differ at {0} docs'.format(n)
+
+            times = [timeIt(full), timeIt(topK)]
+            if rank.numpy:
+                times.append('{0:.4f}'.format(timeIt(vectorized)))
+            else:
+                times.append('no numpy')
+            print '{0: >10} | {1: >14.4f} | {2: >14.4f} | {3: >16}'.format(n, *times)
+            index.close()
+    finally:
+        shutil.rmtree(tmp)
+
+def syntheticDocument(nSentences):
+    """ Return (sentences, model, colModel) of a document of nSentences sentences for extract.summarize()
+    """
+    random.seed(nSentences)
+    vocab = ['w{0}'.format(i) for i in range(2000)]
+    sentences = []
+    for i in range(nSentences):
+        # Zipf-like word choice, so some words repeat across sentences
+        words = [vocab[min(int(random.paretovariate(1.2)) - 1, len(vocab) - 1)] for j in range(random.randint(5, 30))]
+        sentences.append(' '.join(words) + '\n')
+    
+    model = FeatureSet(polarity=1)
+    colModel = FeatureSet(polarity=1)
+    for sentence in sentences:
+        words = sentence.split()
+        for w1, w2 in zip(words, words[1:]):
+            model.addUnigram(w1)
+            model.addBigram(w1, w2)
+    for word in vocab:
+        colModel.words[word] = Unigram(word, count=random.randint(1, 500), probability=0)
+    return sentences, model, colModel
+
+def summarizePairwise(sentences, model, colModel):
+    """ Best centrality of sentences found with tf_idf_cosine() of every pair, as summarize() once did
+    """
+    idf = dict((u.word, u.count) for u in colModel.words.itervalues())
+    tf = dict((u.word, len(u.bigrams)) for u in model.words.itervalues())
+    K = len(sentences)
+    bestC = 0
+    for i, x in enumerate(sentences):
+        c = 0
+        for j, y in enumerate(sentences):
+            if i != j:
+                c += extract.tf_idf_cosine(x, y, tf, idf)
+        bestC = max(bestC, (1/K) * c)
+    return bestC
+
+def benchSummarize(sizes):
+    """ Time extract.summarize() against tf_idf_cosine() of every pair of sentences
+    """
+    print '{0: >10} | {1: >14} | {2: >14}'.format('SENTENCES', 'pairwise (s)', 'summarize (s)')
+    for n in sizes:
+        sentences, model, colModel = syntheticDocument(n)
+        summarize = quiet(lambda: extract.summarize(sentences, model, colModel))
+        
+        # Every pair gets slow quickly, so only time it on small documents
+        pairwise = 'skipped'
+        if n <= 500:
+            bestC = summarizePairwise(sentences, model, colModel)
+            if abs(bestC - summarize()[1]) > 1e-9 * bestC:
+                print 'ERROR: centralities differ at {0} sentences'.format(n)
+            pairwise = '{0:.4f}'.format(timeIt(lambda: summarizePairwise(sentences, model, colModel), 1))
+        print '{0: >10} | {1: >14} | {2: >14.4f}'.format(n, pairwise, timeIt(summarize))
+
+def footprint(obj, seen=None):
+    """ Return bytes held by obj and everything it refers to, counting shared objects once
+    """
+    if seen is None:
+        seen = set()
+    total = 0
+    stack = [obj]
+    while stack:
+        o = stack.pop()
+        if id(o) in seen or isinstance(o, (type, types.ClassType, types.ModuleType, types.FunctionType)):
+            continue
+        seen.add(id(o))
+        total += sys.getsizeof(o)
+        if isinstance(o, dict):
+            stack.extend(o.iterkeys())
+            stack.extend(o.itervalues())
+        elif isinstance(o, (list, tuple, set, frozenset)):
+            stack.extend(o)
+        elif not isinstance(o, (str, unicode, int, long, float, array.array)):
+            if hasattr(o, '__dict__'):
+                stack.append(o.__dict__)
+            for cls in type(o).__mro__:
+                for slot in cls.__dict__.get('__slots__', ()):
+                    if hasattr(o, slot):
+                        stack.append(getattr(o, slot))
+    return total
+
+def writeSyntheticDocuments(dir, nDocs):
+    """ Write nDocs documents of Zipf-like word choice to dir, in the layout genModel.py reads
+    """
+    random.seed(nDocs)
+    vocabulary = ['w{0}'.format(i) for i in range(20000)]
+    for d in xrange(nDocs):
+        file = open(os.path.join(dir, 'doc_{0:06d}.txt'.format(d)), 'w')
+        file.write('http://example.com/{0}\nJanuary 1, 2015\nTitle {0}\n'.format(d))
+        for i in range(random.randint(10, 40)):
+            words = [vocabulary[min(int(random.paretovariate(1.1)) - 1, len(vocabulary) - 1)] for j in range(random.randint(3, 20))]
+            file.write(' '.join(words) + '\n')
+        file.close()
+
+def benchMemory(sizes):
+    """ Bytes per feature of a model directory loaded as FeatureSets, as id-keyed arrays, and mapped
+    """
+    tmp = tempfile.mkdtemp()
+    try:
+        print '{0: >10} | {1: >10} | {2: >16} | {3: >16} | {4: >16}'.format(
+            'DOCS', 'FEATURES', 'FeatureSet (B)', 'IdFeatureSet (B)', 'mapped (B)')
+        for n in sizes:
+            docDir = os.path.join(tmp, 'docs_{0}'.format(n))
+            modelDir = os.path.join(tmp, 'models_{0}'.format(n))
+            os.mkdir(docDir)
+            os.mkdir(modelDir)
+            writeSyntheticDocuments(docDir, n)
+            quiet(lambda: genModel.modeEach(docDir, os.path.join(modelDir, 'text'), binary=False))()
+            textFiles = sorted(os.path.join(modelDir, f) for f in os.listdir(modelDir) if f.endswith('.model'))
+            for i, f in enumerate(textFiles):
+                genModel.writeModelFile(os.path.join(modelDir, 'bin_{0}.bin'.format(i)), rank.readModel(f))
+            
+            models = [rank.readModel(f) for f in textFiles]
+            dictBytes = footprint(models)
+            features = sum(len(m.words) + sum(len(u.bigrams) for u in m.words.itervalues()) for m in models)
+            del models
+            
+            # The vocabulary is shared, so counted once with the models
+            vocabulary = vocab.Vocabulary()
+            idBytes = footprint([vocab.IdFeatureSet(vocabulary, rank.readModel(f)) for f in textFiles])
+            
+            # Mapped models hold their features in the page cache, not on the heap
+            mapped = [rank.readModel(os.path.join(modelDir, 'bin_{0}.bin'.format(i))) for i in range(len(textFiles))]
+            mappedBytes = footprint(mapped)
+            
+            print '{0: >10} | {1: >10} | {2: >16.1f} | {3: >16.1f} | {4: >16.1f}'.format(
+                n, features, dictBytes / features, idBytes / features, mappedBytes / features)
+    finally:
+        shutil.rmtree(tmp)
+
+def readEager(dir):
+    """ Read a text model directory whole, as rank.readDirectory() did before reading bigrams lazily
+    """
+    vocabulary = vocab.Vocabulary()
+    names = sorted(n for n in os.listdir(dir) if n.endswith('.model'))
+    return [vocab.IdFeatureSet(vocabulary, rank.readModel(os.path.join(dir, n))) for n in names]
+
+def benchLoad(sizes):
+    """ Load time and bytes of a text model directory read whole, and read with bigrams left for later
+    """
+    tmp = tempfile.mkdtemp()
+    try:
+        print '{0: >10} | {1: >12} | {2: >12} | {3: >14} | {4: >14}'.format(
+            'DOCS', 'eager (s)', 'lazy (s)', 'eager (MB)', 'lazy (MB)')
+        for n in sizes:
+            docDir = os.path.join(tmp, 'docs_{0}'.format(n))
+            modelDir = os.path.join(tmp, 'models_{0}'.format(n))
+            os.mkdir(docDir)
+            os.mkdir(modelDir)
+            writeSyntheticDocuments(docDir, n)
+            colPrefix = os.path.join(tmp, 'col_{0}'.format(n))
+            quiet(lambda: genModel.modeEach(docDir, os.path.join(modelDir, 'text'), binary=False))()
+            quiet(lambda: genModel.modeAll(docDir, colPrefix, binary=False))()
+            
+            eager = readEager(modelDir)
+            lazy = rank.readDirectory(modelDir)
+            # Scoring adds to the collection model's queryProbability, so each ranking reads its own
+            ranked = [[d.modelFile for d in quiet(lambda: rank.rank(['w1', 'w7'], models, rank.readModel(colPrefix + '_all.model')))()]
+                      for models in (eager, lazy)]
+            if ranked[0] != ranked[1]:
+                print 'ERROR: rankings differ at {0} documents'.format(n)
+            eagerBytes = footprint(eager)
+            lazyBytes = footprint(lazy)
+            del eager, lazy
+            
+            print '{0: >10} | {1: >12.4f} | {2: >12.4f} | {3: >14.1f} | {4: >14.1f}'.format(
+                n, timeIt(lambda: readEager(modelDir), 1), timeIt(lambda: rank.readDirectory(modelDir), 1),
+                eagerBytes / 1e6, lazyBytes / 1e6)
+    finally:
+        shutil.rmtree(tmp)
+
+def processLineDeque(line, vector):
+    """ Count features of line into vector, as genModel.processLine() did before countTokens()
+    """
+    tokens = line.split()
+    vector.numTokens += len(tokens)
+    if len(tokens) == 1:
+        vector.getUnigram(tokens[0].lower())
+        vector.addUnigram(tokens[0].lower())
+    elif len(tokens) >= 2:
+        q = deque(tokens)
+        prevWord = q.popleft().lower()
+        for t in q:
+            word = t.lower()
+            unigram, exists = vector.getUnigram(prevWord)
+            if not exists:
+                vector.addUnigram(prevWord)
+            bigram, exists = vector.getBigram(prevWord, word)
+            if not exists:
+                vector.addBigram(prevWord, word)
+            prevWord = word
+
+def readDocumentLines(dir, nDocs=None):
+    """ Return the lines of the first nDocs documents of dir, with metadata lines as genModel.readFile() gives them
+    """
+    docs = []
+    for name in sorted(os.listdir(dir))[:nDocs]:
+        file = open(os.path.join(dir, name))
+        lines = [file.readline().rstrip().lower() for i in range(3)]
+        lines.extend(file)
+        file.close()
+        docs.append(lines)
+    return docs
+
+def countDeque(docs):
+    vectors = []
+    for lines in docs:
+        vector = FeatureSet(polarity=1)
+        for line in lines:
+            processLineDeque(line, vector)
+        vectors.append(vector)
+    return vectors
+
+def countStreaming(docs):
+    vectors = []
+    for lines in docs:
+        vector = FeatureSet(polarity=1)
+        for tokens in genModel.tokenLines(lines):
+            genModel.countTokens(tokens, vector)
+        vectors.append(vector)
+    return vectors
+
+def sameCounts(a, b):
+    """ Return True if FeatureSets a and b hold the same features with the same counts
+    """
+    if a.numTokens != b.numTokens or sorted(a.words) != sorted(b.words):
+        return False
+    for word, unigram in a.words.iteritems():
+        other = b.words[word]
+        if unigram.count != other.count or \
+           sorted((w, g.count) for w, g in unigram.bigrams.iteritems()) != sorted((w, g.count) for w, g in other.bigrams.iteritems()):
+            return False
+    return True
+
+def benchTokenize(sizes, dir=None):
+    """ Tokens per second counted into document feature sets, by the old deque loop and by the streaming pipeline.
+    
+        Counts documents of dir, such as the cdc_docs directory modelgen_cdc.bat makes,
+        the first n of them for each n of sizes, or synthetic documents if dir is not given.
+    """
+    tmp = tempfile.mkdtemp()
+    try:
+        print '{0: >10} | {1: >10} | {2: >16} | {3: >16}'.format('DOCS', 'TOKENS', 'deque (tok/s)', 'streaming (tok/s)')
+        for n in sizes:
+            docDir = dir
+            if docDir is None:
+                docDir = os.path.join(tmp, 'docs_{0}'.format(n))
+                os.mkdir(docDir)
+                writeSyntheticDocuments(docDir, n)
+            docs = readDocumentLines(docDir, n)
+            
+            old, new = countDeque(docs), countStreaming(docs)
+            if not all(sameCounts(a, b) for a, b in zip(old, new)):
+                print 'ERROR: counts differ at {0} documents'.format(n)
+            tokens = sum(v.numTokens for v in new)
+            del old, new
+            
+            print '{0: >10} | {1: >10} | {2: >16.0f} | {3: >16.0f}'.format(
+                len(docs), tokens, tokens / timeIt(lambda: countDeque(docs)), tokens / timeIt(lambda: countStreaming(docs)))
+    finally:
+        shutil.rmtree(tmp)
+
+BENCHMARKS = {
+    'rank': benchRank,
+    'summarize': benchSummarize,
+    'memory': benchMemory,
+    'load': benchLoad,
+    'tokenize': benchTokenize,
+}
+
+def printHelp():
+    print '\nUsage: python benchmark.py -b <benchmark> -n <sizes>'
+    print 'Options:'
+    print '\t-b <benchmark>\t--bench="<benchmark>"\tOne of: {0}'.format(', '.join(sorted(BENCHMARKS)))
+    print '\t-n <sizes>\t--sizes="<sizes>"\tComma separated problem sizes, such as numbers of documents'
+    print '\t-d <dir>\t--dir="<dir>"\t\tDirectory of documents to use instead of synthetic ones, for tokenize'
+    print '\n'
+
+def main(argv):
+    bench = ""
+    sizes = [10000, 100000, 1000000]
+    docDir = None
+
+    try:
+        opts, args = getopt.getopt(argv, "hb:n:d:", ["bench=", "sizes=", "dir="])
+    except getopt.GetoptError:
+        printHelp()
+        sys.exit(2)
+    for opt, arg in opts:
+        if opt == '-h':
+            printHelp()
+            sys.exit(1)
+        elif opt in ('-b', '--bench'):
+            bench = arg
+        elif opt in ('-n', '--sizes'):
+            sizes = [int(n) for n in arg.split(',')]
+        elif opt in ('-d', '--dir'):
+            docDir = arg
+
+    # Only tokenize reads documents from a directory
+    if bench not in BENCHMARKS or (docDir and bench != 'tokenize'):
+        printHelp()
+        sys.exit(2)
+
+    if docDir:
+        BENCHMARKS[bench](sizes, dir=docDir)
+    else:
+        BENCHMARKS[bench](sizes)
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
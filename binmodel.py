@@ -0,0 +1,492 @@
+#!/usr/bin/python2.7
+# binmodel.py
+# Jeremy Johnston
+
+""" Binary, memory-mapped model file format.
+
+    A text .model file costs a split(), float() and int() per line, and a Unigram or
+    Bigram object per line, before a single probability can be used. A binary model
+    file instead holds packed arrays that are mapped into memory, so opening a model
+    only reads its header and metadata, and pages of the file are touched only when
+    a feature is looked up.
+
+    Layout (little endian), each array section starting on an 8 byte boundary:
+
+        header          magic, version, numTokens, polarity, vocab sizes, section offsets
+        metadata        originFile, link, date, title as (length, bytes) pairs
+        string offsets  uint32[nVocab + 1], offsets into string data
+        string data     vocabulary bytes
+        unigram counts  uint32[nUni]
+        unigram probs   float64[nUni]
+        bigram rows     uint32[nUni + 1], CSR row pointers, one row per unigram
+        bigram columns  uint32[nBi], vocabulary id of word2, ascending in each row
+        bigram counts   uint32[nBi]
+        bigram probs    float64[nBi]
+
+    Vocabulary ids [0, nUni) are the unigram words, sorted. Ids [nUni, nVocab) are words
+    only ever seen as the second word of a bigram, also sorted, so any word can be found
+    by binary search.
+
+    Use as a converter for existing text model files:
+        python binmodel.py -i <model or dir> -o <model or dir>
+"""
+
+import sys
+import getopt
+import os
+import math
+import mmap
+import struct
+import array
+import logging
+from genModel import Unigram, Bigram, FeatureSet
+
+MAGIC = 'ALBM'
+VERSION = 1
+
+# magic, version, numTokens, polarity, nVocab, nUni, nBi, then 8 section offsets
+HEADER = struct.Struct('<4sIQiIII8Q')
+
+def isBinaryModel(fileName):
+    """ Return True if fileName starts with the binary model magic
+    """
+    file = open(fileName, 'rb')
+    try:
+        return file.read(len(MAGIC)) == MAGIC
+    finally:
+        file.close()
+
+def replaceFile(tempName, fileName):
+    """ Move the finished file tempName to fileName, in place of any file there.
+
+        The rename is atomic, so a reader that has the old file open or mapped, such as
+        rankserver.py during a rebuild, keeps reading the old file. Writing over it in
+        place would fault the reader's map. Windows will not rename over a file, so there
+        the old one is removed first.
+    """
+    try:
+        os.rename(tempName, fileName)
+    except OSError:
+        if not os.path.exists(fileName):
+            raise
+        os.remove(fileName)
+        os.rename(tempName, fileName)
+
+def alignFile(file):
+    """ Pad file so the next section starts on an 8 byte boundary, and return its offset
+    """
+    extra = file.tell() % 8
+    if extra:
+        file.write('\0' * (8 - extra))
+    return file.tell()
+
+def writeArray(file, typecode, values):
+    """ Write values as a little endian array section, and return its offset
+    """
+    a = array.array(typecode, values)
+    if sys.byteorder != 'little':
+        a.byteswap()
+    offset = alignFile(file)
+    a.tofile(file)
+    return offset
+
+def readArray(buf, typecode, offset, length):
+    """ Read a little endian array of length elements from buf at offset
+    """
+    a = array.array(typecode)
+    a.fromstring(buf[offset:offset + length * a.itemsize])
+    if sys.byteorder != 'little':
+        a.byteswap()
+    return a
+
+def writeStrings(file, strings):
+    """ Write a string table section, and return offsets of its (offsets, data) arrays
+    """
+    offsets = [0]
+    for s in strings:
+        offsets.append(offsets[-1] + len(s))
+    offOffsets = writeArray(file, 'I', offsets)
+    offData = alignFile(file)
+    file.write(''.join(strings))
+    return offOffsets, offData
+
+def stringAt(buf, offOffsets, offData, i):
+    """ Return string i of the string table at the given section offsets
+    """
+    start, end = struct.unpack_from('<II', buf, offOffsets + 4 * i)
+    return buf[offData + start:offData + end]
+
+def readStrings(buf, offOffsets, offData, n):
+    """ Return whole string table of n strings as a list
+    """
+    offsets = readArray(buf, 'I', offOffsets, n + 1)
+    data = buf[offData:offData + offsets[-1]]
+    return [data[offsets[i]:offsets[i + 1]] for i in xrange(n)]
+
+def searchStrings(buf, offOffsets, offData, word, lo, hi):
+    """ Binary search sorted range [lo, hi) of a string table for word. Return its index or -1
+    """
+    while lo < hi:
+        mid = (lo + hi) // 2
+        w = stringAt(buf, offOffsets, offData, mid)
+        if w < word:
+            lo = mid + 1
+        elif w > word:
+            hi = mid
+        else:
+            return mid
+    return -1
+
+def writeBinaryModel(modelFile, model):
+    """ Write FeatureSet model to modelFile in the binary model format
+    """
+
+    # Build the vocabulary: sorted unigram words, then sorted bigram-only words
+    uniWords = sorted(model.words.iterkeys())
+    extra = set()
+    for unigram in model.words.itervalues():
+        for word2 in unigram.bigrams.iterkeys():
+            if word2 not in model.words:
+                extra.add(word2)
+    vocab = uniWords + sorted(extra)
+    ids = dict((w, i) for i, w in enumerate(vocab))
+
+    uniCounts = []
+    uniProbs = []
+    biRows = [0]
+    biCols = []
+    biCounts = []
+    biProbs = []
+    for word in uniWords:
+        unigram = model.words[word]
+        uniCounts.append(unigram.count)
+        uniProbs.append(unigram.probability)
+        row = sorted((ids[w2], b) for w2, b in unigram.bigrams.iteritems())
+        for col, bigram in row:
+            biCols.append(col)
+            biCounts.append(bigram.count)
+            biProbs.append(bigram.probability)
+        biRows.append(len(biCols))
+
+    # Written aside and moved into place, see replaceFile()
+    tempName = modelFile + '.tmp'
+    try:
+        file = open(tempName, 'wb')
+
+        # Header is rewritten once the section offsets are known
+        file.write('\0' * HEADER.size)
+
+        for s in (model.originFile, model.link, model.date, model.title):
+            s = str(s).rstrip('\n')
+            file.write(struct.pack('<I', len(s)))
+            file.write(s)
+
+        offsets = list(writeStrings(file, vocab))
+        offsets.append(writeArray(file, 'I', uniCounts))
+        offsets.append(writeArray(file, 'd', uniProbs))
+        offsets.append(writeArray(file, 'I', biRows))
+        offsets.append(writeArray(file, 'I', biCols))
+        offsets.append(writeArray(file, 'I', biCounts))
+        offsets.append(writeArray(file, 'd', biProbs))
+
+        file.seek(0)
+        file.write(HEADER.pack(MAGIC, VERSION, model.numTokens, model.polarity,
+                               len(vocab), len(uniWords), len(biCols), *offsets))
+        file.close()
+        replaceFile(tempName, modelFile)
+    except:
+        print 'ERROR writing binary model file {0}'.format(modelFile)
+        raise
+
+class MappedWords():
+    """ Read-only stand-in for FeatureSet.words over a mapped binary model.
+
+        Supports the dict operations the rest of the code uses on words. Unigrams are
+        built on first access and kept, so repeat lookups of a term are dict lookups.
+    """
+
+    def __init__(self, mapped):
+        self.mapped = mapped
+        self.cache = {}
+
+    def __len__(self):
+        return self.mapped.nUni
+
+    def __contains__(self, word):
+        return word in self.cache or self.mapped.findUnigram(word) >= 0
+
+    def __getitem__(self, word):
+        if word in self.cache:
+            return self.cache[word]
+        i = self.mapped.findUnigram(word)
+        if i < 0:
+            raise KeyError(word)
+        unigram = self.mapped.unigramAt(i)
+        self.cache[word] = unigram
+        return unigram
+
+    def get(self, word, default=None):
+        try:
+            return self[word]
+        except KeyError:
+            return default
+
+    def iterkeys(self):
+        mapped = self.mapped
+        for i in xrange(mapped.nUni):
+            yield mapped.wordAt(i)
+
+    __iter__ = iterkeys
+
+    def keys(self):
+        return list(self.iterkeys())
+
+    def itervalues(self):
+        for word, unigram in self.iteritems():
+            yield unigram
+
+    def values(self):
+        return list(self.itervalues())
+
+    def iteritems(self):
+        # Load whole arrays at once rather than unpacking one element at a time
+        mapped = self.mapped
+        mapped.open()
+        buf = mapped.buf
+        nUni = mapped.nUni
+        vocab = readStrings(buf, mapped.offStrOffsets, mapped.offStrData, mapped.nVocab)
+        counts = readArray(buf, 'I', mapped.offUniCount, nUni)
+        probs = readArray(buf, 'd', mapped.offUniProb, nUni)
+        rows = readArray(buf, 'I', mapped.offBiRow, nUni + 1)
+        cols = readArray(buf, 'I', mapped.offBiCol, mapped.nBi)
+        biCounts = readArray(buf, 'I', mapped.offBiCount, mapped.nBi)
+        biProbs = readArray(buf, 'd', mapped.offBiProb, mapped.nBi)
+
+        for i in xrange(nUni):
+            word = vocab[i]
+            if word in self.cache:
+                yield word, self.cache[word]
+                continue
+            unigram = Unigram(word, counts[i], probs[i])
+            for j in xrange(rows[i], rows[i + 1]):
+                word2 = vocab[cols[j]]
+                unigram.bigrams[word2] = Bigram(word, word2, biCounts[j], biProbs[j])
+            yield word, unigram
+
+    def items(self):
+        return list(self.iteritems())
+
+class MappedFeatureSet(FeatureSet):
+    """ FeatureSet backed by a memory-mapped binary model file.
+
+        Opening reads only the header and metadata. The file is mapped on the first
+        feature lookup, and only the pages holding that feature are read. The model is
+        read-only; use FeatureSet.update() to copy it into a FeatureSet to modify it.
+
+        A map holds a file descriptor, so rank.py unmaps each model with close() once
+        it is scored. If the file was replaced by the time it is mapped again, as by a
+        rebuild, the new file's header is read.
+    """
+
+    def __init__(self, fileName):
+        FeatureSet.__init__(self, polarity=1)
+        self.modelFile = fileName
+        self.buf = None
+
+        file = open(fileName, 'rb')
+        try:
+            self.readHeader(file)
+        finally:
+            file.close()
+
+    def readHeader(self, file):
+        """ Read the header and metadata of open model file
+        """
+        fileName = self.modelFile
+        st = os.fstat(file.fileno())
+        self.stat = (st.st_ino, st.st_size, st.st_mtime)
+        file.seek(0)
+        header = file.read(HEADER.size)
+        fields = HEADER.unpack(header)
+        if fields[0] != MAGIC:
+            raise ValueError('{0} is not a binary model file'.format(fileName))
+        if fields[1] != VERSION:
+            raise ValueError('{0} has binary model version {1}, expected {2}'.format(fileName, fields[1], VERSION))
+        (self.numTokens, self.polarity, self.nVocab, self.nUni, self.nBi) = fields[2:7]
+        (self.offStrOffsets, self.offStrData, self.offUniCount, self.offUniProb,
+         self.offBiRow, self.offBiCol, self.offBiCount, self.offBiProb) = fields[7:]
+
+        meta = []
+        for i in range(4):
+            length, = struct.unpack('<I', file.read(4))
+            meta.append(file.read(length))
+        self.originFile, self.link, self.date, self.title = meta
+
+        self.words = MappedWords(self)
+
+    def open(self):
+        """ Map the model file, if not already mapped
+        """
+        if self.buf is None:
+            file = open(self.modelFile, 'rb')
+            try:
+                st = os.fstat(file.fileno())
+                if (st.st_ino, st.st_size, st.st_mtime) != self.stat:
+                    self.readHeader(file)
+                self.buf = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+            finally:
+                file.close()
+
+    def close(self):
+        """ Unmap the model file. It is mapped again on the next lookup.
+        """
+        if self.buf is not None:
+            self.buf.close()
+            self.buf = None
+
+    def _uint(self, offset, i):
+        return struct.unpack_from('<I', self.buf, offset + 4 * i)[0]
+
+    def _double(self, offset, i):
+        return struct.unpack_from('<d', self.buf, offset + 8 * i)[0]
+
+    def wordAt(self, i):
+        self.open()
+        return stringAt(self.buf, self.offStrOffsets, self.offStrData, i)
+
+    def _search(self, word, lo, hi):
+        self.open()
+        return searchStrings(self.buf, self.offStrOffsets, self.offStrData, word, lo, hi)
+
+    def findUnigram(self, word):
+        """ Return vocabulary id of unigram word, or -1 if not in model
+        """
+        if self.nUni == 0:
+            return -1
+        return self._search(word, 0, self.nUni)
+
+    def findWord(self, word):
+        """ Return vocabulary id of any word in model, or -1
+        """
+        i = self.findUnigram(word)
+        if i < 0 and self.nVocab > self.nUni:
+            i = self._search(word, self.nUni, self.nVocab)
+        return i
+
+    def unigramAt(self, i):
+        self.open()
+        return MappedUnigram(self, i, self.wordAt(i), self._uint(self.offUniCount, i), self._double(self.offUniProb, i))
+
+    def bigramsAt(self, i):
+        """ Return the bigrams of unigram i, as Unigram.bigrams
+        """
+        self.open()
+        word = self.wordAt(i)
+        bigrams = {}
+        for j in xrange(self._uint(self.offBiRow, i), self._uint(self.offBiRow, i + 1)):
+            word2 = self.wordAt(self._uint(self.offBiCol, j))
+            bigrams[word2] = Bigram(word, word2, self._uint(self.offBiCount, j), self._double(self.offBiProb, j))
+        return bigrams
+
+class MappedUnigram(Unigram):
+    """ Unigram of a mapped binary model. Its bigrams are read from the map on first use,
+        so a unigram query touches none of the bigram pages.
+    """
+    __slots__ = ('mapped', 'index')
+
+    def __init__(self, mapped, i, word, count, probability):
+        Unigram.__init__(self, word, count, probability)
+        self.mapped = mapped
+        self.index = i
+
+    @property
+    def bigrams(self):
+        if self._bigrams is None:
+            self._bigrams = self.mapped.bigramsAt(self.index)
+        return self._bigrams
+
+def readBinaryModel(fileName):
+    return MappedFeatureSet(fileName)
+
+def inferNumTokens(model):
+    """ Recover numTokens of a model read from a text model file.
+
+        Text model files do not store numTokens, but calculateProbabilities() gives each
+        unigram probability log2((count + 1) / (numTokens + V)), so it can be solved for.
+    """
+    V = len(model.words)
+    for unigram in model.words.itervalues():
+        return int(round((unigram.count + 1) / math.pow(2, unigram.probability))) - V
+    return 0
+
+def convertFile(inFile, outFile):
+    import rank
+
+    model = rank.readModel(inFile)
+    if isinstance(model, MappedFeatureSet):
+        print '{0} is already a binary model, skipping'.format(inFile)
+        return
+    model.numTokens = inferNumTokens(model)
+    print 'Converting {0} to {1}...'.format(inFile, outFile)
+    writeBinaryModel(outFile, model)
+
+def convert(input, output):
+    """ Convert a text model file, or a directory of them, to binary model files.
+
+        Converts in place if output is not given.
+    """
+    if not output:
+        output = input
+
+    try:
+        if os.path.isdir(input):
+            if not os.path.exists(output):
+                os.makedirs(output)
+            names = os.listdir(input)
+            names.sort()
+            for name in names:
+                if name.endswith('.model'):
+                    convertFile(os.path.join(input, name), os.path.join(output, name))
+        else:
+            convertFile(input, output)
+    except:
+        msg = "ERROR converting {0} to binary model format".format(input)
+        print msg
+        logging.error(msg)
+        raise
+
+def printHelp():
+    print '\nUsage: python binmodel.py -i <input> -o <output>'
+    print 'Converts text model files to the binary model format.'
+    print 'Options:'
+    print '\t-i <input>\t--input="<input>"\tText model file, or directory of model files'
+    print '\t-o <output>\t--output="<output>"\tBinary model file, or directory. Converts in place if not given'
+    print '\n'
+
+def main(argv):
+    input = ""
+    output = ""
+
+    try:
+        opts, args = getopt.getopt(argv, "hi:o:", ["input=", "output="])
+    except getopt.GetoptError:
+        printHelp()
+        sys.exit(2)
+    for opt, arg in opts:
+        if opt == '-h':
+            printHelp()
+            sys.exit(1)
+        elif opt in ('-i', '--input'):
+            input = arg
+        elif opt in ('-o', '--output'):
+            output = arg
+
+    if not os.path.exists(input):
+        print '\nPath {0} does not exist'.format(input)
+        sys.exit()
+
+    convert(input, output)
+    print '\nDONE\n\n'
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
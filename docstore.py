@@ -0,0 +1,338 @@
+#!/usr/bin/python2.7
+# docstore.py
+# Jeremy Johnston
+
+""" Sharded document store, in place of a directory of one text file per document.
+
+    readjson.py -s writes every item of a crawl into a store, rather than a file each,
+    so a large crawl is a few large files instead of tens of thousands of small ones.
+    genModel.py and extract.py read a store wherever they read a directory of documents.
+
+    A store is a directory holding shard files and an index. Each document is a record of
+    its text, in the layout of a document file (link, date, title, then one sentence per
+    line), and is named by its id, the order it was added in. Document id i of store
+    <store> is referred to as <store>#<i>, which openDocument() opens as it would a file.
+
+        <store>/docs_<n>.shard      records, a uint32 length then the document text
+        <store>/docs.index          where each record is
+
+    Index layout (little endian):
+
+        header          magic, version, nDocs
+        shards          uint32[nDocs], shard number of each document
+        offsets         uint32[nDocs], offset of each record in its shard
+        lengths         uint32[nDocs], length of each document text
+
+    Use as a converter for an existing directory of documents:
+        python docstore.py -i <dir> -o <store>
+"""
+
+import sys
+import getopt
+import os
+import struct
+import array
+import hashlib
+import StringIO
+
+MAGIC = 'ALBD'
+VERSION = 1
+
+# magic, version, nDocs
+HEADER = struct.Struct('<4sII')
+RECORD = struct.Struct('<I')
+
+INDEX_FILE = 'docs.index'
+SHARD_SIZE = 1 << 26        # A new shard is started once one reaches 64MB
+REF_SEPARATOR = '#'
+
+def shardFile(store, shard):
+    return os.path.join(store, 'docs_{0:05d}.shard'.format(shard))
+
+def isStore(path):
+    """ Return True if path is a document store
+    """
+    return os.path.isfile(os.path.join(path, INDEX_FILE))
+
+def documentRef(store, docId):
+    """ Return the name document docId of store is opened by, <store>#<docId>
+    """
+    return '{0}{1}{2}'.format(store, REF_SEPARATOR, docId)
+
+def splitRef(path):
+    """ Return (store, docId) of a document reference, or None if path is not one
+    """
+    store, sep, docId = path.rpartition(REF_SEPARATOR)
+    if not sep or not docId.isdigit() or not isStore(store):
+        return None
+    return store, int(docId)
+
+def toLittle(a):
+    if sys.byteorder != 'little':
+        a.byteswap()
+    return a
+
+class DocStore():
+    """ Read access to a document store by document id.
+
+        Shard files are opened on first use and kept open, so reading a document is a
+        seek and a read.
+    """
+
+    def __init__(self, store):
+        self.store = store
+        self.files = {}
+
+        fileName = os.path.join(store, INDEX_FILE)
+        file = open(fileName, 'rb')
+        try:
+            magic, version, nDocs = HEADER.unpack(file.read(HEADER.size))
+            if magic != MAGIC:
+                raise ValueError('{0} is not a document store index'.format(fileName))
+            if version != VERSION:
+                raise ValueError('{0} has document store version {1}, expected {2}'.format(fileName, version, VERSION))
+            self.shards, self.offsets, self.lengths = array.array('I'), array.array('I'), array.array('I')
+            for a in (self.shards, self.offsets, self.lengths):
+                a.fromfile(file, nDocs)
+                toLittle(a)
+        finally:
+            file.close()
+
+    def __len__(self):
+        return len(self.lengths)
+
+    def close(self):
+        for file in self.files.itervalues():
+            file.close()
+        self.files = {}
+
+    def names(self):
+        """ Return the name of each document, its id as a string, in id order
+        """
+        return [repr(i) for i in xrange(len(self))]
+
+    def read(self, docId):
+        """ Return the text of document docId
+        """
+        if not 0 <= docId < len(self):
+            raise KeyError('No document {0} in store {1}'.format(docId, self.store))
+        shard = self.shards[docId]
+        file = self.files.get(shard)
+        if file is None:
+            file = self.files[shard] = open(shardFile(self.store, shard), 'rb')
+        file.seek(self.offsets[docId] + RECORD.size)
+        text = file.read(self.lengths[docId])
+        if len(text) != self.lengths[docId]:
+            raise IOError('Document {0} of store {1} is cut short'.format(docId, self.store))
+        return text
+
+class DocStoreWriter():
+    """ Appends documents to a document store, creating it if need be.
+
+        Adding to a store that already exists, rather than writing its documents a
+        second time, must be asked for with append.
+
+        Records are written to the shards as documents are added, and the index when the
+        writer is flushed or closed, so a store is only ever seen with documents of finished writes.
+        Records after the last indexed one, left by a writer that did not close, are
+        written over.
+    """
+
+    def __init__(self, store, shardSize=SHARD_SIZE, append=False):
+        self.store = store
+        self.shardSize = shardSize
+
+        if isStore(store):
+            if not append:
+                raise ValueError('Document store {0} already exists, give append to add to it'.format(store))
+            existing = DocStore(store)
+            self.shards, self.offsets, self.lengths = existing.shards, existing.offsets, existing.lengths
+        else:
+            if not os.path.isdir(store):
+                os.makedirs(store)
+            self.shards, self.offsets, self.lengths = array.array('I'), array.array('I'), array.array('I')
+
+        self.file = None
+        self.openShard()
+
+    def __len__(self):
+        return len(self.lengths)
+
+    def openShard(self):
+        """ Continue the last shard from the end of its last indexed record
+        """
+        if self.file:
+            self.file.close()
+        self.shard, end = 0, 0
+        if len(self.lengths):
+            self.shard = self.shards[-1]
+            end = self.offsets[-1] + RECORD.size + self.lengths[-1]
+        self.file = open(shardFile(self.store, self.shard), 'r+b' if end else 'wb')
+        self.file.seek(end)
+        self.file.truncate()
+
+    def truncate(self, nDocs):
+        """ Drop documents from id nDocs on, as if never added
+        """
+        if nDocs < len(self.lengths):
+            del self.shards[nDocs:]
+            del self.offsets[nDocs:]
+            del self.lengths[nDocs:]
+            self.openShard()
+
+    def add(self, text):
+        """ Append document text to the store, and return its document id
+        """
+        offset = self.file.tell()
+        if offset and offset + RECORD.size + len(text) > self.shardSize:
+            self.file.close()
+            self.shard += 1
+            self.file = open(shardFile(self.store, self.shard), 'wb')
+            offset = 0
+        if offset + RECORD.size + len(text) >= 1 << 32:
+            raise ValueError('Document of {0} bytes is too large for store {1}'.format(len(text), self.store))
+
+        self.file.write(RECORD.pack(len(text)))
+        self.file.write(text)
+        self.shards.append(self.shard)
+        self.offsets.append(offset)
+        self.lengths.append(len(text))
+        return len(self.lengths) - 1
+
+    def close(self):
+        self.flush()
+        self.file.close()
+
+    def flush(self):
+        """ Write the index, so documents added so far are in the store
+        """
+        self.file.flush()
+
+        # Write then rename, so readers never see part of an index
+        fileName = os.path.join(self.store, INDEX_FILE)
+        tempName = fileName + '.tmp'
+        try:
+            file = open(tempName, 'wb')
+            file.write(HEADER.pack(MAGIC, VERSION, len(self.lengths)))
+            for a in (self.shards, self.offsets, self.lengths):
+                toLittle(array.array('I', a)).tofile(file)
+            file.close()
+            try:
+                os.rename(tempName, fileName)
+            except OSError:
+                # Windows will not rename over a file. Elsewhere the rename is atomic, so
+                # there is never a moment without an index, when the store would look
+                # like a directory of documents
+                if not os.path.exists(fileName):
+                    raise
+                os.remove(fileName)
+                os.rename(tempName, fileName)
+        except:
+            print 'ERROR writing document store index {0}'.format(fileName)
+            raise
+
+def listDocuments(dir):
+    """ Return the name of each document of dir, a directory of document files or a store.
+
+        Names of document files are sorted; names of store documents are their ids, in id order.
+    """
+    if isStore(dir):
+        return getStore(dir).names()
+    names = os.listdir(dir)
+    names.sort()
+    return names
+
+def documentPath(dir, name):
+    """ Return the path of document name of dir, a file path or a <store>#<id> reference
+    """
+    if isStore(dir):
+        return documentRef(dir, name)
+    return os.path.join(dir, name)
+
+# Stores opened by openDocument(), with the modification time of their index
+openStores = {}
+
+def getStore(store):
+    """ Return the DocStore of store, kept open between calls until its index changes
+    """
+    mtime = os.path.getmtime(os.path.join(store, INDEX_FILE))
+    if store in openStores and openStores[store][1] == mtime:
+        return openStores[store][0]
+    if store in openStores:
+        openStores[store][0].close()
+    openStores[store] = (DocStore(store), mtime)
+    return openStores[store][0]
+
+def openDocument(path, mode='r'):
+    """ Open document path, a file or a <store>#<id> reference, for reading
+    """
+    ref = splitRef(path)
+    if ref is None:
+        return open(path, mode)
+    return StringIO.StringIO(getStore(ref[0]).read(ref[1]))
+
+def hashDocument(path):
+    """ Return the sha1 of the text of document path, a file or a <store>#<id> reference
+    """
+    file = openDocument(path, 'rb')
+    try:
+        return hashlib.sha1(file.read()).hexdigest()
+    finally:
+        file.close()
+
+def convert(dir, store, append=False):
+    """ Copy each document of directory dir into store, in sorted name order, after any
+        documents already in store if append
+    """
+    writer = DocStoreWriter(store, append=append)
+    try:
+        for name in listDocuments(dir):
+            file = open(os.path.join(dir, name), 'rb')
+            try:
+                docId = writer.add(file.read())
+            finally:
+                file.close()
+            print '{0} -> {1}'.format(name, documentRef(store, docId))
+    finally:
+        writer.close()
+
+def printHelp():
+    print '\nUsage: python docstore.py -i <dir> -o <store> [-a]'
+    print '\t-i <dir>\t--input="<dir>"\t\tDirectory of document files'
+    print '\t-o <store>\t--output="<store>"\tDocument store to write them to, created if need be'
+    print '\t-a\t\t--append\t\tAdd them after the documents of an existing store. Without it, an existing store is an error'
+    print '\n'
+
+def main(argv):
+    input = ""
+    output = ""
+    append = False
+
+    try:
+        opts, args = getopt.getopt(argv, "hi:o:a", ["input=", "output=", "append"])
+    except getopt.GetoptError:
+        printHelp()
+        sys.exit(2)
+    for opt, arg in opts:
+        if opt == '-h':
+            printHelp()
+            sys.exit(1)
+        elif opt in ('-i', '--input'):
+            input = arg
+        elif opt in ('-o', '--output'):
+            output = arg
+        elif opt in ('-a', '--append'):
+            append = True
+
+    if not os.path.isdir(input) or not output:
+        printHelp()
+        sys.exit(2)
+
+    if isStore(output) and not append:
+        print '\nDocument store {0} already exists. Give -a to add to it'.format(output)
+        sys.exit(2)
+
+    convert(input, output, append)
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
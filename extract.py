@@ -15,12 +15,18 @@ import math
 from collections import deque
 import time
 import logging
+import itertools
 import rank
+import termtable
+import docstore
 from rank import readModel
 from genModel import Unigram, Bigram, FeatureSet
 
 logging.basicConfig(filename="extract.log", level=logging.DEBUG)
 
+# Term table or IDF table of each collection model file read, see loadCollection()
+collections = {}
+
 class Results():
     def __init__(self):
         self.query = []
@@ -36,9 +42,12 @@ class Results():
         self.summary = ""
         self.rank = 1000
         self.summaryCentrality = 0 
+        self.link = ""
+        self.title = ""
+        self.date = ""
         
 
-def summarize(sentences, model, colModel):
+def summarize(sentences, model, colModel, idf=None, tf=None):
     """ Summarize a listing of sentences by choosing most central sentence.
     
         Given a model over a set of sentences, and a collective model over the set of documents
@@ -50,46 +59,62 @@ def summarize(sentences, model, colModel):
         centrality(x) = (1/K) * SUM[all y](tf_idf_cosine(x,y))
         where x and y are sentences in document.
         
+        Rather than tf_idf_cosine() of every pair, each sentence is read once into its
+        term counts and norm, see sentenceVector(). With b(w) = (tf(w) * idf(w))^2,
+        
+        SUM_W(x,y) = SUM[w](b(w) * (count(w,x) * [w in y] + [w in x] * count(w,y)))
+        
+        so the sum over all y of tf_idf_cosine(x,y) is the dot product of x with the
+        sums of [w in y] / norm(y) and count(w,y) / norm(y) over the document. The
+        cosine of x with itself is then taken back out, as y ranges over the others.
+        
         Refer to p792 J&M 
+        
+        idf is the idfTable() of colModel, and tf the term frequencies of model, if
+        already found, such as from a term table. See termtable.py.
     """
     
     print 'Finding centralities over {0} sentences...'.format(len(sentences))
     
     # First fetch idf of each term in colModel, the count of the term
-    print '\t...computing idf values...'
-    idf = {} 
-    for unigram in colModel.words.itervalues():
-        idf[unigram.word] = unigram.count
+    if idf is None:
+        print '\t...computing idf values...'
+        idf = idfTable(colModel)
         
     # Fetch term frequencies; the number of bigrams here 
-    print '\t...computing tf values...'
-    tf = {} 
-    for unigram in model.words.itervalues(): 
-        tf[unigram.word] = len(unigram.bigrams) 
+    if tf is None:
+        print '\t...computing tf values...'
+        tf = {} 
+        for unigram in model.words.itervalues(): 
+            tf[unigram.word] = len(unigram.bigrams) 
         
     K = len(sentences) 
     
+    # Term counts and norm of each sentence, and their sums over the document
+    print '\t...computing sentence vectors...'
+    b = {}
+    vectors = [sentenceVector(s, tf, idf, b) for s in sentences]
+    present = {}
+    counts = {}
+    for vector, norm in vectors:
+        for w, count in vector.iteritems():
+            present[w] = present.get(w, 0) + 1 / norm
+            counts[w] = counts.get(w, 0) + count / norm
+    
     # Find centrality values 
     centralities = {}
     bestC = 0 
-    for s in sentences:
-        centralities[s] = 0 
-    
-    i = 0 
-    for x in sentences:
-        #print '\t...finding centrality for sentence #{0}...'.format(i)
+    for x, (vector, norm) in itertools.izip(sentences, vectors):
         c = 0
-        setY = []
-        setY.extend(sentences) 
-        setY.remove(x) 
-        for y in setY:
-            c += tf_idf_cosine(x, y, tf, idf)
+        cSelf = 0
+        for w, count in vector.iteritems():
+            c += b[w] * (count * present[w] + counts[w])
+            cSelf += b[w] * 2 * count
         
-        c = (1/K) * c 
+        c = (1/K) * (c / norm - cSelf / (norm * norm))
         centralities[x] = c 
         if c > bestC:
             bestC = c 
-        i += 1
         
     # Sort centralities, highest first 
     orderedS = sorted(centralities, key=centralities.__getitem__, reverse=True) 
@@ -98,6 +123,27 @@ def summarize(sentences, model, colModel):
     # EDIT: Reducing to top sentence, as sentence boundaries are such that a sentence might already be one or two sentences
     return [orderedS[0]], bestC  
     
+def idfTable(colModel):
+    """ Return the idf of each term of the collection model, the count of the term
+    """
+    idf = {} 
+    for unigram in colModel.words.itervalues():
+        idf[unigram.word] = unigram.count
+    return idf
+
+def loadCollection(colFile):
+    """ Return what summaries need of collection model file colFile, reading it only once per run.
+    
+        That is its TermTable, if genModel.py wrote one, else idfTable() of the whole model.
+    """
+    if colFile not in collections:
+        table = termtable.readTermTable(colFile)
+        if table is None:
+            print 'Reading collection model {0}...'.format(colFile)
+            table = idfTable(rank.readModel(colFile))
+        collections[colFile] = table
+    return collections[colFile]
+
 def tf_idf_cosine(x, y, tf, idf):
     """ Given two sentences x and y, finds tf_idf_cosine(x,y)
     
@@ -153,6 +199,24 @@ def tf_idf_cosine(x, y, tf, idf):
     return cosine 
             
     
+def sentenceVector(sentence, tf, idf, b):
+    """ Return (counts, norm) of a sentence, as used by tf_idf_cosine().
+    
+        counts maps each term with a nonzero tf * idf to its count in the sentence, and
+        norm is sqrt(1 + SUM[terms](tf * idf)^2). b caches (tf * idf)^2 of each term.
+    """
+    counts = {}
+    SUM_X = 1 
+    for term in sentence.split():
+        tfX = getFreq(tf, term)
+        idfX = getFreq(idf, term)
+        SUM_X += math.pow(tfX * idfX, 2)
+        if term not in b:
+            b[term] = tfX * tfX * idfX * idfX
+        if b[term]:
+            counts[term] = counts.get(term, 0) + 1
+    return counts, math.sqrt(SUM_X)
+
 def getFreq(freqlist, term):
     if term in freqlist:
         return freqlist[term] 
@@ -172,6 +236,9 @@ def printHelp():
     print 'Options:'
     print '\t-i <input>\t--input="<input>"\tGive rank result file as input'
     print '\t-o <output>\t--output="<output>"\tName of generated summary file'
+    print '\t-a\t--all\tSummarize every result in <input>, not only the top two'
+    print '\t-d <dir>\t--dir="<dir>"\tSummarize every result of every .result file in <dir>, instead of <input>'
+    print '\t--workers=<N>\tSummarize on a pool of N processes'
     print '\n'
 
 def readResults(fileName):
@@ -241,7 +308,7 @@ def readDoc(filename, result):
     print 'Reading document: {0}'.format(filename)
     
     try:
-        file = open(filename) 
+        file = docstore.openDocument(filename) 
          
         # Get the metadata 
         result.link = file.readline().rstrip().lower() 
@@ -279,18 +346,100 @@ def printMetrics(list):
     print 'Comparing top two results, PR difference = ', pdiff 
     print 'Comparing centralities, Centrality diffrence = ', cdiff
         
-def printSummary(result):
-    print '\n\nRank {0} result'.format(result.rank)
-    print '-----------'
-    print 'Link: ', result.model.link.strip() 
-    print 'Title: ', result.model.title.strip() 
-    print 'Date: ', result.model.date.strip()
-    print 'Summary Centrality: ', result.summaryCentrality 
-    print 'Summary: '
+def formatSummary(result):
+    lines = ['\n\nRank {0} result'.format(result.rank)]
+    lines.append('-----------')
+    lines.append('Link:  {0}'.format(result.link))
+    lines.append('Title:  {0}'.format(result.title))
+    lines.append('Date:  {0}'.format(result.date))
+    lines.append('Summary Centrality:  {0}'.format(result.summaryCentrality))
+    lines.append('Summary: ')
     for s in result.summary:
-        print s.strip()
+        lines.append(s.strip())
+    return '\n'.join(lines) + '\n'
+
+def printSummary(result):
+    sys.stdout.write(formatSummary(result))
+
+def summarizeResult(args):
+    """ Summarize the origin document of one result. Worker process entry point.
+    
+        Returns (summary, centrality, link, title, date) of the document.
+    """
+    originFile, modelFile, colFile = args
+    
+    # Get document sentences
+    result = Results()
+    readDoc(originFile, result)
+    
+    # Get document model, and the idf table of the collective model, read once per run
+    model = rank.readModel(modelFile)
+    table = loadCollection(colFile)
+    if isinstance(table, dict):
+        idf = table
+        tf = None
+    else:
+        # Only look up the terms of this document
+        words = set()
+        for sentence in result.sentences:
+            words.update(sentence.split())
+        idf = table.idfTable(words)
+        tf = table.tfTable(modelFile)
+    
+    # Perform summarization over origin document 
+    summary, centrality = summarize(result.sentences, model, None, idf, tf)
+    return summary, centrality, model.link.strip(), model.title.strip(), model.date.strip()
+
+def summarizeResults(results, workers=1):
+    """ Summarize the origin document of each result, on a pool of workers if more than one
+    """
+    # Read each collection model before the pool starts, so workers share the idf tables
+    for result in results:
+        loadCollection(result.colFile)
+    
+    jobs = [(result.originFile, result.modelFile, result.colFile) for result in results]
+    if workers > 1:
+        import multiprocessing
+        
+        pool = multiprocessing.Pool(workers)
+        try:
+            # Summaries come back in order of results
+            summaries = list(pool.imap(summarizeResult, jobs))
+            pool.close()
+        except:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+    else:
+        summaries = [summarizeResult(job) for job in jobs]
+    
+    for result, (summary, centrality, link, title, date) in itertools.izip(results, summaries):
+        result.summary = summary
+        result.summaryCentrality = centrality
+        result.link = link
+        result.title = title
+        result.date = date
 
-def getTopResult(resultFile, summaryFile):
+def writeSummaries(summaryFile, batches):
+    """ Write summaries of every (resultFile, resultlist) batch to summaryFile
+    """
+    try:
+        file = open(summaryFile, 'w')
+        for resultFile, resultlist in batches:
+            file.write('Summaries of results in {0}, for query: {1}\n'.format(resultFile, resultlist[0].query if resultlist else ''))
+            for result in resultlist:
+                file.write(formatSummary(result))
+            file.write('\n\n')
+    except:
+        msg = "ERROR writing summary file {0}".format(summaryFile)
+        print msg 
+        logging.error(msg)
+        raise
+    else:
+        file.close()
+
+def getTopResult(resultFile, summaryFile, workers=1):
     # Get results
     resultlist, NR, ND = readResults(resultFile)
     
@@ -300,29 +449,43 @@ def getTopResult(resultFile, summaryFile):
     # Let us compare the top two results 
     #print resultlist
     top2 = [resultlist[0], resultlist[1]]
-    
-    # Get document sentences
-    for result in top2:
-        readDoc(result.originFile, result)
-        
-        # Get top document model and collective model 
-        result.model = rank.readModel(result.modelFile)
-        result.colModel = rank.readModel(result.colFile)
-        
-        # Perform summarization over origin document 
-        result.summary, result.summaryCentrality = summarize(result.sentences, result.model, result.colModel)
+    summarizeResults(top2, workers)
     
     printRecall(resultlist, NR, ND)
     printMetrics(top2)
     printSummary(resultlist[0])
     printSummary(resultlist[1])
+    
+    if summaryFile:
+        writeSummaries(summaryFile, [(resultFile, top2)])
+
+def getAllResults(resultFiles, summaryFile, workers=1):
+    """ Summarize every result of every file in resultFiles into summaryFile
+    """
+    batches = []
+    for resultFile in resultFiles:
+        resultlist, NR, ND = readResults(resultFile)
+        batches.append((resultFile, resultlist))
+    
+    # One pool over the results of all files
+    summarizeResults([result for resultFile, resultlist in batches for result in resultlist], workers)
+    
+    for resultFile, resultlist in batches:
+        print 'Summarized {0} results of {1}'.format(len(resultlist), resultFile)
+    
+    if summaryFile:
+        print 'Writing summary file {0}'.format(summaryFile)
+        writeSummaries(summaryFile, batches)
         
 def main(argv):
     resultFile = ""              
     summaryFile = ""             
+    resultDir = ""          # Directory of result files to summarize all of
+    allResults = False      # Summarize every result, not only the top two
+    workers = 1             # Processes summarizing documents
     
     try:
-        opts, args = getopt.getopt(argv, "hi:o:",["input=", "output="])
+        opts, args = getopt.getopt(argv, "hi:o:ad:",["input=", "output=", "all", "dir=", "workers="])
     except getopt.GetoptError:
         printHelp()
         sys.exit(2)
@@ -334,11 +497,27 @@ def main(argv):
             resultFile = arg 
         elif opt in ('-o', '--output'):
             summaryFile = arg 
+        elif opt in ('-a', '--all'):
+            allResults = True
+        elif opt in ('-d', '--dir'):
+            resultDir = arg
+        elif opt == '--workers':
+            workers = int(arg)
+    
+    if resultDir:
+        if not checkPath(resultDir):
+            sys.exit()
+        names = sorted(n for n in os.listdir(resultDir) if n.endswith('.result'))
+        getAllResults([os.path.join(resultDir, n) for n in names], summaryFile, workers)
+        return
             
     if not checkPath(resultFile):
         sys.exit()
     
-    getTopResult(resultFile, summaryFile)
+    if allResults:
+        getAllResults([resultFile], summaryFile, workers)
+    else:
+        getTopResult(resultFile, summaryFile, workers)
    
   
 if __name__ == "__main__":
@@ -10,13 +10,26 @@ import sys
 import getopt
 import os
 import math
-from collections import deque
+from itertools import izip, islice
 import time
 import logging
+import json
+import uuid
+import docstore
 
 logging.basicConfig(filename="genModel.log", level=logging.DEBUG)
 
-class FeatureSet():
+MANIFEST_VERSION = 1
+GENERATION_FILE = 'GENERATION'
+
+# Line of a text model file between its unigrams and its bigrams, see writeTextModelFile()
+BIGRAM_SECTION = 'BIGRAMS'
+
+class FeatureSet(object):
+    # Loaded models number in the thousands, so attributes are slots, not a __dict__ each
+    __slots__ = ('words', 'numTokens', 'polarity', 'queryProbability', 'rank',
+                 'originFile', 'modelFile', 'link', 'date', 'title')
+    
     def __init__(self, polarity):
         self.words = {} # dictionary of (word, unigram) pairs, and our feature set
         self.numTokens = 0 
@@ -109,6 +122,25 @@ class FeatureSet():
             self.updateUnigrams(unigram)
             for bigram in unigram.bigrams.itervalues():
                 self.updateBigrams(bigram)
+    
+    def subtract(self, vector):
+        """ Take the counts of vector back out of the model, dropping features that reach zero
+        """
+        self.numTokens -= vector.numTokens
+        
+        for unigram in vector.words.itervalues():
+            if unigram.word not in self.words:
+                continue
+            mine = self.words[unigram.word]
+            mine.count -= unigram.count
+            if mine.count <= 0:
+                del self.words[unigram.word]
+                continue
+            for bigram in unigram.bigrams.itervalues():
+                if bigram.word2 in mine.bigrams:
+                    mine.bigrams[bigram.word2].count -= bigram.count
+                    if mine.bigrams[bigram.word2].count <= 0:
+                        del mine.bigrams[bigram.word2]
             
     def calculateProbabilities(self):
         ''' Finds Log MLE Probability of each feature.
@@ -175,16 +207,29 @@ class FeatureSet():
                     
         return value
             
-class Unigram():
+class Unigram(object):
+    # Models hold millions of features, so attributes are slots, not a __dict__ each
+    __slots__ = ('word', 'count', 'probability', '_bigrams')
+    
     def __init__(self, word, count, probability):
         self.word = word 
         self.count = count 
         self.probability = probability
         
-        # Let a unigram word keep track of it's bigrams
-        self.bigrams = {} # Pairs (Word2, Bigram) for this unigram Word1
+        # Let a unigram word keep track of it's bigrams, made on first use
+        self._bigrams = None
+    
+    @property
+    def bigrams(self):
+        """ Pairs (Word2, Bigram) for this unigram Word1
+        """
+        if self._bigrams is None:
+            self._bigrams = {}
+        return self._bigrams
         
-class Bigram():
+class Bigram(object):
+    __slots__ = ('word1', 'word2', 'count', 'probability')
+    
     def __init__(self, word1, word2, count, probability):
         self.word1 = word1      # Word W_i
         self.word2 = word2      # Word W_i+1
@@ -194,35 +239,63 @@ class Bigram():
 ###################################################################################################
 ###################################################################################################
 
-def processUnigram(word, vector):
-    """ Adds feature to vector or increases its count in vector
+def tokenLines(lines):
+    """ Yield the tokens of each of lines, lowercased once per line
     """
+    for line in lines:
+        yield line.lower().split()
 
-    unigram, exists = vector.getUnigram(word)
-    vector.addUnigram(word)
+def tokenPairs(tokens):
+    """ Return an iterator over each adjacent pair (prevWord, word) of tokens
+    """
+    return izip(tokens, islice(tokens, 1, None))
+
+def countTokens(tokens, vector):
+    """ Count features of one line of tokens into vector, the feature set of a single document.
     
-def processFeature(prevWord, word, vector):
-    """ Adds feature to vector or increases its count in vector
+        A line of one token counts it as a unigram once more. Otherwise each adjacent pair
+        (prevWord, word) adds unigram prevWord and bigram (prevWord, word) if not already in
+        vector, so a document counts each at most once; the last word of a line is left for
+        its bigrams to carry.
     """
+    vector.numTokens += len(tokens)
     
-    # We add feature whether it exists or not
-    unigram, exists = vector.getUnigram(prevWord)
-    if not exists:
-        vector.addUnigram(prevWord)
-  
-        
-    bigram, exists = vector.getBigram(prevWord, word)
-    if not exists:
-        vector.addBigram(prevWord, word)
-   
-        
+    # Handle special case of 1 token
+    if len(tokens) == 1:
+        vector.addUnigram(tokens[0])
+        return
     
+    # One dict lookup for the unigram and one for its bigram per pair
+    words = vector.words
+    for prevWord, word in tokenPairs(tokens):
+        unigram = words.get(prevWord)
+        if unigram is None:
+            unigram = words[prevWord] = Unigram(prevWord, count=1, probability=0)
+        bigrams = unigram.bigrams
+        if word not in bigrams:
+            bigrams[word] = Bigram(prevWord, word, count=1, probability=0)
     
-def readFile(filename, model):
+def readFile(filename, model, collection=None):
+    """ Count features of document filename into model, and into collection if given
+    """
+    try:
+        file = docstore.openDocument(filename)
+    except:
+        print "ERROR reading file: {0}".format(filename)
+        raise
+    try:
+        readDocument(file, filename, model, collection)
+    finally:
+        file.close()
+
+def readDocument(file, filename, model, collection=None):
+    """ Count features of the lines of document file, named filename, into model, and into collection if given.
+    
+        file may be any iterable of lines with readline(), such as a StringIO of document text
+        never written to disk, see alembic/pipelines.py.
+    """
+    lineNum = 0 
     try:
-        file = open(filename)
-        lineNum = 0 
-        
         # Feature set just for this file
         vector = FeatureSet(model.polarity)
         
@@ -232,60 +305,34 @@ def readFile(filename, model):
         model.date = file.readline().rstrip().lower() 
         model.title = file.readline().rstrip().lower() 
         
-        # Process some of the metadata as part of language model 
-        processLine(model.link, vector)
-        processLine(model.date, vector)
-        processLine(model.title, vector)
-        
-        # Process each sentence for unigram and bigram features
-        for line in file:
-            processLine(line,vector)
+        # Process some of the metadata as part of language model, then each sentence
+        # for unigram and bigram features, streaming the file line by line
+        for tokens in tokenLines((model.link, model.date, model.title)):
+            countTokens(tokens, vector)
+        for tokens in tokenLines(file):
+            countTokens(tokens, vector)
             lineNum += 1
         
         # Tally each feature in vector and add to model
         model.update(vector)
+        if collection:
+            collection.update(vector)
          
     except:
         print "ERROR reading file: {0} at line number {1}".format(filename, lineNum)
         raise 
-    else:
-        file.close()
 
 def processLine(line, vector):
-    line.rstrip()
-    tokens = line.split()
-    
-    vector.numTokens += len(tokens)
-    
-    # Handle special case of 1 token
-    if len(tokens) == 1 :
-        processUnigram(tokens[0].lower(), vector)
-    # Handle normal line of at least two tokens (for zero tokens we do nothing)        
-    elif len(tokens) >= 2 :
-        q = deque(tokens)
-        
-        prevWord = q.popleft().lower() 
-        word = q.popleft().lower()  
-        
-        processFeature(prevWord, word, vector) 
-        
-        prevWord = word 
-        
-        for t in q:
-            word = t.lower()  
-            
-            processFeature(prevWord, word, vector)
-            
-            prevWord = word 
-            
+    """ Count features of line into vector, see countTokens()
+    """
+    countTokens(line.lower().split(), vector)
         
 def read_with_10fold_validation(directory, models):
     names = []
     parts = [[]] * 10
     subsets = [[]] * 10
     try:
-        names = os.listdir(directory)
-        names.sort()   
+        names = docstore.listDocuments(directory)
         
         logging.debug("Sorted file names of directory {0} are: {1}".format(directory, names))
         
@@ -311,15 +358,31 @@ def readReviewDirectory(directory, fileNames, model):
  
     try:       
         for name in fileNames:
-            fullPath = os.path.join(directory, name)
+            fullPath = docstore.documentPath(directory, name)
             readFile(fullPath, model)
         
     except:
         print "ERROR: Problem reading directory at path {0}".format(directory)
         raise 
 
-def writeModelFile(modelFile, model):
+def writeModelFile(modelFile, model, binary=True, sort=False):
+    """ Write model to modelFile, in the binary model format unless binary is False
+    
+        A text model's words are written in sorted order if sort, else in the order of its
+        dicts. Binary models order their words themselves, see binmodel.py.
+    """
+    if binary:
+        import binmodel
+        binmodel.writeBinaryModel(modelFile, model)
+    else:
+        writeTextModelFile(modelFile, model, sort)
+
+def writeTextModelFile(modelFile, model, sort=False):
     try:
+        words = model.words.values()
+        if sort:
+            words.sort(key=lambda unigram: unigram.word)
+        
         file = open(modelFile, 'w')
         
         # Write the metadata
@@ -328,13 +391,17 @@ def writeModelFile(modelFile, model):
         file.write('{0}\n'.format(model.date))
         file.write('{0}\n'.format(model.title))
         
-        # Write probabilities
-        for unigram in model.words.itervalues():
-            # Write the unigram probability 
+        # Write the unigram probabilities
+        for unigram in words:
             file.write('{0} {1} {2}\n'.format(unigram.probability, unigram.word, unigram.count))
-            
-            # Then the bigrams for that word
-            for bigram in unigram.bigrams.itervalues():
+        
+        # Then the bigrams after a section line, so readers after only unigrams stop there
+        file.write('{0}\n'.format(BIGRAM_SECTION))
+        for unigram in words:
+            bigrams = unigram.bigrams.values()
+            if sort:
+                bigrams.sort(key=lambda bigram: bigram.word2)
+            for bigram in bigrams:
                 file.write('{0} {1} {2} {3}\n'.format(bigram.probability, bigram.word1, bigram.word2, bigram.count))
         
         
@@ -345,13 +412,12 @@ def writeModelFile(modelFile, model):
     else:
         file.close()
 
-def modeAll(dir, modelFilePrefix):        
+def modeAll(dir, modelFilePrefix, binary=True):        
     print "\nStarting modeAll, generate model over collection of docs from ", dir
     # Get doc names 
     names = []
     try:
-        names = os.listdir(dir)
-        names.sort()   
+        names = docstore.listDocuments(dir)
         logging.debug("Sorted file names of directory {0} are: {1}".format(dir, names))
     except:
         print "ERROR: Problem reading directory at path {0}".format(dir)
@@ -362,6 +428,14 @@ def modeAll(dir, modelFilePrefix):
     # Process all documents into one model
     readReviewDirectory(dir, names, model)
     
+    writeCollectionModel(dir, modelFilePrefix, model, binary)
+
+def writeCollectionModel(dir, modelFilePrefix, model, binary=True, terms=None):
+    """ Find probabilities of collection model over documents in dir and write it to <modelFilePrefix>_all.model
+    
+        Also writes its term table, <modelFilePrefix>_all.terms, with the term frequency
+        vectors of the document models collected in terms, if given. See termtable.py.
+    """
     model.calculateProbabilities()
     
     # Correct the model metadata for a collection model 
@@ -371,54 +445,433 @@ def modeAll(dir, modelFilePrefix):
     model.originFile = dir
 
     fileName = modelFilePrefix + '_' + 'all.model'
-    writeModelFile(fileName, model)
+    # Sorted, as a collection merged from worker processes fills its dicts in another order
+    writeModelFile(fileName, model, binary, sort=True)
+    
+    import termtable
+    if terms is None:
+        terms = termtable.TermTableBuilder()
+    terms.write(termtable.termTableFile(fileName), model)
+
+def modeBoth(dir, modelFilePrefix, binary=True, index=False, workers=1):
+    """ Generate the model of each document and the collection model in one pass.
+    
+        Each document is read once, and its counts merged into the collection model as
+        its own model is written, instead of modeAll() reading every document again.
+    """
+    print "\nStarting modeBoth, generate model for each doc and over collection of docs from ", dir
+    
+    import termtable
+    collection = FeatureSet(polarity=1)
+    terms = termtable.TermTableBuilder()
+    modeEach(dir, modelFilePrefix, binary, index, collection, workers, terms)
+    writeCollectionModel(dir, modelFilePrefix, collection, binary, terms)
+        
+def buildDocument(i, fullPath, modelFilePrefix, binary=True, builders=(), collection=None):
+    """ Read document fullPath and write its model file <modelFilePrefix>_<i>.model
+    
+        Each of builders, such as an invindex.IndexBuilder, is given the model with add().
+    """
+    model = FeatureSet(polarity = 1)
+    
+    # Read each file, counting unigrams and bigrams as we do
+    print 'Reading file {0}...'.format(fullPath)
+    readFile(fullPath, model, collection)
+    writeDocumentModel(i, model, modelFilePrefix, binary, builders)
+
+def writeDocumentModel(i, model, modelFilePrefix, binary=True, builders=()):
+    """ Calculate probabilities of document model and write it to model file <modelFilePrefix>_<i>.model
+    
+        Each of builders is given the model with add(). Returns the model file name.
+    """
+    # Find Log MLE probabilities based on counts
+    print '\tCalculating log MLE probabilities of unigram and bigram features...'
+    model.calculateProbabilities()
+    
+    # Write to model file
+    fileName = modelFilePrefix + '_' + repr(i) + '.model'
+    print '\tWriting to model file: {0}...'.format(fileName)
+    writeModelFile(fileName, model, binary)
+    
+    for builder in builders:
+        builder.add(fileName, model)
+    return fileName
+
+class PartialCollection():
+    """ Collection counts of a run of documents, built by a worker process.
+    
+        FeatureSet.update() gives a unigram new to the model a count of 1 rather than
+        its count in the document. So a worker keeps exact sums, and the count of each
+        unigram in the first document it saw it in, and mergeInto() applies them to the
+        collection model with the same result as reading the documents in turn.
+    """
+    def __init__(self):
+        self.model = FeatureSet(polarity=1)
+        self.first = {}     # word -> count in the first document containing it
+    
+    def update(self, vector):
+        model = self.model
+        model.numTokens += vector.numTokens
+        
+        for unigram in vector.words.itervalues():
+            word = unigram.word
+            if word in model.words:
+                model.words[word].count += unigram.count
+            else:
+                model.words[word] = Unigram(word, count=unigram.count, probability=0)
+                self.first[word] = unigram.count
+            bigrams = model.words[word].bigrams
+            for bigram in unigram.bigrams.itervalues():
+                if bigram.word2 in bigrams:
+                    bigrams[bigram.word2].count += bigram.count
+                else:
+                    bigrams[bigram.word2] = Bigram(word, bigram.word2, count=bigram.count, probability=0)
+    
+    def mergeInto(self, collection):
+        collection.numTokens += self.model.numTokens
         
-def modeEach(dir, modelFilePrefix):
+        for unigram in self.model.words.itervalues():
+            word = unigram.word
+            if word in collection.words:
+                collection.words[word].count += unigram.count
+            else:
+                collection.addUnigram(word)
+                collection.words[word].count += unigram.count - self.first[word]
+            bigrams = collection.words[word].bigrams
+            for bigram in unigram.bigrams.itervalues():
+                if bigram.word2 in bigrams:
+                    bigrams[bigram.word2].count += bigram.count
+                else:
+                    bigrams[bigram.word2] = Bigram(word, bigram.word2, count=bigram.count, probability=0)
+
+def buildChunk(args):
+    """ Worker process entry point. Build models of a run of (i, fullPath) documents.
+    
+        Returns the PartialCollection of the run, if asked for, and a new builder of each
+        of the given builder classes, given the models of the run.
+    """
+    chunk, modelFilePrefix, binary, builderClasses, collect = args
+    
+    builders = [builderClass() for builderClass in builderClasses]
+    partial = None
+    if collect:
+        partial = PartialCollection()
+    
+    for i, fullPath in chunk:
+        buildDocument(i, fullPath, modelFilePrefix, binary, builders, partial)
+    
+    return partial, builders
+
+def buildDocuments(docs, modelFilePrefix, binary=True, builders=(), collection=None, workers=1):
+    """ Build the model of each (i, fullPath) document in docs.
+    
+        With more than one worker, documents are split into runs built by a process
+        pool, and runs are merged in order, so output is the same as one process.
+    """
+    if workers > 1:
+        import multiprocessing
+        
+        # Several runs per worker, so one slow run does not hold up the others
+        size = max(1, int(math.ceil(len(docs) / (workers * 4))))
+        builderClasses = [builder.__class__ for builder in builders]
+        chunks = [(docs[j:j + size], modelFilePrefix, binary, builderClasses, collection is not None)
+                  for j in range(0, len(docs), size)]
+        
+        pool = multiprocessing.Pool(workers)
+        try:
+            # Results come back in order, so merge each run while later ones are built
+            for partial, partialBuilders in pool.imap(buildChunk, chunks):
+                if partial:
+                    partial.mergeInto(collection)
+                for builder, partialBuilder in zip(builders, partialBuilders):
+                    builder.merge(partialBuilder)
+            pool.close()
+        except:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+    else:
+        # Read, process, and write each in turn. The upside here is in case of failure, we can resume from the point of failure.
+        for i, fullPath in docs:
+            buildDocument(i, fullPath, modelFilePrefix, binary, builders, collection)
+
+def modeEach(dir, modelFilePrefix, binary=True, index=False, collection=None, workers=1, terms=None):
+    """ Generate a model file for each document in dir.
+    
+        If collection is given, the counts of each document are also added to it, and
+        if terms is given, its term frequency vector to that TermTableBuilder.
+        Also writes the vocabulary of the models, see vocab.py.
+        Also writes the build manifest used by modeUpdate().
+    """
     print "\nStarting modeEach, generate model for each doc in ", dir
     # Get doc names 
     names = []
     try:
-        names = os.listdir(dir)
-        names.sort()   
+        names = docstore.listDocuments(dir)
         logging.debug("Sorted file names of directory {0} are: {1}".format(dir, names))
     except:
         print "ERROR: Problem reading directory at path {0}".format(dir)
         raise 
+    
+    import vocab
+    vocabulary = vocab.Vocabulary()
+    builders = [vocabulary]
+    builder = None
+    if index:
+        import invindex
+        builder = invindex.IndexBuilder()
+        builders.append(builder)
+    if terms:
+        builders.append(terms)
+    
+    docs = [(i, docstore.documentPath(dir, names[i])) for i in range(len(names))]
+    buildDocuments(docs, modelFilePrefix, binary, builders, collection, workers)
+    
+    if builder:
+        writeIndex(modelFilePrefix, builder)
+    writeVocabulary(modelFilePrefix, vocabulary)
+    
+    manifest = {'docs': {}, 'nextId': len(names), 'collection': collection is not None}
+    for i, fullPath in docs:
+        manifest['docs'][names[i]] = {'hash': hashFile(fullPath), 'id': i}
+    writeManifest(modelFilePrefix, manifest)
+
+def writeIndex(modelFilePrefix, builder):
+    indexFile = modelFilePrefix + '.index'
+    print 'Writing inverted index file: {0}...'.format(indexFile)
+    builder.write(indexFile)
 
-    models = [] 
+def writeVocabulary(modelFilePrefix, vocabulary):
+    vocabFile = modelFilePrefix + '.vocab'
+    print 'Writing vocabulary file: {0}...'.format(vocabFile)
+    vocabulary.write(vocabFile)
+
+def hashFile(fileName):
+    """ Return the sha1 of document fileName, a file or a document store reference
+    """
+    return docstore.hashDocument(fileName)
+
+def readManifest(modelFilePrefix):
+    """ Return build manifest of models at modelFilePrefix, or None if there is none.
     
-    # Read, process, and write each in turn. The upside here is in case of failure, we can resume from the point of failure.
-    for i in range(len(names)):
-        models.append(FeatureSet(polarity = 1))
-        fullPath = os.path.join(dir, names[i])
-        # Read each file, counting unigrams and bigrams as we do
-        print 'Reading file {0}...'.format(fullPath)
-        readFile(fullPath, models[i])
+        The manifest maps each document name to its content hash and model id, and
+        records whether <modelFilePrefix>_all.model was built from the same documents.
+    """
+    manifestFile = modelFilePrefix + '.manifest'
+    if not os.path.exists(manifestFile):
+        return None
+    try:
+        file = open(manifestFile)
+        manifest = json.load(file)
+        file.close()
+    except:
+        print 'ERROR reading manifest file {0}'.format(manifestFile)
+        raise
+    if manifest.get('version') != MANIFEST_VERSION:
+        return None
+    return manifest
+
+def writeManifest(modelFilePrefix, manifest):
+    manifestFile = modelFilePrefix + '.manifest'
+    manifest['version'] = MANIFEST_VERSION
+    try:
+        file = open(manifestFile, 'w')
+        json.dump(manifest, file, indent=1, sort_keys=True)
+    except:
+        print 'ERROR writing manifest file {0}'.format(manifestFile)
+        raise
+    else:
+        file.close()
+
+def writeGeneration(modelFilePrefix):
+    """ Stamp the directory of the model files at modelFilePrefix with a new build generation.
     
-        # Find Log MLE probabilities based on counts
-        print '\tCalculating log MLE probabilities of unigram and bigram features...'
-        models[i].calculateProbabilities()
-        
-        # Write to model file
-        fileName = modelFilePrefix + '_' + repr(i) + '.model'
-        print '\tWriting to model file: {0}...'.format(fileName)
-        writeModelFile(fileName, models[i])
+        Written after every build, so readers such as querycache.py can tell a model set
+        has changed without reading it.
+    """
+    generationFile = os.path.join(os.path.dirname(modelFilePrefix), GENERATION_FILE)
+    try:
+        file = open(generationFile, 'w')
+        file.write('{0}\n'.format(uuid.uuid4().hex))
+    except:
+        print 'ERROR writing generation file {0}'.format(generationFile)
+        raise
+    else:
+        file.close()
+
+def readGeneration(dir):
+    """ Return the build generation written to dir by writeGeneration(), or None if there is none
+    """
+    generationFile = os.path.join(dir, GENERATION_FILE)
+    if not os.path.exists(generationFile):
+        return None
+    file = open(generationFile)
+    try:
+        return file.read().strip()
+    finally:
+        file.close()
+
+def copyModel(model):
+    """ Return a FeatureSet with the same counts as model, such as a mapped binary model
+    """
+    copy = FeatureSet(polarity=model.polarity)
+    copy.numTokens = model.numTokens
+    for unigram in model.words.itervalues():
+        mine = Unigram(unigram.word, count=unigram.count, probability=0)
+        for bigram in unigram.bigrams.itervalues():
+            mine.bigrams[bigram.word2] = Bigram(unigram.word, bigram.word2, count=bigram.count, probability=0)
+        copy.words[unigram.word] = mine
+    return copy
+
+def loadModel(modelFile):
+    """ Read a model file written by this program, with its numTokens
+    """
+    import rank
+    import binmodel
+    
+    model = rank.readModel(modelFile)
+    if not binmodel.isBinaryModel(modelFile):
+        # Text model files do not store numTokens
+        model.numTokens = binmodel.inferNumTokens(model)
+    return model
+
+def modeUpdate(dir, modelFilePrefix, binary=True, index=False, both=False, workers=1):
+    """ Rebuild only the models of documents added or changed since the last build.
+    
+        Documents are matched to the build manifest by content hash. Unchanged documents
+        keep their model files, and new documents get new model ids. With both, the
+        collection model is updated by subtracting the old models of changed and removed
+        documents and adding the counts of new ones, rather than reading every document.
+        
+        FeatureSet.update() counts a word once for the first document it is added from,
+        so a word repeated on one-word lines of a document can be off by that repeat from
+        a full rebuild. Run without -u to rebuild from scratch.
+    """
+    manifest = readManifest(modelFilePrefix)
+    if manifest and manifest.get('source'):
+        # Keyed by crawled link rather than document name, see alembic/pipelines.py
+        print "ERROR: {0}.manifest was written by {1}, not genModel.py, so cannot be updated from {2}".format(modelFilePrefix, manifest['source'], dir)
+        raise ValueError('{0}.manifest is not a genModel.py manifest'.format(modelFilePrefix))
+    colFile = modelFilePrefix + '_' + 'all.model'
+    if manifest is None:
+        print "\nNo build manifest for {0}, building all models".format(modelFilePrefix)
+        if both:
+            modeBoth(dir, modelFilePrefix, binary, index, workers)
+        else:
+            modeEach(dir, modelFilePrefix, binary, index, workers=workers)
+        return
+    
+    print "\nStarting modeUpdate, update models for changed docs in ", dir
+    names = []
+    try:
+        names = docstore.listDocuments(dir)
+        logging.debug("Sorted file names of directory {0} are: {1}".format(dir, names))
+    except:
+        print "ERROR: Problem reading directory at path {0}".format(dir)
+        raise 
+    
+    old = manifest['docs']
+    hashes = dict((name, hashFile(docstore.documentPath(dir, name))) for name in names)
+    changed = [n for n in names if n in old and old[n]['hash'] != hashes[n]]
+    added = [n for n in names if n not in old]
+    removed = sorted(n for n in old if n not in hashes)
+    print "{0} unchanged, {1} changed, {2} new, {3} removed documents".format(
+        len(names) - len(changed) - len(added), len(changed), len(added), len(removed))
+    
+    modelFile = lambda i: modelFilePrefix + '_' + repr(i) + '.model'
+    
+    # Take old counts of changed and removed documents out of the collection
+    collection = None
+    if both and manifest.get('collection') and os.path.exists(colFile):
+        collection = copyModel(loadModel(colFile))
+        for name in changed + removed:
+            collection.subtract(loadModel(modelFile(old[name]['id'])))
+    
+    for name in removed:
+        f = modelFile(old[name]['id'])
+        if os.path.exists(f):
+            os.remove(f)
+        del old[name]
+    
+    docs = []
+    for name in changed:
+        docs.append((old[name]['id'], docstore.documentPath(dir, name)))
+    for name in added:
+        old[name] = {'id': manifest['nextId']}
+        manifest['nextId'] += 1
+        docs.append((old[name]['id'], docstore.documentPath(dir, name)))
+    for name in changed + added:
+        old[name]['hash'] = hashes[name]
+    
+    # Words of new documents get the next ids, so ids of unchanged models stay valid
+    import vocab
+    vocabFile = modelFilePrefix + '.vocab'
+    if os.path.exists(vocabFile):
+        vocabulary = vocab.readVocabulary(vocabFile)
+    else:
+        vocabulary = vocab.Vocabulary()
+        for name in names:
+            if name not in changed and name not in added:
+                vocabulary.add(modelFile(old[name]['id']), loadModel(modelFile(old[name]['id'])))
+    
+    buildDocuments(docs, modelFilePrefix, binary, [vocabulary], collection, workers)
+    writeVocabulary(modelFilePrefix, vocabulary)
+    
+    # Postings and term frequencies of unchanged documents come from their model files
+    builder = None
+    if index:
+        import invindex
+        builder = invindex.IndexBuilder()
+    terms = None
+    if both:
+        import termtable
+        terms = termtable.TermTableBuilder()
+    if builder or terms:
+        for name in names:
+            f = modelFile(old[name]['id'])
+            model = loadModel(f)
+            if builder:
+                builder.add(f, model)
+            if terms:
+                terms.add(f, model)
+    if builder:
+        writeIndex(modelFilePrefix, builder)
+    
+    if both:
+        if collection is None:
+            # Collection model was missing or built from other documents
+            collection = FeatureSet(polarity=1)
+            readReviewDirectory(dir, names, collection)
+        writeCollectionModel(dir, modelFilePrefix, collection, binary, terms)
+    manifest['collection'] = both
+    
+    writeManifest(modelFilePrefix, manifest)
     
 def printHelp():
     print "\nUsage: python genModel.py -d <dir> -m <modelFilePrefix> -a"
     print "Operation: Generate a model for collection of documents in directory <dir> with model file name of <modelFilePrefix>_all.model"
     print 'Options: '
-    print '\t-d <dir>\t\tSpecify directory of document collection'
+    print '\t-d <dir>\t\tSpecify directory of document collection, or document store written by readjson.py -s'
     print '\t--dir="<dir>"\t\tSame as above'
     print '\n'
     print '\t-m <modelFilePrefix>\t\tSpecify name of output model file (in all mode) or prefix of each file (in individual mode)'
     print '\t--model="<modelFilePrefix>"\t\tSame as above. Output files will be of name <modelFilePrefix>.model'
     print '\n'
-    print '\t-i\t\tSpecify execution mode "individual". Generates model file for each document in directory <dir>, of names <modelFilePrefix>[0-N].model'
+    print '\t-i\t\tSpecify execution mode "individual". Generates model file for each document in directory <dir>, of names <modelFilePrefix>[0-N].model, and their vocabulary, <modelFilePrefix>.vocab'
     print '\n'
     print '\t-b\t\tSpecify execution mode "both". Generates model file for each document in directory <dir>, of names <modelFilePrefix>[0-N].model and model over all docs.'
     print '\n'
     print '\t-a\t\tSpecify execution mode "all". Generates model file for whole collection in <dir>, of name <modelFilePrefix>_all.model'
+    print '\n'
+    print '\t-x\t\tWith -i or -b, also write an inverted index over the document models, of name <modelFilePrefix>.index. Give it to rank.py with -x.'
+    print '\n'
+    print '\t-u\t\tWith -i or -b, only rebuild models of documents added or changed since the last run, using <modelFilePrefix>.manifest'
+    print '\t--update\t\tSame as above'
+    print '\n'
+    print '\t--workers=<N>\t\tWith -i or -b, build document models on a pool of N processes. Output is the same as with one.'
+    print '\n'
+    print '\t--text\t\tWrite model files in the old text format instead of the binary format. See binmodel.py to convert text model files.'
     print '\n\n'
         
 def main(argv):
@@ -429,10 +882,14 @@ def main(argv):
     
     dir = ""                # Directory of documents   
     modelFilePrefix = ""    # Prefix of model files to be written
-   
+    binary = True           # Write binary model files, see binmodel.py
+    index = False           # Write inverted index over document models, see invindex.py
+    workers = 1             # Processes building document models
+    update = False          # Only rebuild models of changed documents
+
     
     try:
-        opts, args = getopt.getopt(argv, "hd:m:iab",["dir=", "model="])
+        opts, args = getopt.getopt(argv, "hd:m:iabxu",["dir=", "model=", "text", "index", "workers=", "update"])
     except getopt.GetoptError:
         printHelp()
         sys.exit(2)
@@ -451,6 +908,14 @@ def main(argv):
             dir = arg 
         elif opt in ('-m', '--model'):
             modelFilePrefix = arg 
+        elif opt in ('-x', '--index'):
+            index = True
+        elif opt in ('-u', '--update'):
+            update = True
+        elif opt == '--text':
+            binary = False
+        elif opt == '--workers':
+            workers = int(arg)
         
             
     if not os.path.exists(dir):
@@ -464,16 +929,30 @@ def main(argv):
     
     start = time.clock()
     
-    if MODE_EACH:
+    if update and MODE_EACH:
+        logging.info('\nStarting modeUpdate()...')
+        modeUpdate(dir, modelFilePrefix, binary, index, MODE_ALL, workers)
+        logging.info('\nFinished modeUpdate()...')
+        
+    elif MODE_EACH and MODE_ALL:
+        # Read each document once for both kinds of model
+        logging.info('\nStarting modeBoth()...')
+        modeBoth(dir, modelFilePrefix, binary, index, workers)
+        logging.info('\nFinished modeBoth()...')
+        
+    elif MODE_EACH:
         logging.info('\nStarting modeEach()...')
-        modeEach(dir, modelFilePrefix)
+        modeEach(dir, modelFilePrefix, binary, index, workers=workers)
         logging.info('\nFinished modeEach()...')
         
-    if MODE_ALL:
+    elif MODE_ALL:
         logging.info('\nStarting modeAll()...')
-        modeAll(dir, modelFilePrefix)
+        modeAll(dir, modelFilePrefix, binary)
         logging.info('\nFinished modeAll()...')
     
+    # Results cached over the old models no longer hold
+    writeGeneration(modelFilePrefix)
+    
     end = time.clock() - start
     print 'Finished generating model files in time: {0}'.format(end)
     logging.info('\nGeneration done in time {0}\nDONE\n\n'.format(end))
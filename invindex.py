@@ -0,0 +1,195 @@
+#!/usr/bin/python2.7
+# invindex.py
+# Jeremy Johnston
+
+""" Inverted index over per-document models.
+
+    Maps each term to its postings, the (document id, count, log probability) of the
+    term in every per-document model containing it. Ranking then only touches the
+    documents in the posting lists of the query terms, and never opens a model file.
+
+    Document ids are positions in the sorted list of model file names, the same order
+    rank.readDirectory() reads a model directory in.
+
+    Layout (little endian), built on the binmodel.py section helpers:
+
+        header          magic, version, nDocs, nTerms, nPostings, section offsets
+        doc strings     string table of 2 * nDocs strings, (modelFile, originFile) per doc
+        term strings    string table of nTerms sorted terms
+        posting rows    uint32[nTerms + 1], row pointers into the posting arrays
+        posting docs    uint32[nPostings]
+        posting counts  uint32[nPostings]
+        posting probs   float64[nPostings]
+
+    Each row is ordered by impact, lowest log probability first, so ranking can stop
+    reading a posting list once no unread posting can change the best documents.
+
+    Bigrams are indexed too, under the term "word1 word2" (see bigramTerm()), so a
+    phrase query only touches documents containing its word pairs. Words never hold
+    white space, so bigram terms cannot collide with unigram terms.
+"""
+
+import os
+import mmap
+import struct
+import array
+from binmodel import writeArray, readArray, writeStrings, stringAt, searchStrings, replaceFile
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+MAGIC = 'ALBX'
+VERSION = 3
+
+# magic, version, nDocs, nTerms, nPostings, then 8 section offsets
+HEADER = struct.Struct('<4sIIII8Q')
+
+def bigramTerm(word1, word2):
+    """ Return the index term of bigram (word1, word2)
+    """
+    return word1 + ' ' + word2
+
+class IndexBuilder():
+    """ Collects postings of per-document models, then writes them as an index file
+    """
+
+    def __init__(self):
+        self.docs = []          # (modelFile, originFile) of each added model
+        self.postings = {}      # term -> (doc ids, counts, probabilities) arrays
+
+    def add(self, modelFile, model):
+        """ Add postings of every unigram and bigram of model, written to modelFile
+        """
+        docId = len(self.docs)
+        self.docs.append((modelFile, str(model.originFile).rstrip('\n')))
+
+        for unigram in model.words.itervalues():
+            self.post(unigram.word, docId, unigram.count, unigram.probability)
+            for bigram in unigram.bigrams.itervalues():
+                self.post(bigramTerm(bigram.word1, bigram.word2), docId, bigram.count, bigram.probability)
+
+    def post(self, term, docId, count, probability):
+        if term in self.postings:
+            docs, counts, probs = self.postings[term]
+        else:
+            docs, counts, probs = array.array('I'), array.array('I'), array.array('d')
+            self.postings[term] = (docs, counts, probs)
+        docs.append(docId)
+        counts.append(count)
+        probs.append(probability)
+
+    def merge(self, other):
+        """ Add all postings of another IndexBuilder
+        """
+        base = len(self.docs)
+        self.docs.extend(other.docs)
+        for term, (docs, counts, probs) in other.postings.iteritems():
+            if term not in self.postings:
+                self.postings[term] = (array.array('I'), array.array('I'), array.array('d'))
+            mine = self.postings[term]
+            mine[0].extend(d + base for d in docs)
+            mine[1].extend(counts)
+            mine[2].extend(probs)
+
+    def write(self, fileName):
+        # Renumber documents in sorted model file name order
+        order = sorted(range(len(self.docs)), key=lambda d: os.path.basename(self.docs[d][0]))
+        newId = [0] * len(order)
+        for new, old in enumerate(order):
+            newId[old] = new
+
+        docStrings = []
+        for old in order:
+            docStrings.extend(self.docs[old])
+
+        terms = sorted(self.postings.iterkeys())
+        rows = [0]
+        postDocs = array.array('I')
+        postCounts = array.array('I')
+        postProbs = array.array('d')
+        for term in terms:
+            docs, counts, probs = self.postings[term]
+            for j in sorted(range(len(docs)), key=lambda j: (probs[j], newId[docs[j]])):
+                postDocs.append(newId[docs[j]])
+                postCounts.append(counts[j])
+                postProbs.append(probs[j])
+            rows.append(len(postDocs))
+
+        # Written aside and moved into place, as a rank server may have the old index mapped
+        tempName = fileName + '.tmp'
+        try:
+            file = open(tempName, 'wb')
+            file.write('\0' * HEADER.size)
+
+            offsets = list(writeStrings(file, docStrings))
+            offsets.extend(writeStrings(file, terms))
+            offsets.append(writeArray(file, 'I', rows))
+            offsets.append(writeArray(file, 'I', postDocs))
+            offsets.append(writeArray(file, 'I', postCounts))
+            offsets.append(writeArray(file, 'd', postProbs))
+
+            file.seek(0)
+            file.write(HEADER.pack(MAGIC, VERSION, len(self.docs), len(terms), len(postDocs), *offsets))
+            file.close()
+            replaceFile(tempName, fileName)
+        except:
+            print 'ERROR writing index file {0}'.format(fileName)
+            raise
+
+class InvertedIndex():
+    """ Memory-mapped index file written by IndexBuilder
+    """
+
+    def __init__(self, fileName):
+        self.fileName = fileName
+
+        file = open(fileName, 'rb')
+        try:
+            fields = HEADER.unpack(file.read(HEADER.size))
+            if fields[0] != MAGIC:
+                raise ValueError('{0} is not an index file'.format(fileName))
+            if fields[1] != VERSION:
+                raise ValueError('{0} has index version {1}, expected {2}'.format(fileName, fields[1], VERSION))
+            self.nDocs, self.nTerms, self.nPostings = fields[2:5]
+            (self.offDocOffsets, self.offDocData, self.offTermOffsets, self.offTermData,
+             self.offRow, self.offDoc, self.offCount, self.offProb) = fields[5:]
+            self.buf = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        finally:
+            file.close()
+
+    def close(self):
+        self.buf.close()
+
+    def modelFile(self, docId):
+        return stringAt(self.buf, self.offDocOffsets, self.offDocData, 2 * docId)
+
+    def originFile(self, docId):
+        return stringAt(self.buf, self.offDocOffsets, self.offDocData, 2 * docId + 1)
+
+    def postings(self, term):
+        """ Return (doc ids, counts, log probabilities) arrays of term, empty if not indexed
+        """
+        i = searchStrings(self.buf, self.offTermOffsets, self.offTermData, term, 0, self.nTerms)
+        if i < 0:
+            return array.array('I'), array.array('I'), array.array('d')
+        start, end = struct.unpack_from('<II', self.buf, self.offRow + 4 * i)
+        return (readArray(self.buf, 'I', self.offDoc + 4 * start, end - start),
+                readArray(self.buf, 'I', self.offCount + 4 * start, end - start),
+                readArray(self.buf, 'd', self.offProb + 8 * start, end - start))
+
+    def postingArrays(self, term):
+        """ Return (doc ids, counts, log probabilities) of term as numpy arrays viewing the mapped file
+        """
+        i = searchStrings(self.buf, self.offTermOffsets, self.offTermData, term, 0, self.nTerms)
+        if i < 0:
+            return numpy.zeros(0, '<u4'), numpy.zeros(0, '<u4'), numpy.zeros(0, '<f8')
+        start, end = struct.unpack_from('<II', self.buf, self.offRow + 4 * i)
+        n = end - start
+        return (numpy.frombuffer(self.buf, '<u4', n, self.offDoc + 4 * start),
+                numpy.frombuffer(self.buf, '<u4', n, self.offCount + 4 * start),
+                numpy.frombuffer(self.buf, '<f8', n, self.offProb + 8 * start))
+
+def readIndex(fileName):
+    return InvertedIndex(fileName)
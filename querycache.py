@@ -0,0 +1,175 @@
+#!/usr/bin/python2.7
+# querycache.py
+# Jeremy Johnston
+
+""" Cache of ranking results, in front of rank.py and rankserver.py.
+
+    A result is the rank.reportData() dict of a query, keyed on its terms, weight,
+    phrase flag and cutoff. Results are kept in memory, least recently used dropped
+    first, and optionally in a cache directory so they last between runs of rank.py.
+
+    Each cache belongs to one build of the models, named by buildId(). genModel.py
+    writes a new generation stamp after every build, so a rebuild changes the build id,
+    and results cached over older builds are never returned. Opening a cache directory
+    removes the results of other builds once unused for PRUNE_AGE, so a rank server
+    still answering over an old build keeps its results.
+"""
+
+import os
+import time
+import json
+import hashlib
+import shutil
+import threading
+import logging
+from collections import OrderedDict
+from genModel import readGeneration
+
+# Seconds a cache directory of another build goes unused before it is removed
+PRUNE_AGE = 24 * 60 * 60
+
+def buildId(dir, col, indexFile=None):
+    """ Return an id of the model set ranked from dir, col and indexFile, that changes on rebuild.
+
+        Uses the generation stamp genModel.py writes next to the model files, or for
+        models without one, the modification time and size of the files.
+    """
+    parts = []
+    for path in (dir, col, indexFile):
+        if not path:
+            continue
+        stampDir = path if os.path.isdir(path) else os.path.dirname(path)
+        generation = readGeneration(stampDir)
+        if generation is None:
+            st = os.stat(path)
+            generation = '{0}:{1}:{2}'.format(path, st.st_mtime, st.st_size)
+        parts.append(generation)
+    return hashlib.sha1('\n'.join(parts)).hexdigest()
+
+def queryKey(terms, weight, CUTOFF, phrase=False):
+    """ Return the cache key of a query. Terms keep their order, as it matters to the phrase pairs.
+    """
+    return json.dumps([' '.join(terms).split(), repr(float(weight)), int(CUTOFF), bool(phrase)])
+
+def decode(data):
+    """ Turn the unicode strings json gives back into the byte strings ranking returned
+    """
+    if isinstance(data, unicode):
+        return data.encode('utf-8')
+    if isinstance(data, list):
+        return [decode(d) for d in data]
+    if isinstance(data, dict):
+        return dict((decode(k), decode(v)) for k, v in data.iteritems())
+    return data
+
+class QueryCache():
+    """ Results of queries over one build of the models, in memory and optionally in cacheDir.
+
+        Results returned are shared with the cache, and must not be changed.
+    """
+
+    def __init__(self, build, cacheDir=None, size=1000):
+        self.build = build
+        self.size = size
+        self.results = OrderedDict()    # query key -> result, least recently used first
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+        self.dir = None
+        if cacheDir:
+            self.dir = os.path.join(cacheDir, build)
+            self.makeDir()
+            os.utime(self.dir, None)
+            prune(cacheDir, build)
+
+    def makeDir(self):
+        if not os.path.isdir(self.dir):
+            try:
+                os.makedirs(self.dir)
+            except OSError:
+                # Made by another process meanwhile
+                if not os.path.isdir(self.dir):
+                    raise
+
+    def fileName(self, key):
+        return os.path.join(self.dir, hashlib.sha1(key).hexdigest() + '.json')
+
+    def get(self, key):
+        """ Return cached result of key, or None
+        """
+        with self.lock:
+            if key in self.results:
+                data = self.results.pop(key)
+                self.results[key] = data
+                self.hits += 1
+                return data
+
+        data = None
+        if self.dir:
+            fileName = self.fileName(key)
+            if os.path.exists(fileName):
+                try:
+                    file = open(fileName)
+                    try:
+                        entry = json.load(file)
+                    finally:
+                        file.close()
+                    if entry['key'] == key:
+                        data = decode(entry['data'])
+                        # Mark the build in use, see prune()
+                        os.utime(self.dir, None)
+                except (IOError, OSError, ValueError, KeyError):
+                    # A damaged entry is only a miss
+                    logging.exception('Unreadable cache file {0}'.format(fileName))
+
+        with self.lock:
+            if data is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.remember(key, data)
+        return data
+
+    def put(self, key, data):
+        with self.lock:
+            self.remember(key, data)
+
+        if self.dir:
+            # Write then rename, so readers never see part of an entry
+            fileName = self.fileName(key)
+            tempName = '{0}.{1}.tmp'.format(fileName, threading.current_thread().ident)
+            try:
+                # Pruned by a cache opened over another build after a long time unused
+                self.makeDir()
+                file = open(tempName, 'w')
+                json.dump({'key': key, 'data': data}, file)
+                file.close()
+                os.rename(tempName, fileName)
+            except (IOError, OSError):
+                # The result is still kept in memory, so a failed write is only a later miss
+                logging.exception('ERROR writing cache file {0}'.format(fileName))
+
+    def remember(self, key, data):
+        self.results.pop(key, None)
+        self.results[key] = data
+        while len(self.results) > self.size:
+            self.results.popitem(last=False)
+
+def prune(cacheDir, build):
+    """ Remove the cache directories of builds other than build not used for PRUNE_AGE.
+
+        A directory is used when a result is written to it or read from it, so one a
+        running rank server still answers from is kept.
+    """
+    now = time.time()
+    for name in os.listdir(cacheDir):
+        path = os.path.join(cacheDir, name)
+        if name == build or not os.path.isdir(path):
+            continue
+        try:
+            if now - os.path.getmtime(path) > PRUNE_AGE:
+                shutil.rmtree(path, ignore_errors=True)
+        except OSError:
+            # Removed by another process meanwhile
+            pass
@@ -17,22 +17,52 @@ import math
 from collections import deque
 import time
 import logging
-from genModel import Unigram, Bigram, FeatureSet
+import heapq
+import itertools
+from genModel import Unigram, Bigram, FeatureSet, BIGRAM_SECTION
+import binmodel
+import invindex
+import querycache
+import termtable
+import vocab
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 
 logging.basicConfig(filename="rank.log", level=logging.DEBUG)
 
 def readDirectory(dir):
+    """ Read every model file in dir.
+    
+        Text models are kept as vocab.IdFeatureSet arrays over one vocabulary of the
+        directory, the one genModel.py wrote to dir if there is one, rather than as dicts
+        of words. This is the only use of vocab.py's ids.
+        Only their unigrams are read here; the bigrams are read the first time a model
+        is asked for one, by phrase queries or naive Bayes. Binary models are mapped as
+        they are scored, and unmapped after, see binmodel.py.
+    """
     names = []
     models = []
     currentName = ""
     try:
-        names = os.listdir(dir)
+        vocabulary = vocab.findVocabulary(dir) or vocab.Vocabulary()
+        
+        # Skip anything that is not a document model, such as an index written by genModel -x,
+        # or the collection model genModel -b writes next to the documents' models
+        names = [n for n in os.listdir(dir) if n.endswith('.model') and not n.endswith('_all.model')]
         names.sort()
         for name in names:
             currentName = name
             file = os.path.join(dir, name)
-            models.append(readModel(file))
+            if binmodel.isBinaryModel(file):
+                model = binmodel.readBinaryModel(file)
+            else:
+                model, offset = readTextModel(file, bigrams=False)
+                model = vocab.IdFeatureSet(vocabulary, model, offset)
+            models.append(model)
     except:
         msg = "\n\nERROR reading directory at path {0}, failed on model file count {1} of {2} expected, last file name touched: {3}\n\n".format(dir, len(models), len(names), currentName)
         print msg
@@ -42,12 +72,27 @@ def readDirectory(dir):
     return models 
 
 def readModel(fileName):
+    """ Read a model file, either binary (see binmodel.py) or text
+    """
+    if binmodel.isBinaryModel(fileName):
+        return binmodel.readBinaryModel(fileName)
+    return readTextModel(fileName)[0]
+
+def readTextModel(fileName, bigrams=True):
+    """ Read a text model file. Return a pair (model, offset).
+    
+        With bigrams False, reading stops at the bigram section line genModel.py writes
+        after the unigrams, and offset is the byte offset of the bigram lines that follow,
+        for readBigrams(). Otherwise offset is None, as it is for older model files with
+        the bigrams of each unigram right after it, which are read whole.
+    """
     model = FeatureSet(polarity=1)
     model.modelFile = fileName 
     lineNum = 1
+    offset = 0
     
     try:
-        file = open(fileName)
+        file = open(fileName, 'rb')
         
         
         # Read metadata
@@ -55,12 +100,11 @@ def readModel(fileName):
         model.link = file.readline() 
         model.date = file.readline() 
         model.title = file.readline()
+        offset = len(model.originFile) + len(model.link) + len(model.date) + len(model.title)
         
         # Read probabilities 
         for line in file:
-            line.rstrip()
-            
-                   
+            offset += len(line)
             tokens = line.split()
             
             # Process Unigram feature of format: probability word count
@@ -69,6 +113,10 @@ def readModel(fileName):
                 word = tokens[1]
                 count = int(tokens[2])
                 model.words[word] = Unigram(word=word, count=count, probability=prob)
+            # The bigrams follow
+            elif len(tokens) == 1 and tokens[0] == BIGRAM_SECTION:
+                if not bigrams:
+                    break
             # Process Bigram feature of format: probability word1 word2 count
             else:
                 prob = float(tokens[0])
@@ -78,18 +126,75 @@ def readModel(fileName):
                 model.words[word1].bigrams[word2] = Bigram(probability=prob, word1=word1, word2=word2, count=count)
                              
             lineNum += 1
+        else:
+            offset = None
                 
     except:
         print "ERROR: Problem reading file {0} on line {1}".format(fileName, lineNum)
         raise
     else:
         file.close()
-        return model
+        return model, offset
+
+def readBigrams(fileName, offset):
+    """ Yield each Bigram of text model file fileName, from the bigram section at offset
+    """
+    try:
+        file = open(fileName, 'rb')
+        file.seek(offset)
+        for line in file:
+            prob, word1, word2, count = line.split()
+            yield Bigram(probability=float(prob), word1=word1, word2=word2, count=int(count))
+    except:
+        print "ERROR: Problem reading bigrams of file {0}".format(fileName)
+        raise
+    else:
+        file.close()
+
+class RankedDoc():
+    """ Ranking result for a document scored through an inverted index, in place of its model
+    """
+    def __init__(self, modelFile, originFile, queryProbability):
+        self.modelFile = modelFile
+        self.originFile = originFile
+        self.queryProbability = queryProbability
+        self.rank = 10000
 
 #TODO: Add precision, recall and MRR functions, or do in separate evaluation program?        
         
-def rank(terms, models, colModel, weight=0.6):        
-    """ Rank using mixture model over given terms.
+def queryFeatures(terms, phrase=False):
+    """ Return the features a query is scored over: each term, and with phrase, each pair
+        of adjacent terms as its index term "word1 word2" (see invindex.bigramTerm()).
+    """
+    features = list(terms)
+    if phrase:
+        for i in range(len(terms) - 1):
+            features.append(invindex.bigramTerm(terms[i], terms[i + 1]))
+    return features
+
+def featureProbability(model, feature):
+    """ Return (log probability, boolFound) of a query feature in model, a unigram or a bigram
+    """
+    words = feature.split(' ')
+    if len(words) == 2:
+        bigram, exists = model.getBigram(words[0], words[1])
+        return bigram.probability, exists
+    unigram, exists = model.getUnigram(feature)
+    return unigram.probability, exists
+
+def collectionProbability(terms, colModel, weight, phrase=False):
+    """ Return (1-W) * P(Q | C), the base probability every document gets from the collection
+    """
+    invWeight = 1 - weight
+    prob = 0
+    for feature in queryFeatures(terms, phrase):
+        featureProb, exists = featureProbability(colModel, feature)
+        if exists:
+            prob += invWeight * featureProb
+    return prob
+
+def scoreModels(terms, models, colModel, weight=0.6, phrase=False):        
+    """ Score each model using mixture model over given terms, into model.queryProbability.
 
         Rank of any model file M on term Q is:
             P(Q | M, C) = W * P(Q | M) + (1-W) * P(Q | C)
@@ -103,7 +208,9 @@ def rank(terms, models, colModel, weight=0.6):
         For each term, sum their probabilities for final value.
         Best rank is max probability.
         
-        TODO: Consider that we should find probability for each term, and probability for each (term[i], term[j])
+        With phrase, each pair of adjacent terms (term[i], term[i+1]) is also scored, as
+        above with the bigram probabilities P(term[i+1] | term[i], M) and P(term[i+1] | term[i], C),
+        so documents holding the query words in order rank above those holding them apart.
     """ 
     
     if weight > 1:
@@ -113,25 +220,16 @@ def rank(terms, models, colModel, weight=0.6):
     
     ## First get Unigram probability sum 
     # Pre-calculate base collection probability 
-    invWeight = 1 - weight
-    for term in terms:
-        prob = 0 
-        unigram, exists = colModel.getUnigram(term)
-        if exists:
-            prob = unigram.probability
-            
-        colModel.queryProbability += invWeight * prob  
-    
-    
+    colModel.queryProbability += collectionProbability(terms, colModel, weight, phrase)
+    features = queryFeatures(terms, phrase)
     
     # Find probability sum for each 
     for model in models:
         # Sum term probabilities
-        for term in terms:
-            prob = 0
-            unigram, exists = model.getUnigram(term)
-            if exists:
-                prob = unigram.probability
+        for feature in features:
+            prob, exists = featureProbability(model, feature)
+            if not exists:
+                prob = 0
             model.queryProbability += weight * prob 
         
         # Add collection prob as base probability
@@ -139,21 +237,28 @@ def rank(terms, models, colModel, weight=0.6):
         
         # Square the prob 
         model.queryProbability = math.pow(model.queryProbability, 2)
+        
+        # A mapped binary model holds a file descriptor, so unmap it once scored
+        if hasattr(model, 'close'):
+            model.close()
     
     # Square collection prob before we write to file
     colModel.queryProbability = math.pow(colModel.queryProbability, 2)  
+
+def rank(terms, models, colModel, weight=0.6, phrase=False):        
+    """ Rank using mixture model over given terms, see scoreModels(). Returns every model, best first.
+    """ 
     
-    ##
-    #TODO: Consider bigram term probability 
+    scoreModels(terms, models, colModel, weight, phrase)
         
     # Sort by queryProbability to rank results  
     results = sorted(models, key=lambda m: m.queryProbability)
     
     results.reverse()
     
-    #TODO Def need to include bigram prob. Unigram only gives same prob to documents with term or terms. Too many documents contain common unigrams for top 10 results to differ.
+    #Unigram only gives same prob to documents with term or terms. Too many documents contain common unigrams for top 10 results to differ.
     #Do see meaningful difference when using many terms, as top 10 will have those with each term, with one term, and with none.
-    #Bigram prob would increase unique rankings
+    #Bigram prob increases unique rankings, see phrase in scoreModels()
     
     i = 0 
     for r in results:
@@ -164,34 +269,264 @@ def rank(terms, models, colModel, weight=0.6):
     
     # Return results 
     return results
+
+def rankTopModels(terms, models, colModel, weight=0.6, K=10, phrase=False):
+    """ Rank as rank() does, but keep only the best K models, in a bounded heap.
+    
+        Returns (results, NR, ND), as rankVectorized() does.
+    """
+    
+    scoreModels(terms, models, colModel, weight, phrase)
+    
+    # Ties go to later models, as in rank()
+    best = heapq.nlargest(K, xrange(len(models)), key=lambda i: (models[i].queryProbability, i))
+    results = [models[i] for i in best]
+    for i in range(len(results)):
+        results[i].rank = i
+    
+    NR = 0
+    for model in models:
+        if model.queryProbability > colModel.queryProbability:
+            NR += 1
+    
+    return results, NR, len(models)
+
+def rankIndex(terms, index, colModel, weight=0.6, phrase=False):
+    """ Rank as rank() does, but only score documents in the posting lists of the terms.
+    
+        A document without any of the terms gets W * 0 from its own model, so its
+        probability is just the collection base probability, and its model file is never
+        opened. Documents tie the same way as in rank(), later model files first.
+        With phrase, the posting lists of the term pairs are read as well.
+    """
+    
+    if weight > 1:
+        msg = "\n\nERROR in rank.py:rankIndex(); weight given should be in range [0, 1]\n\n"
+        logging.error(msg)
+        raise ValueError(msg)
+    
+    colModel.queryProbability += collectionProbability(terms, colModel, weight, phrase)
+    
+    # Sum term probabilities of each document in a posting list, in term order as rank() does.
+    # With no weight on document models, every document has the base probability.
+    sums = {}
+    for term in (queryFeatures(terms, phrase) if weight > 0 else []):
+        docs, counts, probs = index.postings(term)
+        for j in xrange(len(docs)):
+            d = docs[j]
+            sums[d] = sums.get(d, 0) + weight * probs[j]
+    
+    base = colModel.queryProbability
+    results = []
+    for d, prob in sums.iteritems():
+        results.append((math.pow(prob + base, 2), d))
+    results.sort(reverse=True)
+    
+    # Every other document has the base probability
+    baseProbability = math.pow(base, 2)
+    matched = [RankedDoc(index.modelFile(d), index.originFile(d), p) for p, d in results]
+    for d in xrange(index.nDocs - 1, -1, -1):
+        if d not in sums:
+            matched.append(RankedDoc(index.modelFile(d), index.originFile(d), baseProbability))
+    results = matched
+    
+    colModel.queryProbability = baseProbability
+    
+    i = 0
+    for r in results:
+        r.rank = i
+        i += 1
+    
+    return results
         
-def writeReport(terms, results, outputFileName, collection, CUTOFF=10):
-    ''' Write N best results to file, where N = CUTOFF, 10 by default
-    '''
+def rankTopK(terms, index, colModel, weight=0.6, K=10, phrase=False):
+    """ Rank the best K documents through index, without scoring every document in the posting lists.
+    
+        Posting lists are ordered by impact, W * -log P(term | M), highest first. They are
+        read in runs, round robin, and each document is scored the first time it is read,
+        looking up its other terms. A document not read yet has at most the impact at the
+        read position of each list, so reading stops once the K best scores beat that sum.
+        
+        Returns (results, NR, ND), as rankVectorized() does. NR is the number of distinct
+        documents in the posting lists, ND the number of documents in the index.
+    """
+    
+    if weight > 1:
+        msg = "\n\nERROR in rank.py:rankTopK(); weight given should be in range [0, 1]\n\n"
+        logging.error(msg)
+        raise ValueError(msg)
+    
+    colModel.queryProbability += collectionProbability(terms, colModel, weight, phrase)
+    base = colModel.queryProbability
+    baseProbability = math.pow(base, 2)
+    colModel.queryProbability = baseProbability
+    
+    # With no weight on document models, every document has the base probability
+    lists = []
+    if weight > 0:
+        lists = [index.postings(term) for term in queryFeatures(terms, phrase)]
+    n = len(lists)
+    
+    # Term lookups by doc id. Documents in any of them are above the base probability.
+    lookups = [dict(itertools.izip(docs, probs)) for docs, counts, probs in lists]
+    matched = set()
+    for lookup in lookups:
+        matched.update(lookup)
+    
+    heap = []           # (probability, doc id) of the best K so far, worst first
+    scored = set()
+    pos = 0
+    step = 16
+    while True:
+        for t in range(n):
+            docs = lists[t][0]
+            for j in xrange(pos, min(pos + step, len(docs))):
+                d = docs[j]
+                if d in scored:
+                    continue
+                scored.add(d)
+                
+                # Sum term probabilities in term order, as rank() does
+                prob = 0
+                for lookup in lookups:
+                    if d in lookup:
+                        prob += weight * lookup[d]
+                entry = (math.pow(prob + base, 2), d)
+                if len(heap) < K:
+                    heapq.heappush(heap, entry)
+                elif entry > heap[0]:
+                    heapq.heapreplace(heap, entry)
+        pos += step
+        step *= 2
+        
+        # Best probability any document not read yet could have
+        unread = 0
+        for docs, counts, probs in lists:
+            if pos < len(docs):
+                unread += weight * probs[pos]
+        if unread == 0:
+            break
+        
+        # Leave a margin for rounding in the sums, ties are settled by reading on
+        bound = math.pow(unread + base, 2)
+        if len(heap) == K and heap[0][0] > bound * (1 + 1e-9) + 1e-12:
+            break
+    
+    best = sorted(heap, reverse=True)
+    results = [RankedDoc(index.modelFile(d), index.originFile(d), p) for p, d in best]
+    
+    # Fill with documents in no posting list, later documents first
+    d = index.nDocs - 1
+    while len(results) < K and d >= 0:
+        if d not in matched:
+            results.append(RankedDoc(index.modelFile(d), index.originFile(d), baseProbability))
+        d -= 1
+    
+    for i in range(len(results)):
+        results[i].rank = i
+    
+    return results, len(matched), index.nDocs
 
-    try:
-        file = open(outputFileName, 'w')
-        file.write("Best results over query terms: {0}\n".format(terms))
-        file.write("Collection base probability: {0:.4f} : Collection model file: {1}\n".format(collection.queryProbability, collection.modelFile))
+def rankVectorized(terms, index, colModel, weight=0.6, K=10, phrase=False):
+    """ Rank as rankIndex() does, with numpy over the posting arrays of the terms.
+    
+        Probability sums of all documents are one array, each term's postings are added
+        to it in one operation, and only the top K are sorted, using argpartition.
         
-        # Find number of relevant documents 
+        Returns (results, NR, ND): the best K documents, the number of documents above
+        the collection base probability, and the number of documents.
+    """
+    
+    if weight > 1:
+        msg = "\n\nERROR in rank.py:rankVectorized(); weight given should be in range [0, 1]\n\n"
+        logging.error(msg)
+        raise ValueError(msg)
+    
+    colModel.queryProbability += collectionProbability(terms, colModel, weight, phrase)
+    base = colModel.queryProbability
+    
+    # Sum term probabilities, in term order as rank() does. Doc ids are unique in a posting list.
+    sums = numpy.zeros(index.nDocs)
+    for term in queryFeatures(terms, phrase):
+        docs, counts, probs = index.postingArrays(term)
+        sums[docs] += weight * probs
+    
+    # numpy.power, unlike numpy.square, rounds as math.pow() does in rank()
+    scores = numpy.power(sums + base, 2.0)
+    colModel.queryProbability = math.pow(base, 2)
+    
+    ND = index.nDocs
+    NR = int(numpy.count_nonzero(scores > colModel.queryProbability))
+    
+    K = min(K, ND)
+    if K == 0:
+        return [], NR, ND
+    
+    # Take the K best, breaking ties at the Kth score toward later documents as rank() does
+    part = numpy.argpartition(-scores, K - 1)[:K]
+    kth = scores[part].min()
+    above = numpy.flatnonzero(scores > kth)
+    ties = numpy.flatnonzero(scores == kth)[::-1][:K - len(above)]
+    best = numpy.concatenate((above, ties))
+    best = best[numpy.lexsort((-best, -scores[best]))]
+    
+    results = []
+    for i, d in enumerate(best):
+        doc = RankedDoc(index.modelFile(d), index.originFile(d), float(scores[d]))
+        doc.rank = i
+        results.append(doc)
+    
+    return results, NR, ND
+        
+def reportData(terms, results, collection, CUTOFF=10, NR=None, ND=None):
+    ''' Return the data writeReport() writes, as a dict, for the N best results where N = CUTOFF
+    
+        NR and ND are counted from results unless given, as when results is only the best N.
+    '''
+    
+    # Find number of relevant documents 
+    if NR is None:
         NR = 0 
-        ND = len(results)
         for model in results:
             if model.queryProbability > collection.queryProbability:
                 NR += 1
+    if ND is None:
+        ND = len(results)
+    
+    best = []
+    for model in results[0:CUTOFF]:
+        best.append({'rank': model.rank, 'probability': float(model.queryProbability),
+                     'modelFile': model.modelFile, 'originFile': model.originFile})
+    
+    return {'terms': terms, 'collectionProbability': collection.queryProbability,
+            'collectionFile': collection.modelFile, 'relevant': NR, 'total': ND, 'results': best}
         
-        file.write('Relevant docs found: {0} : Total docs: {1}\n'.format(NR, ND))
+def writeReport(terms, results, outputFileName, collection, CUTOFF=10, NR=None, ND=None):
+    ''' Write N best results to file, where N = CUTOFF, 10 by default
+    
+        NR and ND are counted from results unless given, as when results is only the best N.
+    '''
+
+    writeReportData(reportData(terms, results, collection, CUTOFF, NR, ND), outputFileName)
+
+def writeReportData(data, outputFileName):
+    ''' Write report file of data given by reportData(), such as a cached result
+    '''
+    try:
+        file = open(outputFileName, 'w')
+        file.write("Best results over query terms: {0}\n".format(data['terms']))
+        file.write("Collection base probability: {0:.4f} : Collection model file: {1}\n".format(data['collectionProbability'], data['collectionFile']))
+        
+        file.write('Relevant docs found: {0} : Total docs: {1}\n'.format(data['relevant'], data['total']))
         
         fmt = "{rank: <5}| {prob: <10}| {modelf: <{width}}| {originf: <{width}}\n"
         file.write(fmt.format(rank='RANK', prob='PR', modelf='MODEL_FILE', originf='ORIGIN_FILE', width=25))
         fmt = "{rank: <5}| {prob: <10.4f}| {modelf: <{width}}| {originf: <{width}}\n"
         fixedWidth=30
-        for model in results[0:CUTOFF]:
-            p = float(model.queryProbability)
-            temp = max(len(model.modelFile), len(model.originFile))
+        for result in data['results']:
+            temp = max(len(result['modelFile']), len(result['originFile']))
             fixedWidth = max(fixedWidth, temp)
-            str = fmt.format(rank=model.rank, prob=p, modelf=model.modelFile, originf=model.originFile, width=fixedWidth)
+            str = fmt.format(rank=result['rank'], prob=result['probability'], modelf=result['modelFile'], originf=result['originFile'], width=fixedWidth)
             file.write(str)
             
     except:
@@ -351,6 +686,9 @@ def printHelp():
     print '\t-c <col>\t--col="<col>"\Give model file over a collection to read'
     print '\t-o <outputFileName>\t--output="<outputFileName>"\tFile to write rank results in'
     print '\t-q <query>\t--query="<query>"\tWhite space separated query terms'
+    print '\t-x <index>\t--index="<index>"\tRank through an inverted index written by genModel.py -x, instead of reading every model in <dir>'
+    print '\t-p\t--phrase\tAlso score each pair of adjacent query terms by its bigram probabilities, ranking documents with the words in order higher'
+    print '\t--cache="<cacheDir>"\tKeep results in <cacheDir>, and answer repeat queries from it until genModel.py rebuilds the models'
 
 def checkPath(path):
     if not os.path.exists(path):
@@ -358,30 +696,81 @@ def checkPath(path):
         return False
     return True
 
-def rank_documents(dir, col, outputFileName, terms, weight=0.5):
+def loadModels(dir, col, indexFile=None):
+    """ Read what ranking needs: the collection model, and either the index or every model in dir.
     
-    # Read model files
-    print "Reading model files from {0} and {1}...".format(dir, col)
-    models = readDirectory(dir)
-    colModel = readModel(col)
+        Returns (models, index, colModel), with models None if indexFile is given, else index None.
+        colModel is the term table of the collection model, if genModel.py wrote one.
+    """
+    models = None
+    index = None
+    if indexFile:
+        print "Reading index {0} and model file {1}...".format(indexFile, col)
+        index = invindex.readIndex(indexFile)
+    else:
+        print "Reading model files from {0} and {1}...".format(dir, col)
+        models = readDirectory(dir)
+    # The term table only reads the query terms, not the whole collection model
+    colModel = termtable.readTermTable(col)
+    if colModel is None:
+        colModel = readModel(col)
+    
+    return models, index, colModel
+
+def rankLoaded(terms, models, index, colModel, weight=0.5, K=10, phrase=False):
+    """ Rank the best K models, or through index if given, as loaded by loadModels().
+    
+        Returns (results, NR, ND) for writeReport().
+    """
+    if index:
+        # Only documents in the posting lists of the terms are scored
+        if numpy:
+            return rankVectorized(terms, index, colModel, weight, K, phrase)
+        return rankTopK(terms, index, colModel, weight, K, phrase)
     
     # Rank using mixture model equation. We need to find best lambda using a dev set of data.
+    return rankTopModels(terms, models, colModel, weight, K, phrase)
+
+def rank_documents(dir, col, outputFileName, terms, weight=0.5, indexFile=None, phrase=False, cacheDir=None):
+    
+    # Repeat queries over the same build of the models are read from the cache
+    cache = None
+    if cacheDir:
+        cache = querycache.QueryCache(querycache.buildId(dir, col, indexFile), cacheDir)
+        key = querycache.queryKey(terms, weight, 10, phrase)
+        data = cache.get(key)
+        if data is not None:
+            print "Writing cached report file {0}".format(outputFileName)
+            writeReportData(data, outputFileName)
+            return
+    
+    # Read model files
+    models, index, colModel = loadModels(dir, col, indexFile)
+    
     # Rank will return a list of the top N models.
     print "Ranking models over query terms: {0}...".format(terms)
-    results = rank(terms, models, colModel, weight)
+    results, NR, ND = rankLoaded(terms, models, index, colModel, weight, phrase=phrase)
+    if index:
+        index.close()
     
     # Write out the top N model data
     print "Writing report file {0}".format(outputFileName)    
-    writeReport(terms, results, outputFileName, colModel)
+    data = reportData(terms, results, colModel, NR=NR, ND=ND)
+    writeReportData(data, outputFileName)
+    if cache:
+        cache.put(key, data)
     
 def main(argv):
     dir = ""                # Directory of individual models 
     col = ""                # Path to model over collection 
     outputFileName = ""     # Where to write report of ranks 
     query = ""              # Query text
+    indexFile = ""          # Inverted index over individual models
+    phrase = False          # Also score adjacent query term pairs as bigrams
+    cacheDir = ""           # Directory of cached results
     
     try:
-        opts, args = getopt.getopt(argv, "hd:c:q:o:",["dir=", "col=", "query=", "output="])
+        opts, args = getopt.getopt(argv, "hd:c:q:o:x:p",["dir=", "col=", "query=", "output=", "index=", "phrase", "cache="])
     except getopt.GetoptError:
         printHelp()
         sys.exit(2)
@@ -397,8 +786,17 @@ def main(argv):
             outputFileName = arg
         elif opt in ('-q', '--query'):
             query = arg
+        elif opt in ('-x', '--index'):
+            indexFile = arg
+        elif opt in ('-p', '--phrase'):
+            phrase = True
+        elif opt == '--cache':
+            cacheDir = arg
             
-    if not checkPath(dir) or not checkPath(col):
+    if indexFile:
+        if not checkPath(indexFile) or not checkPath(col):
+            sys.exit()
+    elif not checkPath(dir) or not checkPath(col):
         sys.exit()
      
     start = time.clock()
@@ -410,7 +808,7 @@ def main(argv):
         sys.exit()
     
     # Rank documents by given models over given query terms 
-    rank_documents(dir, col, outputFileName, terms)
+    rank_documents(dir, col, outputFileName, terms, indexFile=indexFile, phrase=phrase, cacheDir=cacheDir)
     
     end = time.clock() - start
     print 'Time of execution: {0} seconds'.format(end)
@@ -0,0 +1,291 @@
+#!/usr/bin/python2.7
+# rankserver.py
+# Jeremy Johnston
+
+""" Long-running rank service.
+
+    Loads the models once, as rank.py does for a single query, then answers queries
+    over HTTP until stopped, each on its own thread. A query returns, as JSON, the data
+    rank.py writes to its report file:
+
+        GET /rank?q=ebola+virus&w=0.5&n=10&p=1
+
+    q is the white space separated query terms, w the mixture weight (default 0.5),
+    n the number of results (default 10) and p=1 scores adjacent terms as phrases, as
+    rank.py -p does. Results are cached, see querycache.py, so repeat queries are not
+    ranked again.
+
+    The build of the models is checked at most every few seconds, and when genModel.py
+    has rebuilt them, they and the cache are loaded again. Queries already running
+    finish over the build they started on, and its files are closed after the last.
+    genModel.py moves each mapped file it writes into place rather than writing over
+    it, so the files of a build still in use are never changed.
+
+    Usage: python rankserver.py -d <dir> -c <col> [-x <index>] [-p <port>]
+"""
+
+import sys
+import getopt
+import os
+import json
+import time
+import threading
+import logging
+import urlparse
+import BaseHTTPServer
+import SocketServer
+import rank
+import querycache
+
+class QueryCollection():
+    """ Per-query view of the shared collection model.
+
+        Ranking records the collection base probability of the query on the collection
+        model. Concurrent queries each rank against their own view instead.
+    """
+    def __init__(self, colModel):
+        self.colModel = colModel
+        self.modelFile = colModel.modelFile
+        self.queryProbability = 0
+
+    def getUnigram(self, word):
+        return self.colModel.getUnigram(word)
+
+    def getBigram(self, word1, word2):
+        return self.colModel.getBigram(word1, word2)
+
+class LoadedBuild():
+    """ One build of the models, as loaded by rank.loadModels(), and the cache of its results
+    """
+
+    def __init__(self, dir, col, indexFile=None, cacheDir=None, cacheSize=1000):
+        # Stamp the build before loading, so a rebuild during loading is not cached as this one
+        self.build = querycache.buildId(dir, col, indexFile)
+        self.models, self.index, self.colModel = rank.loadModels(dir, col, indexFile)
+        self.cache = querycache.QueryCache(self.build, cacheDir, cacheSize)
+
+        # rank.rank() scores on the loaded models themselves, so queries without
+        # an index take turns. Index queries only read shared state.
+        self.lock = threading.Lock()
+
+        self.users = 0          # queries answering from this build, see RankService.acquire()
+        self.retired = False    # replaced by a rebuild
+
+    def close(self):
+        """ Unmap the files of the build
+        """
+        if self.index:
+            self.index.close()
+        for model in self.models or []:
+            if hasattr(model, 'close'):
+                model.close()
+        if hasattr(self.colModel, 'close'):
+            self.colModel.close()
+
+class RankService():
+    """ Models loaded once by rank.loadModels(), ranked for each query, and loaded again on rebuild
+    """
+
+    def __init__(self, dir, col, indexFile=None, cacheDir=None, cacheSize=1000, checkInterval=2):
+        self.args = (dir, col, indexFile, cacheDir, cacheSize)
+        self.checkInterval = checkInterval
+        self.loaded = LoadedBuild(*self.args)
+        self.checked = time.time()
+        self.reloadLock = threading.Lock()
+        self.usersLock = threading.Lock()
+
+    def acquire(self):
+        """ Return the current LoadedBuild, kept open for the query until release()
+        """
+        self.current()
+        with self.usersLock:
+            loaded = self.loaded
+            loaded.users += 1
+        return loaded
+
+    def release(self, loaded):
+        with self.usersLock:
+            loaded.users -= 1
+            unused = loaded.retired and loaded.users == 0
+        if unused:
+            loaded.close()
+
+    def replace(self, loaded):
+        """ Answer new queries from loaded, and close the old build once its queries finish
+        """
+        with self.usersLock:
+            old = self.loaded
+            self.loaded = loaded
+            old.retired = True
+            unused = old.users == 0
+        if unused:
+            old.close()
+
+    def current(self):
+        """ Return the LoadedBuild to answer a query from, loading the models again if rebuilt
+        """
+        loaded = self.loaded
+        if time.time() - self.checked < self.checkInterval:
+            return loaded
+
+        with self.reloadLock:
+            if self.loaded is not loaded or time.time() - self.checked < self.checkInterval:
+                # Checked by another query meanwhile
+                return self.loaded
+            try:
+                build = querycache.buildId(*self.args[:3])
+                if build != loaded.build:
+                    logging.info('Models rebuilt, loading build {0}'.format(build))
+                    self.replace(LoadedBuild(*self.args))
+            except:
+                # Most likely caught part way through a rebuild, so try again at the next check
+                logging.exception('ERROR loading rebuilt models, still answering from build {0}'.format(loaded.build))
+            self.checked = time.time()
+            return self.loaded
+
+    def query(self, terms, weight=0.5, CUTOFF=10, phrase=False):
+        """ Return rank.reportData() of terms, from the cache if asked before
+        """
+        loaded = self.acquire()
+        try:
+            key = querycache.queryKey(terms, weight, CUTOFF, phrase)
+            data = loaded.cache.get(key)
+            if data is None:
+                data = self.rank(loaded, terms, weight, CUTOFF, phrase)
+                loaded.cache.put(key, data)
+            return data
+        finally:
+            self.release(loaded)
+
+    def rank(self, loaded, terms, weight, CUTOFF, phrase):
+        if loaded.index:
+            collection = QueryCollection(loaded.colModel)
+            results, NR, ND = rank.rankLoaded(terms, None, loaded.index, collection, weight, CUTOFF, phrase)
+            return rank.reportData(terms, results, collection, CUTOFF, NR, ND)
+
+        with loaded.lock:
+            for model in loaded.models:
+                model.queryProbability = 0
+            loaded.colModel.queryProbability = 0
+            results, NR, ND = rank.rankLoaded(terms, loaded.models, None, loaded.colModel, weight, CUTOFF, phrase)
+            return rank.reportData(terms, results, loaded.colModel, CUTOFF, NR, ND)
+
+class RankHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        url = urlparse.urlparse(self.path)
+        if url.path != '/rank':
+            self.sendJson(404, {'error': 'unknown path {0}, use /rank?q=<query>'.format(url.path)})
+            return
+
+        params = urlparse.parse_qs(url.query)
+        try:
+            terms = params.get('q', [''])[0].split()
+            weight = float(params.get('w', [0.5])[0])
+            cutoff = int(params.get('n', [10])[0])
+            phrase = params.get('p', ['0'])[0] not in ('', '0')
+            if len(terms) < 1:
+                raise ValueError('Please give query terms, space delimited, as q=<query>')
+            if weight < 0 or weight > 1:
+                raise ValueError('weight given should be in range [0, 1]')
+        except ValueError as e:
+            self.sendJson(400, {'error': str(e)})
+            return
+
+        try:
+            data = self.server.service.query(terms, weight, cutoff, phrase)
+        except:
+            msg = "ERROR ranking query terms {0}".format(terms)
+            logging.exception(msg)
+            self.sendJson(500, {'error': msg})
+            return
+
+        # Text model files keep the newline on their metadata lines. The data may be
+        # cached, so strip a copy.
+        data = dict(data)
+        data['collectionFile'] = data['collectionFile'].strip()
+        data['results'] = [dict(result, modelFile=result['modelFile'].strip(), originFile=result['originFile'].strip())
+                           for result in data['results']]
+        self.sendJson(200, data)
+
+    def sendJson(self, status, data):
+        body = json.dumps(data)
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logging.info("%s - %s", self.address_string(), format % args)
+
+class RankServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, service):
+        BaseHTTPServer.HTTPServer.__init__(self, address, RankHandler)
+        self.service = service
+
+def printHelp():
+    print 'Usage: \npython rankserver.py -d <dir> -c <col> -x <index> -p <port>'
+    print 'Loads models once and answers rank queries over HTTP, as GET /rank?q=<query>&w=<weight>&n=<count>&p=<phrase>'
+    print 'Options:'
+    print '\t-d <dir>\t--dir="<dir>"\tGive directory of individual model files to read'
+    print '\t-c <col>\t--col="<col>"\tGive model file over a collection to read'
+    print '\t-x <index>\t--index="<index>"\tRank through an inverted index written by genModel.py -x, instead of reading every model in <dir>'
+    print '\t-p <port>\t--port="<port>"\tPort to listen on, 8320 by default'
+    print '\t-H <host>\t--host="<host>"\tAddress to listen on, localhost by default'
+    print '\t--cache="<cacheDir>"\tAlso keep results in <cacheDir>, shared with rank.py --cache, not only in memory'
+    print '\t--cache-size=<N>\tNumber of results kept in memory, 1000 by default'
+
+def main(argv):
+    dir = ""                # Directory of individual models
+    col = ""                # Path to model over collection
+    indexFile = ""          # Inverted index over individual models
+    host = "localhost"
+    port = 8320
+    cacheDir = ""           # Directory of cached results
+    cacheSize = 1000        # Results cached in memory
+
+    try:
+        opts, args = getopt.getopt(argv, "hd:c:x:p:H:", ["dir=", "col=", "index=", "port=", "host=", "cache=", "cache-size="])
+    except getopt.GetoptError:
+        printHelp()
+        sys.exit(2)
+    for opt, arg in opts:
+        if opt == '-h':
+            printHelp()
+            sys.exit(1)
+        elif opt in ('-d', '--dir'):
+            dir = arg
+        elif opt in ('-c', '--col'):
+            col = arg
+        elif opt in ('-x', '--index'):
+            indexFile = arg
+        elif opt in ('-p', '--port'):
+            port = int(arg)
+        elif opt in ('-H', '--host'):
+            host = arg
+        elif opt == '--cache':
+            cacheDir = arg
+        elif opt == '--cache-size':
+            cacheSize = int(arg)
+
+    if indexFile:
+        if not rank.checkPath(indexFile) or not rank.checkPath(col):
+            sys.exit()
+    elif not rank.checkPath(dir) or not rank.checkPath(col):
+        sys.exit()
+
+    service = RankService(dir, col, indexFile, cacheDir, cacheSize)
+    server = RankServer((host, port), service)
+    print 'Answering rank queries at http://{0}:{1}/rank?q=<query>'.format(host, port)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    server.server_close()
+    print 'DONE\n\n'
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -2,71 +2,324 @@ import json
 import sys
 import getopt
 import os
-import codecs
 import nltk
+import docstore
+from collections import deque
+
+# Bytes read at a time from the input file, and items written between progress checkpoints
+CHUNK_SIZE = 1 << 20
+CHECKPOINT_ITEMS = 100
+
+# Items handed to each worker process ahead of the one being written, see formatItems()
+PENDING_PER_WORKER = 8
+
+WHITESPACE = ' \t\r\n'
 
 def read(fileName):
+    """
+    Return all items of fileName as a list. See iterItems() to read them one at a time.
+    """
     try:
-        file = codecs.open(fileName, encoding='utf-8')
-        data = json.load(file)
-        file.close()
-        return data
+        return [item for item, offset in iterItems(fileName)]
     except:
         print "ERROR reading {0}".format(fileName)
         raise
 
-def writeDoc(item, fileName):
+def iterItems(fileName, offset=0):
+    """
+    Yield each item of fileName, and the byte offset just past it, as it is parsed.
+    
+    fileName holds either a JSON array of items, as scrapy -o items.json writes, or one
+    item per line, JSON Lines, as scrapy -o items.jl writes. Only one item is held at a
+    time. Reading starts at byte offset, 0 or an offset yielded before.
+    """
+    file = open(fileName, 'rb')
     try:
-        print "Writing doc {0}...".format(fileName)
-        file = open(fileName, "w")
+        # An array starts with a bracket, after any whitespace
+        first = ''
+        while True:
+            chunk = file.read(CHUNK_SIZE)
+            first = chunk.lstrip(WHITESPACE)[:1]
+            if first or not chunk:
+                break
         
-        link = item['link']
-        
-        date = item['date']
-        if len(date) > 0:
-            date = date[0]
-        else:
-            date="NULL"
-        
-        title = item['title']
-        if len(title) > 0:
-            title = title[0]
+        file.seek(offset)
+        if first == '[':
+            items = iterArray(file, offset)
         else:
-            title = "NULL"
-        
-        body = item['body']
-        sentences = []
-        if len(body) > 0:
-            sentences = cleanBody(body)
-        else:
-            sentences.append("NULL")
-        
-        # Write the article metadata. Make sure to encode unicode characters 
-        # (converts tokens \uXXXX to right character)
-        file.write("{0}\n".format(link.encode('utf-8')))
-        file.write("{0}\n".format(date.encode('utf-8')))
-        file.write("{0}\n".format(title.encode('utf-8')))
+            items = iterLines(file, offset)
+        for item, end in items:
+            yield item, end
+    finally:
+        file.close()
+
+def iterLines(file, offset):
+    """
+    Yield each (item, offset) of a JSON Lines file, read from byte offset
+    """
+    for line in file:
+        offset += len(line)
+        if line.strip(WHITESPACE):
+            yield json.loads(line), offset
+
+def iterArray(file, offset):
+    """
+    Yield each (item, offset) of a JSON array file, read in chunks from byte offset
+    """
+    decoder = json.JSONDecoder()
+    buf, pos = '', 0        # buf holds the bytes of the file from offset
+    opened = offset > 0
+    
+    while True:
+        # Skip the opening bracket, and the whitespace and commas between items
+        while True:
+            if pos == len(buf):
+                chunk = file.read(CHUNK_SIZE)
+                if not chunk:
+                    return
+                offset += pos
+                buf, pos = chunk, 0
+            c = buf[pos]
+            if c == '[' and not opened:
+                opened = True
+            elif c not in WHITESPACE and c != ',':
+                break
+            pos += 1
+        if buf[pos] == ']':
+            return
         
-        # Write each sentence
-        for s in sentences:
-            file.write("{0}\n".format(s.encode('utf-8')))
+        # Parse the next item, reading on until it is whole
+        while True:
+            try:
+                item, end = decoder.raw_decode(buf, pos)
+                break
+            except ValueError:
+                chunk = file.read(CHUNK_SIZE)
+                if not chunk:
+                    raise
+                offset += pos
+                buf, pos = buf[pos:] + chunk, 0
         
+        yield item, offset + end
+        pos = end
+
+def progressFile(jsonFileName):
+    return jsonFileName + '.progress'
+
+def readProgress(jsonFileName, outputName):
+    """
+    Return the progress checkpoint of reading jsonFileName into outputName, or None if there is none
+    """
+    fileName = progressFile(jsonFileName)
+    if not os.path.exists(fileName):
+        return None
+    try:
+        file = open(fileName)
+        progress = json.load(file)
+        file.close()
+    except:
+        print "ERROR reading {0}".format(fileName)
+        raise
+    if progress['output'] != os.path.abspath(outputName):
+        raise ValueError('{0} is progress of reading into {1}, not {2}'.format(fileName, progress['output'], outputName))
+    return progress
+
+def writeProgress(jsonFileName, progress):
+    fileName = progressFile(jsonFileName)
+    
+    # Write then rename, so a crash never leaves part of a checkpoint
+    try:
+        file = open(fileName + '.tmp', 'w')
+        json.dump(progress, file)
         file.close()
+        if os.path.exists(fileName):
+            os.remove(fileName)
+        os.rename(fileName + '.tmp', fileName)
     except:
         print "ERROR writing {0}".format(fileName)
         raise
+
+def ingest(jsonFileName, outputName, writeText, checkpoint=None, progress=None, workers=1):
+    """
+    Write the document text of each item i of jsonFileName with writeText(i, text) as it is parsed.
+    
+    With more than one worker, items are formatted on a process pool, see formatItems().
+    
+    Every CHECKPOINT_ITEMS items, and at the end, checkpoint() is called to make the
+    items written so far last, and the byte offset reached is written to
+    <jsonFileName>.progress, with what checkpoint() returns. Given such a progress,
+    reading starts from its offset, so a crashed run can be resumed.
+    """
+    if progress is None:
+        progress = {'output': os.path.abspath(outputName), 'offset': 0, 'items': 0}
+    else:
+        print "Resuming at byte offset {0} of {1}, item {2}".format(progress['offset'], jsonFileName, progress['items'])
+    
+    def save():
+        if checkpoint:
+            progress.update(checkpoint())
+        writeProgress(jsonFileName, progress)
+    
+    # Items marked duplicates by the crawl's DedupPipeline are left out
+    items = ((item, offset) for item, offset in iterItems(jsonFileName, progress['offset']) if not item.get('duplicate_of'))
+    for text, offset in formatItems(items, workers):
+        writeText(progress['items'], text)
+        progress['offset'] = offset
+        progress['items'] += 1
+        if progress['items'] % CHECKPOINT_ITEMS == 0:
+            save()
+    save()
+
+def formatItem(args):
+    """
+    Worker process entry point. Return (text, offset) of an (item, offset) of iterItems().
+    """
+    item, offset = args
+    return formatDoc(item), offset
+
+def formatItems(items, workers=1):
+    """
+    Yield (text, offset) of each (item, offset) of items, in order.
+    
+    With more than one worker, items are formatted on a process pool, at most a few
+    per worker handed out ahead of the one written, so memory stays bounded however
+    long the input is.
+    """
+    if workers <= 1:
+        for args in items:
+            yield formatItem(args)
+        return
+    
+    import multiprocessing
+    pool = multiprocessing.Pool(workers, initializer=getSentTokenizer)
+    try:
+        pending = deque()
+        for args in items:
+            pending.append(pool.apply_async(formatItem, (args,)))
+            if len(pending) >= workers * PENDING_PER_WORKER:
+                yield pending.popleft().get()
+        while pending:
+            yield pending.popleft().get()
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+def formatDoc(item):
+    """
+    Return the text of the document of item: link, date and title lines, then one sentence per line
+    """
+    link = item['link']
+    
+    date = item['date']
+    if len(date) > 0:
+        date = date[0]
+    else:
+        date="NULL"
+    
+    title = item['title']
+    if len(title) > 0:
+        title = title[0]
+    else:
+        title = "NULL"
+    
+    body = item['body']
+    sentences = []
+    if len(body) > 0:
+        sentences = cleanBody(body)
+    else:
+        sentences.append("NULL")
+    
+    # Write the article metadata. Make sure to encode unicode characters 
+    # (converts tokens \uXXXX to right character)
+    lines = [link.encode('utf-8'), date.encode('utf-8'), title.encode('utf-8')]
+    
+    # Write each sentence
+    for s in sentences:
+        lines.append(s.encode('utf-8'))
+    
+    return "".join("{0}\n".format(line) for line in lines)
+
+def writeDoc(item, fileName):
+    writeDocFile(formatDoc(item), fileName)
+
+def writeDocFile(text, fileName):
+    try:
+        print "Writing doc {0}...".format(fileName)
+        file = open(fileName, "w")
+        file.write(text)
+        file.close()
+    except:
+        print "ERROR writing {0}".format(fileName)
+        raise
+
+def writeStore(jsonFileName, storeName, resume=False, workers=1, append=False):
+    """
+    Add the document of each item of jsonFileName to document store storeName, see docstore.py
+    
+    An existing store is only added to if append, or when resuming the run that wrote it,
+    so the documents of a crawl are not stored twice.
+    """
+    progress = None
+    if resume:
+        progress = readProgress(jsonFileName, storeName)
+    if docstore.isStore(storeName) and not append and not progress:
+        raise ValueError('Document store {0} already exists. Resume the run writing it with -r, or add to it with --append'.format(storeName))
+    
+    writer = docstore.DocStoreWriter(storeName, append=True)
+    if progress:
+        # Documents added after the checkpoint are added again
+        writer.truncate(progress['docs'])
+    
+    def writeText(i, text):
+        docId = writer.add(text)
+        print "Writing doc {0}...".format(docstore.documentRef(storeName, docId))
+    
+    def checkpoint():
+        writer.flush()
+        return {'docs': len(writer)}
+    
+    try:
+        ingest(jsonFileName, storeName, writeText, checkpoint, progress, workers)
+    except:
+        print "ERROR writing store {0}".format(storeName)
+        raise
+    finally:
+        writer.close()
+
+def writeDocs(jsonFileName, outputPath, resume=False, workers=1):
+    """
+    Write the document of each item i of jsonFileName to <outputPath>_<i>.txt
+    """
+    progress = None
+    if resume:
+        progress = readProgress(jsonFileName, outputPath)
+    
+    writeText = lambda i, text: writeDocFile(text, outputPath + '_' + repr(i) + '.txt')
+    ingest(jsonFileName, outputPath, writeText, progress=progress, workers=workers)
         
+# Punkt sentence tokenizer of this process, loaded on first use
+sentTokenizer = None
+
+def getSentTokenizer():
+    """
+    Return the Punkt sentence tokenizer, unpickling it only the first time
+    """
+    global sentTokenizer
+    if sentTokenizer is None:
+        sentTokenizer = nltk.data.load('tokenizers/punkt/english.pickle')
+    return sentTokenizer
+
 def cleanBody(body):
     """
     Clean any other markup, join paragraphs, and separate by sentence
     """
-    text = u""
-    for p in body:
-        text = text + p
+    text = u"".join(body)
     
     # Fetch a tokenizer for sentence segmentation
-    sent_tokenizer = nltk.data.load('tokenizers/punkt/english.pickle')
-    sentences = sent_tokenizer.tokenize(text)
+    sentences = getSentTokenizer().tokenize(text)
     
     return sentences
         
@@ -79,19 +332,30 @@ def printItem(item):
     print "Second paragraph: \n", item['body'][1]
 
 def printHelp():
-    print "\nUsage: python readjson.py -i <inputJsonFile> -o <outputFilePrefix>"
+    print "\nUsage: python readjson.py -i <inputJsonFile> [-o <outputFilePrefix> | -s <store>]"
     print "\t-i <inputJsonFile>\t\t*.json file of items to read in"
     print '\talso can do --input="<inputJsonFile>"\n'
     print "\t-o <outputFilePrefix>\t\tFor each item i, file <outputFilePrefix>_[i].txt will contain raw text with one sentence per line"
     print '\talso can do --output="<outputFilePrefix>"\n'
+    print "\t-s <store>\t\tInstead of a file each, add the documents of all items to document store <store>, for genModel.py -d <store>. See docstore.py"
+    print '\talso can do --store="<store>"\n'
+    print "\t-r\t\tResume from the byte offset of the input reached by the last run, kept in <inputJsonFile>.progress"
+    print '\talso can do --resume\n'
+    print "\t--append\t\tWith -s, add the documents to an existing store. Without it or -r, an existing store is an error, so a crawl is not stored twice\n"
+    print "\t--workers=<N>\t\tSplit items into sentences on a pool of N processes. Documents are written in the same order as with one."
+    print "\tThe input is read as it is parsed, either a JSON array of items or JSON Lines, one item per line (scrapy -o items.jl)\n"
     print "\n"
     
 def main(argv):
     outputPath = ""
+    storeName = ""
     jsonFileName = ""
+    resume = False
+    append = False
+    workers = 1
 
     try:
-        opts, args = getopt.getopt(argv, "hi:o:",["input=,output="])
+        opts, args = getopt.getopt(argv, "hi:o:s:r",["input=", "output=", "store=", "resume", "append", "workers="])
     except getopt.GetoptError:
         printHelp()
         sys.exit(2)
@@ -103,18 +367,27 @@ def main(argv):
             jsonFileName = arg
         elif opt in ("-o", "--output"):
             outputPath = arg
+        elif opt in ("-s", "--store"):
+            storeName = arg
+        elif opt in ("-r", "--resume"):
+            resume = True
+        elif opt == "--append":
+            append = True
+        elif opt == "--workers":
+            workers = int(arg)
             
     if not os.path.exists(jsonFileName):
         print '\nPath {0} does not exist'.format(jsonFileName)
         sys.exit()
     
-    # Get all data
-    data = read(jsonFileName)
-    
-    # Write each item to a separate doc
-    for i in range(len(data)):
-        output = outputPath + '_' + repr(i) + '.txt'
-        writeDoc(data[i], output)
+    # Write each item as it is read, to the store or a separate doc
+    if storeName:
+        if docstore.isStore(storeName) and not append and not (resume and readProgress(jsonFileName, storeName)):
+            print '\nDocument store {0} already exists. Give -r to resume the run writing it, or --append to add to it'.format(storeName)
+            sys.exit(2)
+        writeStore(jsonFileName, storeName, resume, workers, append)
+    else:
+        writeDocs(jsonFileName, outputPath, resume, workers)
         
     print "DONE writing docs"
     
@@ -1 +1,2 @@
-scrapy crawl cdc_archive -a session_id=005 -o articles_first5.json
+REM Crawl the CDC media archive. Give the URL of its JSON feed, with {page} in place of the page number
+scrapy crawl cdc_archive -a session_id=005 -a feed_url=%1 -o articles_first5.json
@@ -0,0 +1,197 @@
+#!/usr/bin/python2.7
+# termtable.py
+# Jeremy Johnston
+
+""" Term table written alongside a collection model.
+
+    Holds what rank.py and extract.py need of the collection, the count and log
+    probability of each term, plus the term frequency vector of each document model
+    built with it, so neither has to read the collection model to look up a few terms.
+    genModel.py writes <modelFilePrefix>_all.terms next to <modelFilePrefix>_all.model.
+
+    Terms are identified by their term id, their position among the sorted collection
+    unigram words. This is not the id of vocab.py's vocabulary. The term frequency of
+    a word in a document is the number of bigrams of the word in the document model,
+    as extract.summarize() uses it.
+
+    Layout (little endian), built on the binmodel.py section helpers:
+
+        header          magic, version, nTerms, nDocs, nEntries, section offsets
+        term strings    string table of nTerms sorted terms
+        term counts     uint32[nTerms], count of each term in the collection model
+        term probs      float64[nTerms], log probability of each term in the collection model
+        doc strings     string table of nDocs sorted model file base names
+        doc rows        uint32[nDocs + 1], row pointers into the entry arrays
+        entry terms     uint32[nEntries], term id, ascending in each row
+        entry tfs       uint32[nEntries], term frequency, only nonzero ones kept
+"""
+
+import os
+import mmap
+import struct
+import array
+from binmodel import writeArray, readArray, writeStrings, stringAt, searchStrings, replaceFile
+from genModel import Unigram
+
+MAGIC = 'ALBT'
+VERSION = 1
+
+# magic, version, nTerms, nDocs, nEntries, then 9 section offsets
+HEADER = struct.Struct('<4sIIII9Q')
+
+def termTableFile(colFile):
+    """ Return the term table file name of collection model file colFile
+    """
+    if colFile.endswith('.model'):
+        colFile = colFile[:-len('.model')]
+    return colFile + '.terms'
+
+class TermTableBuilder():
+    """ Collects the term frequency vectors of document models, then writes them with a collection model
+    """
+
+    def __init__(self):
+        self.docs = {}      # model file base name -> {word: term frequency}
+
+    def add(self, modelFile, model):
+        tf = {}
+        for unigram in model.words.itervalues():
+            if unigram.bigrams:
+                tf[unigram.word] = len(unigram.bigrams)
+        self.docs[os.path.basename(modelFile)] = tf
+
+    def merge(self, other):
+        self.docs.update(other.docs)
+
+    def write(self, fileName, colModel):
+        terms = sorted(colModel.words.iterkeys())
+        ids = dict((w, i) for i, w in enumerate(terms))
+
+        counts = array.array('I')
+        probs = array.array('d')
+        for term in terms:
+            counts.append(colModel.words[term].count)
+            probs.append(colModel.words[term].probability)
+
+        names = sorted(self.docs.iterkeys())
+        rows = [0]
+        entryTerms = array.array('I')
+        entryTfs = array.array('I')
+        for name in names:
+            for i, tf in sorted((ids[w], tf) for w, tf in self.docs[name].iteritems() if w in ids):
+                entryTerms.append(i)
+                entryTfs.append(tf)
+            rows.append(len(entryTerms))
+
+        # Written aside and moved into place, as a rank server may have the old table mapped
+        tempName = fileName + '.tmp'
+        try:
+            file = open(tempName, 'wb')
+            file.write('\0' * HEADER.size)
+
+            offsets = list(writeStrings(file, terms))
+            offsets.append(writeArray(file, 'I', counts))
+            offsets.append(writeArray(file, 'd', probs))
+            offsets.extend(writeStrings(file, names))
+            offsets.append(writeArray(file, 'I', rows))
+            offsets.append(writeArray(file, 'I', entryTerms))
+            offsets.append(writeArray(file, 'I', entryTfs))
+
+            file.seek(0)
+            file.write(HEADER.pack(MAGIC, VERSION, len(terms), len(names), len(entryTerms), *offsets))
+            file.close()
+            replaceFile(tempName, fileName)
+        except:
+            print 'ERROR writing term table file {0}'.format(fileName)
+            raise
+
+class TermTable():
+    """ Memory-mapped term table file, standing in for its collection model when ranking.
+
+        Unigram lookups are answered from the table. Bigram lookups, only needed for
+        phrase queries, read the collection model itself the first time one is asked.
+    """
+
+    def __init__(self, fileName, colFile):
+        self.fileName = fileName
+        self.modelFile = colFile
+        self.queryProbability = 0
+        self.colModel = None
+
+        file = open(fileName, 'rb')
+        try:
+            fields = HEADER.unpack(file.read(HEADER.size))
+            if fields[0] != MAGIC:
+                raise ValueError('{0} is not a term table file'.format(fileName))
+            if fields[1] != VERSION:
+                raise ValueError('{0} has term table version {1}, expected {2}'.format(fileName, fields[1], VERSION))
+            self.nTerms, self.nDocs, self.nEntries = fields[2:5]
+            (self.offTermOffsets, self.offTermData, self.offCount, self.offProb,
+             self.offDocOffsets, self.offDocData, self.offRow, self.offTerm, self.offTf) = fields[5:]
+            self.buf = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+            self.mtime = os.fstat(file.fileno()).st_mtime
+        finally:
+            file.close()
+
+    def close(self):
+        self.buf.close()
+        if self.colModel is not None and hasattr(self.colModel, 'close'):
+            self.colModel.close()
+
+    def findTerm(self, word):
+        """ Return term id of word, or -1 if not in the collection
+        """
+        return searchStrings(self.buf, self.offTermOffsets, self.offTermData, word, 0, self.nTerms)
+
+    def termAt(self, i):
+        return stringAt(self.buf, self.offTermOffsets, self.offTermData, i)
+
+    def getUnigram(self, word):
+        """ Return a pair (unigram, boolFound), as FeatureSet.getUnigram() of the collection model
+        """
+        i = self.findTerm(word)
+        if i < 0:
+            return Unigram("NULL_DNE", 0, 0), False
+        count, = struct.unpack_from('<I', self.buf, self.offCount + 4 * i)
+        prob, = struct.unpack_from('<d', self.buf, self.offProb + 8 * i)
+        return Unigram(word, count, prob), True
+
+    def getBigram(self, word1, word2):
+        if self.colModel is None:
+            import rank
+            self.colModel = rank.readModel(self.modelFile)
+        return self.colModel.getBigram(word1, word2)
+
+    def idfTable(self, words):
+        """ Return the idf of each of words in the collection, its count, as extract.idfTable() does
+        """
+        idf = {}
+        for word in words:
+            i = self.findTerm(word)
+            if i >= 0:
+                idf[word] = struct.unpack_from('<I', self.buf, self.offCount + 4 * i)[0]
+        return idf
+
+    def tfTable(self, modelFile):
+        """ Return the term frequency of each word of document model modelFile, or None if not in the table.
+
+            Also None if the model file was written after the table, as by genModel.py -i
+            without the collection, when its vector here may be stale.
+        """
+        if os.path.exists(modelFile) and os.path.getmtime(modelFile) > self.mtime:
+            return None
+        d = searchStrings(self.buf, self.offDocOffsets, self.offDocData, os.path.basename(modelFile), 0, self.nDocs)
+        if d < 0:
+            return None
+        start, end = struct.unpack_from('<II', self.buf, self.offRow + 4 * d)
+        terms = readArray(self.buf, 'I', self.offTerm + 4 * start, end - start)
+        tfs = readArray(self.buf, 'I', self.offTf + 4 * start, end - start)
+        return dict((self.termAt(i), tf) for i, tf in zip(terms, tfs))
+
+def readTermTable(colFile):
+    """ Return the TermTable written with collection model colFile, or None if there is none
+    """
+    fileName = termTableFile(colFile)
+    if not os.path.exists(fileName):
+        return None
+    return TermTable(fileName, colFile)
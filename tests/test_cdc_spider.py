@@ -0,0 +1,123 @@
+""" Tests of the cdc_archive spider's feed parsing against a local fixture server.
+
+    Serves tests/fixtures over HTTP, fetches the feed and article pages from it, and
+    hands them to the spider as Scrapy responses. Skipped if scrapy is not installed.
+
+    Run from the repository root with: python -m unittest discover -s tests
+"""
+
+import os
+import sys
+import json
+import posixpath
+import threading
+import unittest
+import urllib
+import urllib2
+import BaseHTTPServer
+import SimpleHTTPServer
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+try:
+    import scrapy
+    from scrapy.http import HtmlResponse, TextResponse
+    from scrapy.settings import Settings
+    from scrapy.utils.test import get_crawler
+    from scrapy.spidermiddlewares.depth import DepthMiddleware
+    from alembic.spiders.cdc_spider import Cdc_archive_spider
+except ImportError:
+    scrapy = None
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+class FixtureHandler(SimpleHTTPServer.SimpleHTTPRequestHandler):
+    """ Serves files of FIXTURES, wherever the tests are run from
+    """
+
+    def translate_path(self, path):
+        path = posixpath.normpath(urllib.unquote(path.split('?', 1)[0].split('#', 1)[0]))
+        return os.path.join(FIXTURES, *[p for p in path.split('/') if p and p not in ('.', '..')])
+
+    def log_message(self, format, *args):
+        pass
+
+@unittest.skipIf(scrapy is None, 'scrapy is not installed')
+class TestFeed(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = BaseHTTPServer.HTTPServer(('localhost', 0), FixtureHandler)
+        cls.base = 'http://localhost:{0}'.format(cls.server.server_port)
+        thread = threading.Thread(target=cls.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        self.spider = Cdc_archive_spider(session_id='test', feed_url=self.base + '/feed_{page}.json',
+                                         domains='localhost', selenium=0)
+
+    def fetch(self, url, responseClass=None, **meta):
+        responseClass = responseClass or TextResponse
+        body = urllib2.urlopen(url).read()
+        request = scrapy.Request(url, meta=meta)
+        return responseClass(url=url, body=body, request=request, encoding='utf-8')
+
+    def testFeedLinksAndPageCount(self):
+        data = json.loads(urllib2.urlopen(self.base + '/feed_1.json').read())
+        self.assertEqual(list(self.spider.feedLinks(data)), ['article_1.html', '/article_2.html'])
+        self.assertEqual(self.spider.pageCount(data), 2)
+        self.assertEqual(self.spider.pageCount({'results': []}), None)
+
+    def testFirstPageRequestsArticlesAndOtherPages(self):
+        results = list(self.spider.parseFeed(self.fetch(self.base + '/feed_1.json', page=1)))
+        articles = [r.url for r in results if r.meta.get('crawl_state')]
+        pages = [r.meta['page'] for r in results if 'page' in r.meta]
+        self.assertEqual(articles, [self.base + '/article_1.html', self.base + '/article_2.html'])
+        self.assertEqual(pages, [2])
+        self.assertEqual(self.spider.articles, 2)
+
+    def testLastPageRequestsNoMorePages(self):
+        results = list(self.spider.parseFeed(self.fetch(self.base + '/feed_2.json', page=2)))
+        self.assertEqual([r.url for r in results], ['http://localhost/article_3.html'])
+
+    def testMaxPages(self):
+        spider = Cdc_archive_spider(feed_url=self.base + '/feed_{page}.json', max_pages=1, selenium=0)
+        results = list(spider.parseFeed(self.fetch(self.base + '/feed_1.json', page=1)))
+        self.assertEqual([r for r in results if 'page' in r.meta], [])
+
+    def testUncountedFeedFollowedPastDepthLimit(self):
+        # Pages without a page count are followed one at a time, each one deeper
+        settings = Settings()
+        settings.setmodule('alembic.settings', priority='project')
+        settings.set('LOG_FILE', None)
+        crawler = get_crawler(Cdc_archive_spider, settings.copy_to_dict())
+        spider = Cdc_archive_spider.from_crawler(crawler, feed_url=self.base + '/uncounted_{page}.json', selenium=0)
+        depth = DepthMiddleware.from_crawler(crawler)
+
+        articles = []
+        request = spider.feedRequest(1)
+        while request is not None:
+            response = self.fetch(request.url, **request.meta)
+            request = None
+            for r in depth.process_spider_output(response, spider.parseFeed(response), spider):
+                if 'page' in r.meta:
+                    request = r
+                else:
+                    articles.append(r.url)
+        self.assertEqual(articles, [self.base + '/update_{0}.html'.format(p) for p in (1, 2, 3, 4)])
+
+    def testArticle(self):
+        items = self.spider.parse(self.fetch(self.base + '/article_1.html', HtmlResponse))
+        self.assertEqual(len(items), 1)
+        item = items[0]
+        self.assertEqual(item['title'], [u'CDC confirms Ebola case'])
+        self.assertEqual(item['date'], [u'October 1, 2014'])
+        self.assertEqual(len(item['body']), 2)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,132 @@
+""" Tests of duplicate detection, alembic/dedup.py, and of DedupPipeline across crawls.
+
+    The pipeline tests are skipped if scrapy is not installed.
+
+    Run from the repository root with: python -m unittest discover -s tests
+"""
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from alembic.dedup import DedupIndex, DedupState
+try:
+    import scrapy
+    from scrapy import signals
+    from scrapy.http import HtmlResponse
+    from scrapy.settings import Settings
+    from scrapy.exceptions import DropItem
+    from scrapy.utils.test import get_crawler
+    from alembic.middlewares import IncrementalCrawl
+    from alembic.pipelines import DedupPipeline
+except ImportError:
+    scrapy = None
+
+BODY = [u"The Centers for Disease Control and Prevention confirmed the first case of Ebola virus "
+        u"disease diagnosed in the United States, in a patient who had traveled from Liberia.",
+        u"Health officials are tracing everyone who had contact with the patient while infectious, "
+        u"and will watch them for twenty one days for any sign of fever."]
+# One word more
+NEAR = [BODY[0], BODY[1] + u" today"]
+# Same words, other case and spacing
+EXACT = [u"  ".join(BODY).upper()]
+OTHER = [u"Measles cases reported this year are the most in two decades, most of them in people "
+         u"who were not vaccinated, according to the latest surveillance report."]
+
+class TestDedupIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def testExactNearAndDistinct(self):
+        index = DedupIndex()
+        self.assertEqual(index.add('a', BODY), None)
+        self.assertEqual(index.add('b', EXACT), ('exact', 'a'))
+        self.assertEqual(index.add('c', NEAR), ('near', 'a'))
+        self.assertEqual(index.add('d', OTHER), None)
+        self.assertEqual(len(index), 2)
+
+    def testChangedBodyReplacesItsOwn(self):
+        index = DedupIndex()
+        index.add('a', BODY)
+        self.assertEqual(index.add('a', NEAR), None)
+        self.assertEqual(index.add('a', OTHER), None)
+        # The first body is no longer kept under 'a'
+        self.assertEqual(index.add('b', BODY), None)
+        self.assertEqual(index.add('c', OTHER), ('exact', 'a'))
+
+    def testStateKeepsBodiesBetweenCrawls(self):
+        fileName = os.path.join(self.tmp, 'dedup.db')
+        for key, body, expected in (('a', BODY, None), ('b', NEAR, ('near', 'a')),
+                                    ('c', EXACT, ('exact', 'a')), ('a', NEAR, None)):
+            state = DedupState(fileName)
+            index = DedupIndex()
+            index.attach(state)
+            self.assertEqual(index.add(key, body), expected)
+            state.close()
+
+    def testStateOfOtherSignaturesRefused(self):
+        fileName = os.path.join(self.tmp, 'dedup.db')
+        state = DedupState(fileName)
+        DedupIndex().attach(state)
+        state.close()
+        state = DedupState(fileName)
+        self.assertRaises(ValueError, DedupIndex(permutations=64, bands=16).attach, state)
+        state.close()
+
+@unittest.skipIf(scrapy is None, 'scrapy is not installed')
+class TestDedupAcrossCrawls(unittest.TestCase):
+    """ An article and a copy of it at another link, crawled twice with IncrementalCrawl
+    """
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.spider = scrapy.Spider('test')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def crawl(self):
+        """ Return the links of the items kept by one crawl of both articles
+        """
+        settings = Settings()
+        settings.setmodule('alembic.settings', priority='project')
+        settings.set('LOG_FILE', None)
+        settings.set('CRAWL_STATE', os.path.join(self.tmp, 'crawlstate.db'))
+        settings.set('DEDUP_STATE', os.path.join(self.tmp, 'dedup.db'))
+        crawler = get_crawler(scrapy.Spider, settings.copy_to_dict())
+        middleware = IncrementalCrawl.from_crawler(crawler)
+        pipeline = DedupPipeline.from_crawler(crawler)
+        middleware.spider_opened(self.spider)
+        pipeline.open_spider(self.spider)
+
+        kept = []
+        for url in ('http://localhost/article_1.html', 'http://localhost/copy_of_1.html'):
+            request = scrapy.Request(url, meta={'crawl_state': True})
+            response = HtmlResponse(url, body='<html></html>', request=request)
+            item = {'link': url, 'title': [u'CDC confirms Ebola case'], 'body': BODY}
+            for item in middleware.process_spider_output(response, [item], self.spider):
+                try:
+                    item = pipeline.process_item(item, self.spider)
+                except DropItem:
+                    continue
+                crawler.signals.send_catch_log(signals.item_scraped, item=item, response=response, spider=self.spider)
+                kept.append(item['link'])
+
+        pipeline.close_spider(self.spider)
+        middleware.spider_closed(self.spider, 'finished')
+        return kept
+
+    def testCopyDroppedEveryCrawl(self):
+        self.assertEqual(self.crawl(), ['http://localhost/article_1.html'])
+        # The article is unchanged, so not passed on, and the copy, never kept, is fetched again
+        self.assertEqual(self.crawl(), [])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,52 @@
+""" Tests of docstore.py document stores.
+
+    Run from the repository root with: python -m unittest discover -s tests
+"""
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import docstore
+
+class TestDocStoreWriter(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.store = os.path.join(self.tmp, 'docs.store')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def testFlushNeverLeavesStoreWithoutIndex(self):
+        writer = docstore.DocStoreWriter(self.store)
+        writer.add("http://a\n2014\nfirst\nthe ebola virus\n")
+        writer.flush()
+
+        # Whenever the index is written over, the store must still be a store
+        remove = os.remove
+        def checkedRemove(path):
+            remove(path)
+            self.assertTrue(docstore.isStore(self.store), 'index removed before its replacement was in place')
+        docstore.os.remove = checkedRemove
+        try:
+            writer.add("http://b\n2014\nsecond\nthe measles virus\n")
+            writer.close()
+        finally:
+            docstore.os.remove = remove
+
+        store = docstore.DocStore(self.store)
+        self.assertEqual(len(store), 2)
+        self.assertEqual(store.read(1).splitlines()[0], "http://b")
+        store.close()
+
+    def testExistingStoreRefusedUnlessAppending(self):
+        docstore.DocStoreWriter(self.store).close()
+        self.assertRaises(ValueError, docstore.DocStoreWriter, self.store)
+        docstore.DocStoreWriter(self.store, append=True).close()
+
+if __name__ == '__main__':
+    unittest.main()
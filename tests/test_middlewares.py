@@ -0,0 +1,84 @@
+""" Tests of the alembic middlewares, built by Scrapy from the project's own settings.
+
+    Skipped if scrapy is not installed.
+
+    Run from the repository root with: python -m unittest discover -s tests
+"""
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+try:
+    import scrapy
+    from scrapy import signals
+    from scrapy.http import HtmlResponse
+    from scrapy.settings import Settings
+    from scrapy.utils.test import get_crawler
+    from scrapy.core.downloader.middleware import DownloaderMiddlewareManager
+    from scrapy.core.spidermw import SpiderMiddlewareManager
+    from alembic.middlewares import PoliteThrottle, IncrementalCrawl
+except ImportError:
+    scrapy = None
+
+def projectCrawler(**overrides):
+    """ Return a crawler with the settings of alembic/settings.py, and overrides
+    """
+    settings = Settings()
+    settings.setmodule('alembic.settings', priority='project')
+    settings.set('LOG_FILE', None)
+    for name, value in overrides.iteritems():
+        settings.set(name, value)
+    return get_crawler(scrapy.Spider, settings.copy_to_dict())
+
+@unittest.skipIf(scrapy is None, 'scrapy is not installed')
+class TestMiddlewares(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.crawler = projectCrawler(CRAWL_STATE=os.path.join(self.tmp, 'crawlstate.db'))
+        self.spider = scrapy.Spider('test')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def testBuildDownloaderMiddlewares(self):
+        manager = DownloaderMiddlewareManager.from_crawler(self.crawler)
+        self.assertEqual(len([m for m in manager.middlewares if isinstance(m, PoliteThrottle)]), 1)
+
+    def testBuildSpiderMiddlewares(self):
+        manager = SpiderMiddlewareManager.from_crawler(self.crawler)
+        self.assertEqual(len([m for m in manager.middlewares if isinstance(m, IncrementalCrawl)]), 1)
+
+    def crawl(self, kept):
+        """ Pass the item of one article through IncrementalCrawl, as scraped if kept.
+
+            Returns the items passed on to the pipelines.
+        """
+        crawler = projectCrawler(CRAWL_STATE=os.path.join(self.tmp, 'crawlstate.db'))
+        middleware = IncrementalCrawl.from_crawler(crawler)
+        middleware.spider_opened(self.spider)
+
+        url = 'http://localhost/article_1.html'
+        request = scrapy.Request(url, meta={'crawl_state': True})
+        response = HtmlResponse(url, body='<html></html>', request=request, headers={'ETag': '"1"'})
+        item = {'link': url, 'title': [u'CDC confirms Ebola case'], 'body': [u'A patient tested positive.']}
+        items = list(middleware.process_spider_output(response, [item], self.spider))
+        if kept:
+            for item in items:
+                crawler.signals.send_catch_log(signals.item_scraped, item=item, response=response, spider=self.spider)
+        middleware.spider_closed(self.spider, 'finished')
+        return items
+
+    def testItemRecordedOnlyOnceKept(self):
+        # Dropped by a pipeline, so passed on again by the next crawl
+        self.assertEqual(len(self.crawl(kept=False)), 1)
+        self.assertEqual(len(self.crawl(kept=True)), 1)
+        # Unchanged since it was kept
+        self.assertEqual(self.crawl(kept=True), [])
+
+if __name__ == '__main__':
+    unittest.main()
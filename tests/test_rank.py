@@ -0,0 +1,67 @@
+""" Tests of rank.py over a directory of models built by genModel.py -b.
+
+    Run from the repository root with: python -m unittest discover -s tests
+"""
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import genModel
+import rank
+
+DOCS = [
+    "http://a\n2014\nfirst\nthe ebola virus\nebola spreads\n",
+    "http://b\n2014\nsecond\nthe measles virus\n",
+    "http://c\n2014\nthird\nebola virus outbreak\n",
+]
+
+class TestCollectionInModelDir(unittest.TestCase):
+    """ genModel.py -b writes the collection model next to the documents' models
+    """
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        docs = os.path.join(self.tmp, 'docs')
+        self.models = os.path.join(self.tmp, 'models')
+        os.mkdir(docs)
+        os.mkdir(self.models)
+        for i, text in enumerate(DOCS):
+            file = open(os.path.join(docs, 'doc_{0}.txt'.format(i)), 'w')
+            file.write(text)
+            file.close()
+        self.prefix = os.path.join(self.models, 'articles')
+        genModel.modeBoth(docs, self.prefix, index=True)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def testCollectionIsNotADocument(self):
+        models = rank.readDirectory(self.models)
+        self.assertEqual(len(models), len(DOCS))
+        self.assertFalse([m for m in models if m.modelFile.strip().endswith('_all.model')])
+
+    def testDirectoryRanksAsIndex(self):
+        col = self.prefix + '_all.model'
+        terms = ['ebola', 'virus']
+        reports = []
+        for dir, indexFile in ((self.models, None), (None, self.prefix + '.index')):
+            models, index, colModel = rank.loadModels(dir, col, indexFile)
+            results, NR, ND = rank.rankLoaded(terms, models, index, colModel)
+            data = rank.reportData(terms, results, colModel, 10, NR, ND)
+            reports.append((NR, ND, [(r['modelFile'].strip(), r['probability']) for r in data['results']]))
+        self.assertEqual(reports[0][1], len(DOCS))
+        self.assertEqual(reports[0], reports[1])
+
+    def testModelsUnmappedOnceScored(self):
+        # A map holds a file descriptor, so a large directory would run out of them
+        models, index, colModel = rank.loadModels(self.models, self.prefix + '_all.model')
+        for phrase in (False, True):
+            rank.rankLoaded(['ebola', 'virus'], models, index, colModel, phrase=phrase)
+            self.assertEqual([model.buf for model in models], [None] * len(DOCS))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,78 @@
+""" Tests of rankserver.py reloading models rebuilt while it answers queries.
+
+    Run from the repository root with: python -m unittest discover -s tests
+"""
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import genModel
+import rankserver
+
+DOCS = [
+    "http://a\n2014\nfirst\nthe ebola virus\nebola spreads\n",
+    "http://b\n2014\nsecond\nthe measles virus\n",
+    "http://c\n2014\nthird\nebola virus outbreak\n",
+]
+
+class TestRebuild(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.docs = os.path.join(self.tmp, 'docs')
+        self.models = os.path.join(self.tmp, 'models')
+        os.mkdir(self.docs)
+        os.mkdir(self.models)
+        self.prefix = os.path.join(self.models, 'articles')
+        self.build(DOCS)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def build(self, docs):
+        for i, text in enumerate(docs):
+            file = open(os.path.join(self.docs, 'doc_{0}.txt'.format(i)), 'w')
+            file.write(text)
+            file.close()
+        genModel.modeBoth(self.docs, self.prefix, index=True)
+        genModel.writeGeneration(self.prefix)
+
+    def service(self, index):
+        col = self.prefix + '_all.model'
+        if index:
+            return rankserver.RankService(None, col, self.prefix + '.index', checkInterval=0)
+        return rankserver.RankService(self.models, col, checkInterval=0)
+
+    def checkRebuild(self, index):
+        service = self.service(index)
+        before = service.query(['ebola'])
+        self.assertEqual(before['total'], len(DOCS))
+
+        # A query still running over the first build while the models are rebuilt
+        old = service.acquire()
+        self.build(DOCS + ["http://d\n2014\nfourth\nebola in the news\n"])
+        after = service.query(['ebola'])
+        self.assertEqual(after['total'], len(DOCS) + 1)
+        self.assertTrue(old.retired)
+
+        # The old build's files are still the ones it mapped, until its last query ends
+        self.assertEqual(service.rank(old, ['ebola'], 0.5, 10, False), before)
+        service.release(old)
+        self.assertRaises(ValueError, lambda: old.colModel.buf[0])
+        if index:
+            self.assertRaises(ValueError, lambda: old.index.buf[0])
+        else:
+            self.assertEqual([model.buf for model in old.models], [None] * len(DOCS))
+
+    def testRebuildIndex(self):
+        self.checkRebuild(index=True)
+
+    def testRebuildDirectory(self):
+        self.checkRebuild(index=False)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,73 @@
+""" Tests of vocab.py id-keyed models over a directory of text model files.
+
+    Run from the repository root with: python -m unittest discover -s tests
+"""
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import genModel
+import rank
+
+# 'zebra' only ever ends a line, so it is never a unigram, only the second word of bigrams
+DOCS = [
+    "http://a\n2014\nfirst\nthe ebola zebra\nvirus spreads to the zebra\n",
+    "http://b\n2014\nsecond\nthe measles virus\nthe zebra\n",
+    "http://c\n2014\nthird\nebola virus outbreak\n",
+]
+
+class TestIdFeatureSetBigrams(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        docs = os.path.join(self.tmp, 'docs')
+        self.models = os.path.join(self.tmp, 'models')
+        os.mkdir(docs)
+        os.mkdir(self.models)
+        for i, text in enumerate(DOCS):
+            file = open(os.path.join(docs, 'doc_{0}.txt'.format(i)), 'w')
+            file.write(text)
+            file.close()
+        genModel.modeEach(docs, os.path.join(self.models, 'articles'), binary=False)
+
+        # Without a vocabulary file, words are only known once a model naming them is read
+        os.remove(os.path.join(self.models, 'articles.vocab'))
+        os.remove(os.path.join(self.models, 'articles.manifest'))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def fullModels(self):
+        names = sorted(n for n in os.listdir(self.models) if n.endswith('.model'))
+        return [rank.readModel(os.path.join(self.models, n)) for n in names]
+
+    def testWordOnlySecondInBigrams(self):
+        models = rank.readDirectory(self.models)
+        for model, full in zip(models, self.fullModels()):
+            expected = full.getBigram('the', 'zebra')
+            bigram, found = model.getBigram('the', 'zebra')
+            self.assertEqual(found, expected[1])
+            self.assertEqual(bigram.count, expected[0].count)
+        self.assertTrue(models[0].getBigram('ebola', 'zebra')[1])
+
+    def testEveryBigramAgreesWithFullRead(self):
+        # Each model freshly read, so no lookup benefits from bigrams read before it
+        full = self.fullModels()
+        pairs = set()
+        for model in full:
+            for unigram in model.words.itervalues():
+                for bigram in unigram.bigrams.itervalues():
+                    pairs.add((bigram.word1, bigram.word2))
+        for word1, word2 in sorted(pairs):
+            models = rank.readDirectory(self.models)
+            for model, expected in zip(models, full):
+                bigram, found = model.getBigram(word1, word2)
+                self.assertEqual(found, expected.getBigram(word1, word2)[1], (word1, word2, model.modelFile))
+                self.assertEqual(bigram.count, expected.getBigram(word1, word2)[0].count)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,301 @@
+#!/usr/bin/python2.7
+# vocab.py
+# Jeremy Johnston
+
+""" Vocabulary of a model directory, and loaded text models keyed by its integer word ids.
+
+    A FeatureSet keys its unigrams by word, and each Bigram holds both its words again,
+    so a directory of loaded models stores each common word thousands of times. A
+    Vocabulary gives every word of the directory one id, and an IdFeatureSet holds a model
+    as packed arrays of those ids, counts and probabilities, sharing the one vocabulary.
+
+    genModel.py -i writes the vocabulary of the models it builds to <modelFilePrefix>.vocab.
+    Ids are given in order of first appearance, so they stay valid as genModel.py -u
+    adds documents.
+
+    What uses these ids, and what does not:
+
+        rank.readDirectory() keeps each text model of a directory as an IdFeatureSet over
+        the directory's vocabulary. This is where the memory is saved.
+        Binary models, the default format, are mapped instead. Their word ids are the
+        file's own, see binmodel.py. Term ids of a term table are positions among the
+        sorted collection words, see termtable.py. Neither is a vocabulary id.
+        genModel.py counts, merges and subtracts models as word-keyed FeatureSets. It
+        only writes the vocabulary.
+
+    Layout (little endian), built on the binmodel.py section helpers:
+
+        header          magic, version, nWords, section offsets
+        word strings    string table of the nWords words, in id order
+"""
+
+import os
+import mmap
+import struct
+import array
+from bisect import bisect_left
+from binmodel import writeStrings, readStrings, replaceFile
+from genModel import Unigram, Bigram, FeatureSet
+
+MAGIC = 'ALBV'
+VERSION = 1
+
+# magic, version, nWords, then 2 section offsets
+HEADER = struct.Struct('<4sII2Q')
+
+class Vocabulary():
+    """ Integer id of each word of the corpus
+    """
+
+    def __init__(self, words=()):
+        self.words = []     # word of each id
+        self.ids = {}       # id of each word
+        for word in words:
+            self.addWord(word)
+
+    def __len__(self):
+        return len(self.words)
+
+    def find(self, word):
+        """ Return id of word, or -1 if not in the vocabulary
+        """
+        return self.ids.get(word, -1)
+
+    def addWord(self, word):
+        """ Return id of word, giving it the next id if new
+        """
+        i = self.ids.get(word)
+        if i is None:
+            i = len(self.words)
+            self.ids[word] = i
+            self.words.append(word)
+        return i
+
+    def add(self, modelFile, model):
+        """ Add every word of model, as genModel.py builds it to modelFile
+        """
+        words = set(model.words.iterkeys())
+        for unigram in model.words.itervalues():
+            words.update(unigram.bigrams.iterkeys())
+        for word in sorted(words):
+            self.addWord(word)
+
+    def merge(self, other):
+        """ Add the words of another Vocabulary, in its id order
+        """
+        for word in other.words:
+            self.addWord(word)
+
+    def write(self, fileName):
+        # Written aside and moved into place, see binmodel.replaceFile()
+        tempName = fileName + '.tmp'
+        try:
+            file = open(tempName, 'wb')
+            file.write('\0' * HEADER.size)
+            offsets = writeStrings(file, self.words)
+            file.seek(0)
+            file.write(HEADER.pack(MAGIC, VERSION, len(self.words), *offsets))
+            file.close()
+            replaceFile(tempName, fileName)
+        except:
+            print 'ERROR writing vocabulary file {0}'.format(fileName)
+            raise
+
+def readVocabulary(fileName):
+    file = open(fileName, 'rb')
+    try:
+        fields = HEADER.unpack(file.read(HEADER.size))
+        if fields[0] != MAGIC:
+            raise ValueError('{0} is not a vocabulary file'.format(fileName))
+        if fields[1] != VERSION:
+            raise ValueError('{0} has vocabulary version {1}, expected {2}'.format(fileName, fields[1], VERSION))
+        buf = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    finally:
+        file.close()
+    try:
+        return Vocabulary(readStrings(buf, fields[3], fields[4], fields[2]))
+    finally:
+        buf.close()
+
+def findVocabulary(dir):
+    """ Return the Vocabulary written to model directory dir by genModel.py, or None if there is not one
+    """
+    names = [n for n in os.listdir(dir) if n.endswith('.vocab')]
+    if len(names) != 1:
+        return None
+    return readVocabulary(os.path.join(dir, names[0]))
+
+class IdWords():
+    """ Read-only stand-in for FeatureSet.words over an IdFeatureSet, as binmodel.MappedWords is
+    """
+
+    def __init__(self, model):
+        self.model = model
+
+    def __len__(self):
+        return len(self.model.uniIds)
+
+    def __contains__(self, word):
+        return self.model.findUnigram(word) >= 0
+
+    def __getitem__(self, word):
+        i = self.model.findUnigram(word)
+        if i < 0:
+            raise KeyError(word)
+        return self.model.unigramAt(i)
+
+    def get(self, word, default=None):
+        i = self.model.findUnigram(word)
+        if i < 0:
+            return default
+        return self.model.unigramAt(i)
+
+    def iterkeys(self):
+        words = self.model.vocab.words
+        for i in self.model.uniIds:
+            yield words[i]
+
+    __iter__ = iterkeys
+
+    def keys(self):
+        return list(self.iterkeys())
+
+    def itervalues(self):
+        for i in xrange(len(self.model.uniIds)):
+            yield self.model.unigramAt(i)
+
+    def values(self):
+        return list(self.itervalues())
+
+    def iteritems(self):
+        for unigram in self.itervalues():
+            yield unigram.word, unigram
+
+    def items(self):
+        return list(self.iteritems())
+
+class IdFeatureSet(FeatureSet):
+    """ FeatureSet held as arrays keyed by the word ids of a Vocabulary shared by a directory's models.
+
+        Unigram i of the model has word id uniIds[i], ascending, and its bigrams are
+        entries [biRows[i], biRows[i + 1]) of the bigram arrays, ascending by the word id
+        of word2. Lookups are a dict lookup of the word id, then a binary search of ints.
+        Words of the model not yet in the vocabulary are added to it.
+
+        Given the bigramOffset rank.readTextModel() returns for a model read without its
+        bigrams, the bigrams are read from the model file the first time one is needed.
+        The model is read-only; use FeatureSet.update() to copy it into a FeatureSet to
+        modify it.
+    """
+
+    def __init__(self, vocab, model=None, bigramOffset=None):
+        FeatureSet.__init__(self, polarity=1)
+        self.vocab = vocab
+        self.bigramOffset = bigramOffset    # of the bigrams of modelFile still unread, or None
+        self.uniIds = array.array('I')
+        self.uniCounts = array.array('I')
+        self.uniProbs = array.array('d')
+        self.biRows = array.array('I', [0])
+        self.biCols = array.array('I')
+        self.biCounts = array.array('I')
+        self.biProbs = array.array('d')
+
+        if model is not None:
+            self.polarity = model.polarity
+            self.numTokens = model.numTokens
+            self.originFile = model.originFile
+            self.modelFile = model.modelFile
+            self.link = model.link
+            self.date = model.date
+            self.title = model.title
+
+            for i, unigram in sorted((vocab.addWord(u.word), u) for u in model.words.itervalues()):
+                self.uniIds.append(i)
+                self.uniCounts.append(unigram.count)
+                self.uniProbs.append(unigram.probability)
+                for j, bigram in sorted((vocab.addWord(b.word2), b) for b in unigram.bigrams.itervalues()):
+                    self.biCols.append(j)
+                    self.biCounts.append(bigram.count)
+                    self.biProbs.append(bigram.probability)
+                self.biRows.append(len(self.biCols))
+
+        self.words = IdWords(self)
+
+    def findId(self, wordId):
+        """ Return position of unigram with word id wordId, or -1 if not in model
+        """
+        i = bisect_left(self.uniIds, wordId)
+        if i < len(self.uniIds) and self.uniIds[i] == wordId:
+            return i
+        return -1
+
+    def findUnigram(self, word):
+        """ Return position of unigram word, or -1 if not in model
+        """
+        wordId = self.vocab.find(word)
+        if wordId < 0:
+            return -1
+        return self.findId(wordId)
+
+    def loadBigrams(self):
+        """ Read the bigrams of the model file, if still unread
+        """
+        if self.bigramOffset is None:
+            return
+        import rank
+        rows = {}
+        for bigram in rank.readBigrams(self.modelFile, self.bigramOffset):
+            rows.setdefault(self.findUnigram(bigram.word1), []).append((self.vocab.addWord(bigram.word2), bigram))
+
+        biRows, biCols, biCounts, biProbs = array.array('I', [0]), array.array('I'), array.array('I'), array.array('d')
+        for i in xrange(len(self.uniIds)):
+            for j, bigram in sorted(rows.get(i, ())):
+                biCols.append(j)
+                biCounts.append(bigram.count)
+                biProbs.append(bigram.probability)
+            biRows.append(len(biCols))
+        self.biRows, self.biCols, self.biCounts, self.biProbs = biRows, biCols, biCounts, biProbs
+        self.bigramOffset = None
+
+    def findBigram(self, i, wordId):
+        """ Return position of the bigram of unigram i with word2 id wordId, or -1
+        """
+        self.loadBigrams()
+        start, end = self.biRows[i], self.biRows[i + 1]
+        j = bisect_left(self.biCols, wordId, start, end)
+        if j < end and self.biCols[j] == wordId:
+            return j
+        return -1
+
+    def unigramAt(self, i):
+        self.loadBigrams()
+        words = self.vocab.words
+        word = words[self.uniIds[i]]
+        unigram = Unigram(word, self.uniCounts[i], self.uniProbs[i])
+        for j in xrange(self.biRows[i], self.biRows[i + 1]):
+            word2 = words[self.biCols[j]]
+            unigram.bigrams[word2] = Bigram(word, word2, self.biCounts[j], self.biProbs[j])
+        return unigram
+
+    def getUnigram(self, word1):
+        """ Return a pair (unigram, boolFound). The unigram returned holds no bigrams, see getBigram().
+        """
+        i = self.findUnigram(word1)
+        if i < 0:
+            return Unigram("NULL_DNE", 0, 0), False
+        return Unigram(word1, self.uniCounts[i], self.uniProbs[i]), True
+
+    def getBigram(self, word1, word2):
+        """ Return a pair (bigram, boolFound)
+        """
+        i = self.findUnigram(word1)
+        if i >= 0:
+            # Reading the bigrams adds their second words to the vocabulary, so read them
+            # before looking up word2, which may be in no other model read so far
+            self.loadBigrams()
+            wordId = self.vocab.find(word2)
+            if wordId >= 0:
+                j = self.findBigram(i, wordId)
+                if j >= 0:
+                    return Bigram(word1, word2, self.biCounts[j], self.biProbs[j]), True
+        return Bigram("NULL_DNE", "NULL_DNE", 0, 0), False